@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+import src.data.instrument as instrument
+
+RULES = ['historical', 'population', 'fixed']
+
+# an aggregate entity and the components it is split into or rolled up from
+#   aggregate:  name of the aggregate row, e.g. 'Belgium/Luxembourg'
+#   components: names of the component rows
+#   rule:       how a split aggregate is shared out: 'historical' (the components' share of
+#               their combined quantities), 'population' (their share of population in each
+#               year) or 'fixed' (ratios)
+#   ratios:     component shares for the fixed rule, in component order
+#   since:      first year of the history the historical rule is taken over
+Rule = namedtuple(
+    'Rule', ['aggregate', 'components', 'rule', 'ratios', 'since'],
+    defaults=['historical', None, None]
+)
+
+
+def pairs(rules):
+    """ (aggregate, component) table of a list of rules
+        rules: list of Rule
+    """
+    return (pd.DataFrame(
+        [(r.aggregate, c) for r in rules for c in r.components],
+        columns=['aggregate', 'component']
+    ))
+
+
+def historical_shares(df, rules, country, year, measures):
+    """ Each component's share of its aggregate's measures over the years every component
+        reported, for all historical rules at once
+        df: table of component rows
+        rules: list of historical Rule
+        country, year: key columns of df
+        measures: measure columns to share
+
+        returns DataFrame of aggregate, component and one share column per measure
+    """
+    aggregate_of = {c: r.aggregate for r in rules for c in r.components}
+    size = {r.aggregate: len(r.components) for r in rules}
+    since = {r.aggregate: -np.inf if r.since is None else r.since for r in rules}
+
+    x = df.loc[df[country].isin(list(aggregate_of)), [country, year] + measures]
+    x = x.assign(
+        component=x[country].astype(object),
+        aggregate=x[country].astype(object).map(aggregate_of)
+    )
+    x = x.loc[x[year].to_numpy() >= x['aggregate'].map(since).to_numpy()]
+
+    # keep a year only where every component of its aggregate reported the measure
+    reported = x.groupby(['aggregate', year])[measures].transform('count')
+    complete = reported.eq(x['aggregate'].map(size).to_numpy()[:, None])
+    values = x[measures].where(complete)
+
+    sums = values.groupby([x['aggregate'], x['component']]).sum()
+    totals = sums.groupby(level='aggregate').transform('sum')
+    out = (sums / totals).reset_index()
+
+    # the last component takes the remainder, so every aggregate is shared out exactly
+    last = out['component'].eq(out['aggregate'].map({r.aggregate: r.components[-1] for r in rules}))
+    others = out.loc[~last].groupby('aggregate')[measures].sum()
+    out.loc[last, measures] = \
+        1 - others.reindex(out.loc[last, 'aggregate']).fillna(0).to_numpy()
+    return (out)
+
+
+def population_shares(rules, population, year, column='population_mid'):
+    """ Each component's share of its aggregate's population in every year
+        rules: list of population Rule
+        population: population table (country, year and the population column)
+        year: name the year column is given
+        column: population measure shared by
+    """
+    x = pairs(rules).merge(population, left_on='component', right_on='country')
+    x['share'] = x[column] / x.groupby(['aggregate', 'year'])[column].transform('sum')
+    return (x.rename(columns={'year': year})[['aggregate', 'component', year, 'share']])
+
+
+def fixed_shares(rules):
+    """ Component shares given by each fixed rule's ratios
+        rules: list of fixed Rule
+    """
+    return (pd.DataFrame(
+        [(r.aggregate, c, s) for r in rules for c, s in zip(r.components, r.ratios)],
+        columns=['aggregate', 'component', 'share']
+    ))
+
+
+def shares(df, rules, country, year, measures, population=None):
+    """ Component shares of every rule, one column per measure
+        df: table holding the component rows (for historical rules)
+        rules: list of Rule
+        country, year: key columns of df
+        measures: measure columns to share
+        population: population table (for population rules)
+
+        returns a list of share tables; population tables also carry the year
+    """
+    unknown = {r.rule for r in rules} - set(RULES)
+    if unknown:
+        raise ValueError(f'Unrecognized apportionment rules: {sorted(unknown)}')
+    by_rule = {name: [r for r in rules if r.rule == name] for name in RULES}
+
+    def per_measure(table):
+        return (table.assign(**{m: table['share'] for m in measures}).drop(columns='share'))
+
+    tables = []
+    if by_rule['historical']:
+        tables.append(historical_shares(df, by_rule['historical'], country, year, measures))
+    if by_rule['population']:
+        if population is None:
+            raise ValueError('population rules need a population table')
+        tables.append(per_measure(population_shares(by_rule['population'], population, year)))
+    if by_rule['fixed']:
+        tables.append(per_measure(fixed_shares(by_rule['fixed'])))
+    return (tables)
+
+
+@instrument.instrumented
+def split(df, rules, measures, country='country', year='calendar_year', population=None):
+    """ Share aggregate rows out to their components and drop them, for every aggregate and
+        measure in one pass
+        df: table with country, year and measure columns
+        rules: list of Rule
+        measures: measure columns to split
+        country, year: key columns
+        population: population table, for population rules
+
+        components keep the values they report; only their missing values are filled from
+        the aggregate
+    """
+    aggregates = [r.aggregate for r in rules]
+    parts = df.loc[df[country].isin(aggregates), [country, year] + measures]
+    parts = parts.assign(aggregate=parts[country].astype(object)).drop(columns=country)
+
+    calc = []
+    for table in shares(df, rules, country, year, measures, population):
+        on = ['aggregate', year] if year in table.columns else ['aggregate']
+        x = parts.merge(table, on=on, suffixes=['', '_share'])
+        shared = x[measures].to_numpy() * x[[f'{m}_share' for m in measures]].to_numpy()
+        calc.append(pd.DataFrame(shared, columns=measures).assign(
+            component=x['component'].to_numpy(), **{year: x[year].to_numpy()}
+        ))
+    if not calc:
+        return (df)
+    calc = pd.concat(calc).set_index(['component', year])[measures]
+
+    keys = pd.MultiIndex.from_arrays([df[country].astype(object), df[year]])
+    filled = calc.reindex(keys).to_numpy()
+    current = df[measures].to_numpy(dtype='float64')
+    out = df.assign(**{
+        m: np.where(np.isnan(current[:, i]), filled[:, i], current[:, i])
+        for i, m in enumerate(measures)
+    })
+    return (out.loc[~out[country].isin(aggregates)].reset_index(drop=True))
+
+
+@instrument.instrumented
+def rollup(df, rules, measures, country='country', keys=('year',)):
+    """ Aggregate rows summed from their components, for every aggregate in one grouped pass
+        df: table with country, key and measure columns
+        rules: list of Rule
+        measures: measure columns to sum
+        country: country column
+        keys: columns the sums are grouped by besides the aggregate
+
+        returns the aggregate rows only, in rule order
+    """
+    keys = list(keys)
+    x = pairs(rules).merge(df, left_on='component', right_on=country)
+    x['aggregate'] = pd.Categorical(x['aggregate'], categories=[r.aggregate for r in rules])
+    out = \
+        x \
+        .groupby(['aggregate'] + keys, observed=True)[measures] \
+        .sum() \
+        .reset_index()
+    out['aggregate'] = out['aggregate'].astype(object)
+    return (out.rename(columns={'aggregate': country})[[country] + keys + measures])
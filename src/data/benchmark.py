@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+import click
+import glob
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+import src.data.etl_functions as f
+import src.data.ico_sheet as ico_sheet
+import src.data.ingest as ingest
+import src.data.pipeline as pipeline
+import src.data.schema as schema
+import src.data.stages as stages
+import src.data.synthetic as synthetic
+
+SCALES = [1, 10, 100, 1000]
+
+# producer workbooks and the measure each is processed into
+PRODUCER_MEASURES = {
+    'gross_opening_stocks': 'openstock',
+    'total_production': 'production',
+    'domestic_consumption': 'consumption',
+    'exports_crop_year': 'exports'
+}
+
+
+def measure(fn, repeat=3):
+    """ Best wall time of `repeat` calls, then the traced peak memory of one more call
+        fn: function of no arguments
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return ({'seconds': best, 'peak_bytes': peak})
+
+
+def targets(raw, external, work_dir):
+    """ Benchmarked steps over a synthetic release, by name
+        raw, external: folders written by synthetic.generate
+        work_dir: scratch folder for pipeline outputs
+
+        the process_* and stock targets start from parsed sheets, so they time the
+        transformation alone; reshape_melt and reshape_unpivot compare the wide frame + melt
+        path with ico_sheet.unpivot on the producer sheets; the pipeline_<target> runs
+        (make_dataset --only) reuse the outputs of the full pipeline run, and cli_startup
+        times make_dataset --help
+    """
+    files = ingest.source_files(raw)
+    sheets = {name: ingest.parse_workbook(path, name) for name, path in files.items()}
+    region_map = pipeline.region_map_frame(pipeline.MEMBER_REGIONS)
+    producer = pipeline.producer_frame(*[
+        f.process_producer(sheets[name], measure, 'crop_year')
+        for name, measure in PRODUCER_MEASURES.items()
+    ])
+
+    def run_pipeline():
+        shutil.rmtree(work_dir, ignore_errors=True)
+        for folder in ['interim', 'processed']:
+            os.makedirs(f'{work_dir}/{folder}')
+        stages.run_stages(
+            pipeline.build_stages(), raw, external, f'{work_dir}/interim',
+            f'{work_dir}/processed', f'{work_dir}/cache', force=True, workbook_cache=False
+        )
+
+    def run_target(target):
+        stages.run_stages(
+            pipeline.build_stages(), raw, external, f'{work_dir}/interim',
+            f'{work_dir}/processed', f'{work_dir}/cache', force=True, workbook_cache=False,
+            only=set(pipeline.TARGETS[target])
+        )
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'make_dataset.py')
+
+    return ({
+        'parse_workbooks': lambda: [
+            ingest.parse_workbook(path, name) for name, path in files.items()
+        ],
+        'process_producer': lambda: [
+            f.process_producer(sheets[name], measure, 'crop_year')
+            for name, measure in PRODUCER_MEASURES.items()
+        ],
+        'process_producer_calendar_year': lambda: f.process_producer(
+            sheets['exports_calendar_year'], 'exports', 'calendar_year'
+        ),
+        'process_importer': lambda: [
+            f.process_importer(sheets[name], name, region_map, splits=pipeline.IMPORTER_SPLITS)
+            for name in ['imports', 're_exports']
+        ],
+        'process_nonmember': lambda: [
+            f.process_nonmember(sheets[f'non_member_{name}'], name)
+            for name in ['imports', 're_exports']
+        ],
+        'process_indicator_prices': lambda: f.process_indicator_prices(
+            sheets['indicator_prices']
+        ),
+        'process_grower_prices': lambda: f.process_grower_prices(
+            sheets['prices_paid_to_growers']
+        ),
+        'reshape_melt': lambda: [
+            schema.compact(
+                ico_sheet.to_frame(sheets[name], 'country', 'harvest_group')
+                .melt(id_vars=['country', 'harvest_group'], var_name='crop_year',
+                      value_name=f'{measure}_1k_bags')
+            )
+            for name, measure in PRODUCER_MEASURES.items()
+        ],
+        'reshape_unpivot': lambda: [
+            schema.compact(f.long_table(sheets[name], 'country', 'harvest_group', 'crop_year',
+                                        f'{measure}_1k_bags'))
+            for name, measure in PRODUCER_MEASURES.items()
+        ],
+        'stock_calcs': lambda: f.stock_calcs(producer),
+        'pipeline': run_pipeline,
+        **{
+            f'pipeline_{target}': (lambda target=target: run_target(target))
+            for target in pipeline.TARGETS
+        },
+        'cli_startup': lambda: subprocess.run(
+            [sys.executable, script, '--help'], check=True, stdout=subprocess.DEVNULL
+        )
+    })
+
+
+def run_benchmarks(scales, work_dir, repeat=3, seed=0):
+    """ Time and memory-profile every target on synthetic releases at each scale
+        scales: multiples of the real release size
+        work_dir: folder synthetic releases are generated into and reused from
+        repeat: timed calls per target; the best is kept
+        seed: random seed of the synthetic releases
+
+        returns a DataFrame with one row per scale and target
+    """
+    rows = []
+    for scale in scales:
+        folder = f'{work_dir}/scale-{scale}-seed-{seed}'
+        if not os.path.exists(f'{folder}/raw'):
+            synthetic.generate(folder, scale, seed)
+        raw, external = f'{folder}/raw', f'{folder}/external'
+        for name, fn in targets(raw, external, f'{folder}/run').items():
+            result = measure(fn, repeat)
+            rows.append({'scale': scale, 'target': name, **result})
+            click.echo(
+                f"{scale:>5}x {name:<32} {result['seconds']:10.4f}s "
+                f"{result['peak_bytes'] / 2 ** 20:10.1f} MiB"
+            )
+    return (pd.DataFrame(rows))
+
+
+def commit_id():
+    """ Short id of the checked out commit, marked -dirty when the tree has changes
+    """
+    try:
+        out = subprocess.run(
+            ['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+            check=True
+        )
+        return (out.stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return ('unknown')
+
+
+def save_results(results, path, repeat):
+    """ Store benchmark results with the commit and environment they were measured on
+        results: DataFrame returned by run_benchmarks
+        path: json file
+        repeat: timed calls per target
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    payload = {
+        'commit': commit_id(),
+        'created': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'repeat': repeat,
+        'results': results.to_dict(orient='records')
+    }
+    with open(path, 'w') as fh:
+        json.dump(payload, fh, indent=2)
+
+
+def load_results(path):
+    """ Benchmark results stored by save_results, as a DataFrame
+    """
+    with open(path) as fh:
+        return (pd.DataFrame(json.load(fh)['results']))
+
+
+def compare(current, baseline, threshold=0.25, min_seconds=0.05):
+    """ Targets that got slower or bigger than a baseline
+        current, baseline: DataFrames of benchmark results
+        threshold: relative increase flagged as a regression
+        min_seconds: slowdowns smaller than this are timer noise, not regressions
+
+        returns the joined results with time and memory ratios and a regression flag
+    """
+    joined = current.merge(baseline, on=['scale', 'target'], suffixes=['', '_baseline'])
+    joined['time_ratio'] = joined['seconds'] / joined['seconds_baseline']
+    joined['memory_ratio'] = joined['peak_bytes'] / joined['peak_bytes_baseline']
+    slower = \
+        (joined['time_ratio'] > 1 + threshold) \
+        & (joined['seconds'] - joined['seconds_baseline'] > min_seconds)
+    joined['regression'] = slower | (joined['memory_ratio'] > 1 + threshold)
+    return (joined)
+
+
+def latest_results(folder, exclude=None):
+    """ Most recent results file in a folder, other than `exclude`
+    """
+    paths = [
+        p for p in glob.glob(f'{folder}/*.json')
+        if exclude is None or os.path.abspath(p) != os.path.abspath(exclude)
+    ]
+    return (max(paths, key=os.path.getmtime) if paths else None)
+
+
+@click.command()
+@click.option('--scales', default='1,10,100', help='comma-separated scales out of 1,10,100,1000')
+@click.option('--repeat', default=3, help='timed calls per target')
+@click.option('--seed', default=0, help='random seed of the synthetic releases')
+@click.option('--work-dir', default='data/benchmark', type=click.Path(),
+              help='folder synthetic releases are generated into')
+@click.option('--results-dir', default='reports/benchmarks', type=click.Path(),
+              help='folder results are stored in, one file per commit')
+@click.option('--baseline', default=None, type=click.Path(exists=True),
+              help='results file to compare against (default: the latest stored)')
+@click.option('--threshold', default=0.25, help='relative slowdown flagged as a regression')
+def main(scales, repeat, seed, work_dir, results_dir, baseline, threshold):
+    """ Benchmark the ETL functions and the pipeline on synthetic ICO releases
+    """
+    logging.getLogger().setLevel(logging.WARNING)
+    scales = [int(s) for s in scales.split(',')]
+    if not set(scales) <= set(SCALES):
+        raise click.BadParameter(f'scales must be among {SCALES}', param_hint='--scales')
+    results = run_benchmarks(scales, work_dir, repeat, seed)
+    path = f'{results_dir}/{commit_id()}.json'
+    baseline = baseline or latest_results(results_dir, exclude=path)
+    save_results(results, path, repeat)
+    click.echo(f'results stored in {path}')
+
+    if baseline is None:
+        return
+    report = compare(results, load_results(baseline), threshold)
+    click.echo(f'compared with {baseline}:')
+    click.echo(
+        report[['scale', 'target', 'seconds', 'seconds_baseline', 'time_ratio',
+                'memory_ratio', 'regression']]
+        .to_string(index=False, float_format=lambda v: f'{v:.3f}')
+    )
+    if report['regression'].any():
+        raise click.ClickException(f"{int(report['regression'].sum())} regressions")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+import src.data.instrument as instrument
+import src.data.schema as schema
+import src.data.units as units
+
+# how one joined table is rolled up
+#   dimensions: key columns rows are grouped by, each on its own (e.g. region, ico_member)
+#   year:       integer year column
+#   population: population column per-capita rates are computed from
+#   measures:   bag measures summed (stored as '<measure>_1k_bags')
+CubeSpec = namedtuple('CubeSpec', ['dimensions', 'year', 'population', 'measures'])
+
+# dimension holding the whole table as one group, the denominator of world_share
+WORLD = 'world'
+WORLD_GROUP = 'World'
+
+# columns of the cube, one row per (table, dimension, group, year, measure) holding data
+#   countries:     rows summed
+#   population:    population of the summed rows that have one
+#   per_capita_kg: kg per person over the rows that have a population
+#   world_share:   share of the table's total for the year and measure
+CUBE_COLUMNS = [
+    'table', 'dimension', 'group', 'year', 'measure', 'countries', 'total_1k_bags',
+    'population', 'per_capita_kg', 'world_share'
+]
+
+
+def group_codes(df, dimensions):
+    """ Integer group of every row under each dimension, numbered across the dimensions
+        df: table with the dimension columns
+        dimensions: dimension columns; WORLD puts every row in one group
+
+        categorical columns are numbered by their codes, without hashing their values
+
+        returns ((rows x dimensions) array of group numbers, -1 for a missing key;
+                 dimension of each group; label of each group)
+    """
+    codes = np.empty((len(df), len(dimensions)), dtype='int64')
+    owners = []
+    labels = []
+    for j, dim in enumerate(dimensions):
+        if dim == WORLD:
+            dim_codes, names = np.zeros(len(df), dtype='int64'), [WORLD_GROUP]
+        elif isinstance(df[dim].dtype, pd.CategoricalDtype):
+            dim_codes, names = df[dim].cat.codes.to_numpy(), df[dim].cat.categories
+        else:
+            dim_codes, names = pd.factorize(df[dim].astype(object), sort=True)
+        codes[:, j] = np.where(dim_codes >= 0, dim_codes + len(labels), -1)
+        owners += [dim] * len(names)
+        labels += list(names)
+    return (codes, owners, labels)
+
+
+@instrument.instrumented
+def rollup(table, df, spec):
+    """ Sums, per-capita rates and world shares of a table's measures by every dimension and
+        year, in one grouped pass
+        table: table name
+        df: joined table (e.g. producer_cropyear)
+        spec: CubeSpec
+
+        rows are coded once as integer (group, year) cells and every measure of every
+        dimension is summed by a single bincount over those cells
+    """
+    dimensions = list(spec.dimensions) + [WORLD]
+    codes, owners, labels = group_codes(df, dimensions)
+    year_codes, years = pd.factorize(df[spec.year].to_numpy().astype('int64'), sort=True)
+    values = np.column_stack([
+        df.units.get(measure, units.CANONICAL).to_numpy(dtype='float64')
+        for measure in spec.measures
+    ])
+    population = df[spec.population].to_numpy(dtype='float64')
+
+    # (rows x dimensions x measures) cell of every value; rows with a missing key or value
+    # are masked out of the sums
+    n_years, n_measures = len(years), len(spec.measures)
+    cells = (codes * n_years + year_codes[:, None])[:, :, None] * n_measures \
+        + np.arange(n_measures)
+    counted = (codes >= 0)[:, :, None] & np.isfinite(values)[:, None, :]
+    covered = counted & np.isfinite(population)[:, None, None]
+    shape = (len(labels), n_years, n_measures)
+
+    def sums(mask, *weights):
+        index = cells[mask]
+        return ([
+            np.bincount(
+                index, None if w is None else np.broadcast_to(w, mask.shape)[mask],
+                np.prod(shape)
+            ).reshape(shape)
+            for w in weights
+        ])
+
+    total, count = sums(counted, values[:, None, :], None)
+    covered_total, covered_population = \
+        sums(covered, values[:, None, :], population[:, None, None])
+    world = total[owners.index(WORLD)]
+
+    group, year, measure = np.nonzero(count)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        per_capita = units.convert(covered_total, 'kg') / covered_population
+        share = total / world
+    cube = pd.DataFrame({
+        'table': table,
+        'dimension': pd.Categorical.from_codes(
+            [dimensions.index(owners[g]) for g in group], categories=dimensions
+        ),
+        'group': np.array(labels, dtype=object)[group],
+        'year': years[year],
+        'measure': pd.Categorical.from_codes(measure, categories=list(spec.measures)),
+        'countries': count[group, year, measure].astype('int64'),
+        'total_1k_bags': total[group, year, measure],
+        'population': covered_population[group, year, measure],
+        'per_capita_kg': np.where(covered_population[group, year, measure] > 0,
+                                  per_capita[group, year, measure], np.nan),
+        'world_share': share[group, year, measure]
+    })
+    return (cube)
+
+
+@instrument.instrumented
+def build(tables, specs):
+    """ Rollup cube of several joined tables, ordered by table, dimension, group, year and
+        measure
+        tables: dict of table name -> joined table
+        specs: dict of table name -> CubeSpec
+    """
+    cube = pd.concat(
+        [rollup(name, tables[name], spec) for name, spec in specs.items()], ignore_index=True
+    )
+    for col in ['table', 'dimension', 'group', 'measure']:
+        cube[col] = pd.Categorical(cube[col], categories=list(dict.fromkeys(cube[col])))
+    return (schema.compact(cube[CUBE_COLUMNS]))
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+from datetime import datetime, timezone
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# table recording the content hash, columns and keys each table was last synced with
+META_TABLE = '_tables'
+STAGING_TABLE = '_staging'
+
+
+def connect(path):
+    """ Open an embedded database file: DuckDB for '.duckdb' files, SQLite otherwise
+        path: database file
+    """
+    if str(path).endswith('.duckdb'):
+        import duckdb
+
+        return (duckdb.connect(str(path)))
+    import sqlite3
+
+    # autocommit, so sync controls the transactions
+    return (sqlite3.connect(str(path), isolation_level=None))
+
+
+def quote(name):
+    """ Quoted SQL identifier
+    """
+    return ('"' + str(name).replace('"', '""') + '"')
+
+
+def sql_type(dtype):
+    """ Column type of a pandas dtype
+    """
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return ('INTEGER')
+    if pd.api.types.is_float_dtype(dtype):
+        return ('DOUBLE')
+    return ('TEXT')
+
+
+def records(df):
+    """ Rows of a table as tuples of plain Python values, None for missing values
+        df: pandas DataFrame
+    """
+    values = df.astype(object).where(df.notna(), None)
+    return (list(values.itertuples(index=False, name=None)))
+
+
+def column_definitions(df):
+    """ Column definitions of a table
+    """
+    return (', '.join(f'{quote(c)} {sql_type(t)}' for c, t in df.dtypes.items()))
+
+
+def read_meta(conn):
+    """ dict of table -> {'hash', 'columns', 'keys'} of the synced tables
+    """
+    conn.execute(
+        f'CREATE TABLE IF NOT EXISTS {META_TABLE} '
+        '(name TEXT PRIMARY KEY, hash TEXT, columns TEXT, keys TEXT, updated_at TEXT)'
+    )
+    rows = conn.execute(f'SELECT name, hash, columns, keys FROM {META_TABLE}').fetchall()
+    return ({
+        name: {'hash': h, 'columns': json.loads(columns), 'keys': json.loads(keys)}
+        for name, h, columns, keys in rows
+    })
+
+
+def create_table(conn, name, df, keys, indexes):
+    """ (Re)create a table with its primary key and secondary indexes
+        name: table name
+        df: table the columns are taken from
+        keys: primary key columns (empty for none)
+        indexes: lists of indexed columns
+    """
+    conn.execute(f'DROP TABLE IF EXISTS {quote(name)}')
+    primary = f', PRIMARY KEY ({", ".join(quote(k) for k in keys)})' if keys else ''
+    conn.execute(f'CREATE TABLE {quote(name)} ({column_definitions(df)}{primary})')
+    for columns in indexes:
+        conn.execute(
+            f'CREATE INDEX {quote(name + "_" + "_".join(columns))} ON {quote(name)} '
+            f'({", ".join(quote(c) for c in columns)})'
+        )
+
+
+def stage(conn, df, keys):
+    """ Load a table into the temporary staging table, indexed on its keys
+    """
+    conn.execute(f'DROP TABLE IF EXISTS {STAGING_TABLE}')
+    conn.execute(f'CREATE TEMP TABLE {STAGING_TABLE} ({column_definitions(df)})')
+    placeholders = ', '.join('?' for _ in df.columns)
+    conn.executemany(f'INSERT INTO {STAGING_TABLE} VALUES ({placeholders})', records(df))
+    if keys:
+        conn.execute(
+            f'CREATE INDEX {STAGING_TABLE}_keys ON {STAGING_TABLE} '
+            f'({", ".join(quote(k) for k in keys)})'
+        )
+
+
+def joined(left, right, keys):
+    """ Join condition matching two tables on their keys
+    """
+    return (' AND '.join(f'{left}.{quote(k)} = {right}.{quote(k)}' for k in keys))
+
+
+def upsert(conn, name, columns, keys):
+    """ Apply the staging table to a keyed table: insert new keys, update rows whose values
+        changed and delete keys that are gone
+        name: table name
+        columns: table columns
+        keys: primary key columns
+
+        returns dict of inserted, updated and deleted row counts
+    """
+    table = quote(name)
+    match = joined('s', 't', keys)
+    values = [c for c in columns if c not in keys]
+    differs = ' OR '.join(f't.{quote(c)} IS DISTINCT FROM s.{quote(c)}' for c in values)
+
+    def count(sql):
+        return (conn.execute(sql).fetchone()[0])
+
+    counts = {
+        'inserted': count(
+            f'SELECT COUNT(*) FROM {STAGING_TABLE} s '
+            f'WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE {match})'
+        ),
+        'updated': count(
+            f'SELECT COUNT(*) FROM {STAGING_TABLE} s JOIN {table} t ON {match} WHERE {differs}'
+        ) if values else 0,
+        'deleted': count(
+            f'SELECT COUNT(*) FROM {table} t '
+            f'WHERE NOT EXISTS (SELECT 1 FROM {STAGING_TABLE} s WHERE {match})'
+        )
+    }
+
+    cols = ', '.join(quote(c) for c in columns)
+    conflict = ', '.join(quote(k) for k in keys)
+    if values:
+        action = \
+            'DO UPDATE SET ' \
+            + ', '.join(f'{quote(c)} = excluded.{quote(c)}' for c in values) \
+            + ' WHERE ' \
+            + ' OR '.join(f'{table}.{quote(c)} IS DISTINCT FROM excluded.{quote(c)}'
+                          for c in values)
+    else:
+        action = 'DO NOTHING'
+    conn.execute(
+        f'INSERT INTO {table} ({cols}) SELECT {cols} FROM {STAGING_TABLE} s WHERE true '
+        f'ON CONFLICT ({conflict}) {action}'
+    )
+    conn.execute(
+        f'DELETE FROM {table} WHERE NOT EXISTS '
+        f'(SELECT 1 FROM {STAGING_TABLE} s WHERE {joined("s", table, keys)})'
+    )
+    return (counts)
+
+
+def replace(conn, name, columns):
+    """ Replace every row of an unkeyed table with the staging table
+    """
+    cols = ', '.join(quote(c) for c in columns)
+    deleted = conn.execute(f'SELECT COUNT(*) FROM {quote(name)}').fetchone()[0]
+    conn.execute(f'DELETE FROM {quote(name)}')
+    conn.execute(f'INSERT INTO {quote(name)} ({cols}) SELECT {cols} FROM {STAGING_TABLE}')
+    inserted = conn.execute(f'SELECT COUNT(*) FROM {quote(name)}').fetchone()[0]
+    return ({'inserted': inserted, 'updated': 0, 'deleted': deleted})
+
+
+def sync_table(conn, name, df, content_hash, keys=None, indexes=None):
+    """ Bring one database table up to date with an output table
+        conn: open connection
+        name: table name
+        df: output table, as written to files (units expanded)
+        content_hash: content hash of the table as written, units expanded (see
+                      stages.output_hash); an unchanged hash skips the table
+        keys: primary key columns; tables without keys are replaced whole
+        indexes: lists of columns given secondary indexes
+
+        the table is recreated when its columns or keys change
+    """
+    keys = list(keys or [])
+    meta = read_meta(conn).get(name)
+    if meta is not None and meta['hash'] == content_hash:
+        return (None)
+
+    df = df.reset_index(drop=True)
+    df.columns = [str(c) for c in df.columns]
+    columns = list(df.columns)
+    if meta is None or meta['columns'] != columns or meta['keys'] != keys:
+        create_table(conn, name, df, keys, indexes or [])
+    stage(conn, df, keys)
+    counts = upsert(conn, name, columns, keys) if keys else replace(conn, name, columns)
+    conn.execute(f'DROP TABLE IF EXISTS {STAGING_TABLE}')
+    conn.execute(f'DELETE FROM {META_TABLE} WHERE name = ?', [name])
+    conn.execute(
+        f'INSERT INTO {META_TABLE} VALUES (?, ?, ?, ?, ?)',
+        [name, content_hash, json.dumps(columns), json.dumps(keys),
+         datetime.now(timezone.utc).isoformat()]
+    )
+    return (counts)
+
+
+def sync(path, hashes, load, keys=None, indexes=None):
+    """ Upsert the tables whose content changed into an embedded database file
+        path: database file (see connect)
+        hashes: dict of table name -> content hash of the table as written (see sync_table)
+        load: function of a table name returning its output table, units expanded
+        keys: dict of table name -> primary key columns
+        indexes: dict of table name -> lists of indexed columns
+
+        returns dict of table name -> inserted/updated/deleted counts of the tables written
+    """
+    keys = keys or {}
+    indexes = indexes or {}
+    conn = connect(path)
+    try:
+        stored = read_meta(conn)
+        written = {}
+        for name, content_hash in hashes.items():
+            if stored.get(name, {}).get('hash') == content_hash:
+                continue
+            conn.execute('BEGIN')
+            try:
+                written[name] = sync_table(
+                    conn, name, load(name), content_hash, keys.get(name), indexes.get(name)
+                )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            logger.info('database table %s: %s', name, written[name])
+    finally:
+        conn.close()
+    return (written)
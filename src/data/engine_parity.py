@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import click
+import logging
+import time
+import pandas as pd
+import src.data.ingest as ingest
+import src.data.pipeline as pipeline
+import src.data.synthetic as synthetic
+
+
+def cases(sheets, region_map):
+    """ ETL calls compared between engines, by name: (function name, arguments)
+        sheets: dict of variable type -> parsed sheet
+        region_map: member region table (see pipeline.region_map_frame)
+    """
+    out = {}
+    for name, measure in [('gross_opening_stocks', 'openstock'),
+                          ('total_production', 'production'),
+                          ('domestic_consumption', 'consumption'),
+                          ('exports_crop_year', 'exports')]:
+        out[name] = ('process_producer', (sheets[name], measure, 'crop_year'))
+        out[f'{name} fixed point'] = \
+            ('process_producer', (sheets[name], measure, 'crop_year', True))
+    out['exports_calendar_year'] = \
+        ('process_producer', (sheets['exports_calendar_year'], 'exports', 'calendar_year'))
+    for name in ['imports', 're_exports']:
+        out[name] = ('process_importer',
+                     (sheets[name], name, region_map, False, pipeline.IMPORTER_SPLITS))
+        out[f'{name} fixed point'] = \
+            ('process_importer', (sheets[name], name, region_map, True, pipeline.IMPORTER_SPLITS))
+        out[f'non_member_{name}'] = ('process_nonmember', (sheets[f'non_member_{name}'], name))
+    out['indicator_prices'] = ('process_indicator_prices', (sheets['indicator_prices'],))
+    out['prices_paid_to_growers'] = \
+        ('process_grower_prices', (sheets['prices_paid_to_growers'],))
+    return (out)
+
+
+def timed(fn, *args):
+    """ Result and wall time of a call
+    """
+    start = time.perf_counter()
+    out = fn(*args)
+    return (out, time.perf_counter() - start)
+
+
+def check_parity(raw, engine='polars', baseline='pandas'):
+    """ Run every ETL call of a raw workbook folder on two engines and compare the results
+        raw: raw workbook folder
+        engine, baseline: engines compared (see pipeline.ENGINES)
+
+        returns a DataFrame with one row per call: whether the tables are identical (values,
+        dtypes, categories and row order), the first difference and both run times
+    """
+    files = ingest.source_files(raw)
+    sheets = {name: ingest.parse_workbook(path, name) for name, path in files.items()}
+    region_map = pipeline.region_map_frame(pipeline.MEMBER_REGIONS)
+    rows = []
+    for name, (fn, args) in cases(sheets, region_map).items():
+        expected, baseline_s = timed(getattr(pipeline.ENGINES[baseline], fn), *args)
+        actual, engine_s = timed(getattr(pipeline.ENGINES[engine], fn), *args)
+        try:
+            pd.testing.assert_frame_equal(expected, actual, check_exact=True)
+            difference = None
+        except AssertionError as e:
+            difference = str(e).strip().splitlines()[0]
+        rows.append({
+            'case': name,
+            'identical': difference is None,
+            f'{baseline}_s': baseline_s,
+            f'{engine}_s': engine_s,
+            'difference': difference
+        })
+    return (pd.DataFrame(rows))
+
+
+@click.command()
+@click.option('--raw', 'raw_filepath', default='data/raw', type=click.Path(),
+              help='raw workbook folder to compare on')
+@click.option('--scales', default='',
+              help='also compare on synthetic releases at these comma-separated scales')
+@click.option('--work-dir', default='data/benchmark', type=click.Path(),
+              help='folder synthetic releases are generated into')
+@click.option('--engine', type=click.Choice(list(pipeline.ENGINES)), default='polars',
+              help='engine checked against the pandas engine')
+def main(raw_filepath, scales, work_dir, engine):
+    """ Check that an etl engine returns exactly the pandas engine's tables
+    """
+    folders = {'raw': raw_filepath}
+    for scale in [int(s) for s in scales.split(',') if s]:
+        folder = f'{work_dir}/scale-{scale}-seed-0'
+        folders[f'{scale}x'] = synthetic.generate(folder, scale)[0]
+
+    failed = 0
+    for label, raw in folders.items():
+        report = check_parity(raw, engine)
+        click.echo(f'{label}:')
+        click.echo(report.drop(columns='difference').to_string(
+            index=False, float_format=lambda v: f'{v:.4f}'
+        ))
+        for row in report.loc[~report['identical']].itertuples():
+            click.echo(f'  {row.case}: {row.difference}')
+        failed += int((~report['identical']).sum())
+    if failed:
+        raise click.ClickException(f'{failed} calls differ from the pandas engine')
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.WARNING)
+    main()
@@ -1,43 +1,45 @@
 # -*- coding: utf-8 -*-
 import pandas as pd
 import numpy as np
+import src.data.apportion as apportion
+import src.data.ico_sheet as ico_sheet
+import src.data.instrument as instrument
+import src.data.schema as schema
+import src.data.units as units
+
+
+def long_table(sheet, label_name, group_name, var_name, value_name, columns=None):
+    """ Long table of a parsed sheet, key columns as categoricals (see ico_sheet.to_long)
+        sheet: ico_sheet.SheetBlock
+        label_name, group_name: names for the row label and group columns
+        var_name, value_name: names for the header and value columns
+        columns: names for the value columns (default: the sheet headers)
+    """
+    return (ico_sheet.to_long(sheet, label_name, group_name, var_name, value_name, columns,
+                              schema.CATEGORY_COLUMNS))
+
+
+def crop_year_begin(crop_year):
+    """ First calendar year of each crop year ('1990/91' -> 1990), parsed once per category
+        crop_year: categorical Series of crop years
+    """
+    begin = crop_year.cat.categories.str[0:4].astype('int').to_numpy()
+    return (begin[crop_year.cat.codes.to_numpy()])
 
 
-def process_producer(df, var_name, time_name):
+@instrument.instrumented
+def process_producer(sheet, var_name, time_name, fixed_point=False):
     """ Processes producer data
-        df: pandas DataFrame containing raw producer data
+        sheet: ico_sheet.SheetBlock of the raw producer workbook
         var_name:   variable name to process (production, consumption, openstock, or exports)
         time:name:  crop_year or calendar_year
+        fixed_point: store bag quantities as scaled integers
     """
-    x = df
-    x.columns = x.iloc[2, :]
-    x = x.iloc[3:(x.shape[0]-1), :]
-    x = x.dropna(how='all')
-    x = x.loc[:, x.columns.notna()]
-    x.rename(
-        columns={'Crop year': 'country', 'Crop years': 'country', 'Calendar years': 'country'},
-        inplace=True)
-    x = x.melt(id_vars='country', var_name=time_name, value_name=f'{var_name}_1k_bags')
-    x['country'] = x['country'].str.strip()
-    x[f'{var_name}_1k_bags'] = x[f'{var_name}_1k_bags'].astype('float', errors='ignore')
-    x[f'{var_name}_kg'] = x[f'{var_name}_1k_bags'] * 1000 * 60
-    x[f'{var_name}_lb'] = x[f'{var_name}_kg'] * 2.20462262185
-    harvest_groups = ['April group', 'July group', 'October group']
-    totals = ['Total']
-    x['harvest_group'] = \
-        np.where(
-            x['country'].isin(harvest_groups),
-            x['country'].str.replace(r' [Gg]roup', '', regex=True),
-            np.NaN
-        )
-    x['harvest_group'] = x['harvest_group'].ffill()
+    x = long_table(sheet, 'country', 'harvest_group', time_name, f'{var_name}_1k_bags')
+    x = schema.compact(x)
     if time_name == 'crop_year':
-        x['crop_year_beg'] = x['crop_year'].str[0:4].astype('int')
+        x['crop_year_beg'] = crop_year_begin(x['crop_year'])
         x['crop_year_end'] = x['crop_year_beg']+1
-    hg_rows = x.iloc[:, 0].isin(harvest_groups)
-    tot_rows = x.iloc[:, 0].isin(totals)
-    x = x.loc[~(hg_rows | tot_rows)]
-    if time_name == 'crop_year':
         x = x[
                 [
                     'country',
@@ -45,9 +47,7 @@ def process_producer(df, var_name, time_name):
                     'crop_year',
                     'crop_year_beg',
                     'crop_year_end',
-                    f'{var_name}_1k_bags',
-                    f'{var_name}_kg',
-                    f'{var_name}_lb'
+                    f'{var_name}_1k_bags'
                 ]
             ]
     else:
@@ -55,103 +55,28 @@ def process_producer(df, var_name, time_name):
                 [
                     'country',
                     'calendar_year',
-                    f'{var_name}_1k_bags',
-                    f'{var_name}_kg',
-                    f'{var_name}_lb'
+                    f'{var_name}_1k_bags'
                 ]
             ]
-    return (x)
+    return (schema.compact(x, fixed_point))
 
 
-def process_importer(df, var_name, region_map):
+@instrument.instrumented
+def process_importer(sheet, var_name, region_map, fixed_point=False, splits=()):
     """ Processes importer data
-        df: pandas DataFrame containing raw importer data
+        sheet: ico_sheet.SheetBlock of the raw importer workbook
         var_name:   variable name to process (imports, re_exports)
         region_map:  pandas DataFrame containing regions to map
+        fixed_point: store bag quantities as scaled integers
+        splits: apportion.Rule list of jointly reported countries to split, e.g.
+                Belgium/Luxembourg
     """
-    x = df
-    x.columns = x.iloc[2, :]
-    x = x.iloc[3:(x.shape[0]-1), :]
-    x = x.dropna(how='all')
-    x.rename(columns={'Calendar years': 'country'}, inplace=True)
-    x = x.melt(id_vars='country', var_name='calendar_year', value_name=f'{var_name}_1k_bags')
-    x['country'] = x['country'].str.strip()
-    x[f'{var_name}_1k_bags'] = x[f'{var_name}_1k_bags'].astype('float', errors='ignore')
-    eu = ['European Union']
-    eu_rows = x.iloc[:, 0].isin(eu)
-    totals = ['Total']
-    tot_rows = x.iloc[:, 0].isin(totals)
-    x = x.loc[~(eu_rows | tot_rows)]
+    x = long_table(sheet, 'country', None, 'calendar_year', f'{var_name}_1k_bags')
+    x = schema.compact(x)
+    x, region_map = schema.unify([x, region_map], ['country'])
     x = x.merge(region_map, how='left', on='country')
     x['ico_member'] = 'member'
-
-    mask = x.country.isin(['Belgium']) & (x.calendar_year >= 1999)
-    B = x.loc[mask, ['calendar_year', f'{var_name}_1k_bags']]
-
-    mask = x.country.isin(['Luxembourg']) & (x.calendar_year >= 1999)
-    L = x.loc[mask, ['calendar_year', f'{var_name}_1k_bags']]
-
-    BL = \
-        B \
-        .merge(L, how='left', on='calendar_year', suffixes=['_B', '_L']) \
-        .assign(
-            tot=lambda x: x[f'{var_name}_1k_bags_B'] + x[f'{var_name}_1k_bags_L'],
-            B_ratio=lambda x: x[f'{var_name}_1k_bags_B']/x.tot
-        )
-
-    belg_ratio = BL[f'{var_name}_1k_bags_B'].sum() / BL.tot.sum()
-
-    calced_split = \
-        x \
-        .loc[
-            lambda x: x.country.isin(['Belgium/Luxembourg']),
-            ['calendar_year', f'{var_name}_1k_bags']
-        ] \
-        .assign(
-            **{
-                f'{var_name}_1k_bags_B': lambda x: x[f'{var_name}_1k_bags'] * belg_ratio,
-                f'{var_name}_1k_bags_L': lambda x: x[f'{var_name}_1k_bags'] * (1-belg_ratio)
-            }
-        )
-
-    B = calced_split[['calendar_year', f'{var_name}_1k_bags_B']] \
-        .assign(country='Belgium') \
-        .rename(columns={f'{var_name}_1k_bags_B': f'{var_name}_1k_bags'})
-
-    L = calced_split[['calendar_year', f'{var_name}_1k_bags_L']] \
-        .assign(country='Luxembourg') \
-        .rename(columns={f'{var_name}_1k_bags_L': f'{var_name}_1k_bags'})
-
-    BL = pd.concat([B, L]) \
-        .reset_index(drop=True) \
-        .loc[:, ['calendar_year', 'country', f'{var_name}_1k_bags']]
-
-    x = \
-        x \
-        .merge(BL, how='left', on=['calendar_year', 'country'], suffixes=['', '_calc']) \
-        .assign(
-            **{
-                f'{var_name}_1k_bags':
-                lambda x: np.where(
-                    x[f'{var_name}_1k_bags'].isna(),
-                    x[f'{var_name}_1k_bags_calc'],
-                    x[f'{var_name}_1k_bags']
-                )
-            }
-        ) \
-        .loc[
-            lambda x: ~x.country.isin(['Belgium/Luxembourg']),
-            [
-                'region',
-                'country',
-                'ico_member',
-                'calendar_year',
-                f'{var_name}_1k_bags'
-            ]
-        ]
-
-    x[f'{var_name}_kg'] = x[f'{var_name}_1k_bags'] * 1000 * 60
-    x[f'{var_name}_lb'] = x[f'{var_name}_kg'] * 2.20462262185
+    x = apportion.split(x, list(splits), [f'{var_name}_1k_bags'])
 
     col_order = \
         [
@@ -159,124 +84,136 @@ def process_importer(df, var_name, region_map):
             'country',
             'ico_member',
             'calendar_year',
-            f'{var_name}_1k_bags',
-            f'{var_name}_kg',
-            f'{var_name}_lb'
+            f'{var_name}_1k_bags'
         ]
 
     x = x[col_order]
 
-    return (x)
+    return (schema.compact(x, fixed_point))
 
 
-def process_nonmember(df, var_name):
+@instrument.instrumented
+def process_nonmember(sheet, var_name, fixed_point=False):
     """ Processes non-member importer data
-        df: pandas DataFrame containing raw importer data
+        sheet: ico_sheet.SheetBlock of the raw non-member workbook
         var_name:   variable name to process (imports, re_exports)
+        fixed_point: store bag quantities as scaled integers
     """
-    x = df
-    x.columns = x.iloc[2, :]
-    x = x.iloc[3:129, :]
-    x = x.dropna(how='all')
-    x.rename(columns={'Calendar years': 'country'}, inplace=True)
-    x = x.melt(id_vars='country', var_name='calendar_year', value_name=f'{var_name}_1k_bags')
-    x['country'] = x['country'].str.strip()
-    x[f'{var_name}_1k_bags'] = x[f'{var_name}_1k_bags'].astype('float', errors='ignore')
-    x[f'{var_name}_kg'] = x[f'{var_name}_1k_bags'] * 1000 * 60
-    x[f'{var_name}_lb'] = x[f'{var_name}_kg'] * 2.20462262185
-    china_agg = x.iloc[:, 0].isin(["China, People's Republic of"])
-    x = x[~china_agg]
-    regions = \
-        [
-            'Africa',
-            'Asia & Oceania',
-            'Caribbean',
-            'Central America & Mexico',
-            'Europe',
-            'North America',
-            'South America'
-        ]
-    totals = ['Total']
-    x['region'] = np.where(x['country'].isin(regions), x['country'], np.NaN)
-    x['region'] = x['region'].ffill()
+    x = long_table(sheet, 'country', 'region', 'calendar_year', f'{var_name}_1k_bags')
+    x = schema.compact(x)
     x['ico_member'] = 'non-member'
-    region_rows = x.iloc[:, 0].isin(regions)
-    tot_rows = x.iloc[:, 0].isin(totals)
-    x = x.loc[~(region_rows | tot_rows)]
     col_order = \
         [
             'region',
             'country',
             'ico_member',
             'calendar_year',
-            f'{var_name}_1k_bags',
-            f'{var_name}_kg',
-            f'{var_name}_lb'
+            f'{var_name}_1k_bags'
         ]
     x = x[col_order]
-    return (x)
+    return (schema.compact(x, fixed_point))
 
 
-# calculated closing stock equals opening stock plus production, less consumption and exports
-def close_stock_calc(df, scale):
-    """ Rollforward Closing Stock as opening stock plus production, less consumption and exports
-        df: pandas DataFrame
-        scale: scale for calculation (1k_bags, kg, lb)
+def indicator_columns(sheet):
+    """ Snake-case indicator names of an indicator price sheet's value columns
+        sheet: ico_sheet.SheetBlock
     """
-    return (
-        np.fmax(
-            0,
-            np.round(
-                df[f'openstock_{scale}']
-                + df[f'production_{scale}']
-                - df[f'consumption_{scale}']
-                - df[f'exports_{scale}'],
-                2
-            )
-        )
-    )
+    return ([
+        str(col).replace('\n', '').replace(' ', '_').lower() for col in sheet.columns
+    ])
 
 
-# calculate assumed imports needed to take closing stock to 0
-def producer_imports(df, scale):
-    """ Rollforward Closing Stock as opening stock plus production, less consumption and exports
-        df: pandas DataFrame
-        scale: scale for calculation (1k_bags, kg, lb)
+@instrument.instrumented
+def process_indicator_prices(sheet):
+    """ Processes ICO indicator price data
+        sheet: ico_sheet.SheetBlock of raw monthly prices, grouped under annual average rows
     """
-    raw_close = \
-        np.round(
-                df[f'openstock_{scale}']
-                + df[f'production_{scale}']
-                - df[f'consumption_{scale}']
-                - df[f'exports_{scale}'],
-                2
-        )
-
-    return (
-        np.where(raw_close < 0, 0 - raw_close, 0)
+    columns = indicator_columns(sheet)
+    x = long_table(sheet, 'calendar_month', 'calendar_year', 'indicator_name',
+                   'indicator_price_cents_per_lb', columns)
+    x['indicator_price_dollars_per_lb'] = \
+        x['indicator_price_cents_per_lb'] / 100
+    avg_annual = ico_sheet.unpivot(
+        {'calendar_year': sheet.group_labels}, 'indicator_name', columns,
+        'indicator_price_cents_per_lb', sheet.group_values, schema.CATEGORY_COLUMNS
     )
+    avg_annual['indicator_price_dollars_per_lb'] = \
+        avg_annual['indicator_price_cents_per_lb'] / 100
+    x = x.merge(
+        avg_annual,
+        how='left',
+        on=['calendar_year', 'indicator_name'],
+        suffixes=['', '_ann']
+        )
+    x = x[
+            [
+                'calendar_year',
+                'calendar_month',
+                'indicator_name',
+                'indicator_price_cents_per_lb',
+                'indicator_price_dollars_per_lb',
+                'indicator_price_cents_per_lb_ann',
+                'indicator_price_dollars_per_lb_ann'
+            ]
+        ]
+    return (schema.compact(x))
 
 
-# closing stock based on time-shifted opening stocks
-def close_stock_shift(df, scale):
-    """ Calculate Closing Stock as next year's opening stock
-        df: pandas DataFrame
-        scale: scale for calculation (1k_bags, kg, lb)
+@instrument.instrumented
+def process_grower_prices(sheet):
+    """ Processes prices paid to growers data
+        sheet: ico_sheet.SheetBlock of the raw grower price workbook
     """
-    open_shift = \
-        df \
-        .groupby('country')[f'openstock_{scale}'] \
-        .shift(-1)
+    # indicator group names are cleaned once per sheet row, before they are repeated
+    names = {group: group.replace(' ', '_').lower() for group in set(sheet.groups)}
+    sheet = sheet._replace(
+        groups=np.array([names[group] for group in sheet.groups], dtype=object)
+    )
+    x = long_table(sheet, 'country', 'indicator_name', 'calendar_year',
+                   'price_paid_cents_per_lb')
+    x['price_paid_dollars_per_lb'] = x['price_paid_cents_per_lb'] / 100
+    x = x[
+            [
+                'country',
+                'indicator_name',
+                'calendar_year',
+                'price_paid_cents_per_lb',
+                'price_paid_dollars_per_lb'
+            ]
+        ]
+    return (schema.compact(x))
 
-    return (open_shift)
 
+# closing stock, assumed imports and stock adjustment on every scale in one pass
+@instrument.instrumented
+def stock_calcs(df):
+    """ Calculate closing stock, assumed imports and stock adjustment for every scale
 
-# stock adjustment -- difference between calculated and shifted closing stocks
-def stock_adj(df, scale):
-    """ Calculate stock adjustment as the difference between the
-        rollforward closing stock and the shifted closing stock
+        df: pandas DataFrame of canonical (1k_bags) producer quantities, sorted by
+            country and crop year
 
-        df: pandas DataFrame
-        scale: scale for calculation (1k_bags, kg, lb)
+        the kg and lb results are rounded on their own scale, so they are returned as
+        columns rather than converted from the 1k_bags result
     """
-    return (close_stock_shift(df, scale) - close_stock_calc(df, scale))
+    raw_close = \
+        np.round(
+            df.units.block('openstock')
+            + df.units.block('production')
+            - df.units.block('consumption')
+            - df.units.block('exports'),
+            2
+        )
+    close = np.fmax(0, raw_close)
+    imports = np.where(raw_close < 0, 0 - raw_close, 0)
+    open_shift = \
+        pd.DataFrame(df.units.block('openstock'), index=df.index) \
+        .groupby(df['country'].to_numpy()) \
+        .shift(-1) \
+        .to_numpy()
+    adj = open_shift - close
+
+    out = {}
+    for name, values in [('closestock', close), ('imports', imports), ('stock_adj', adj)]:
+        for i, scale in enumerate(units.SCALES):
+            out[f'{name}_{scale}'] = values[:, i]
+    return (pd.DataFrame(out, index=df.index))
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import src.data.apportion as apportion
+import src.data.etl_functions as etl_functions
+import src.data.instrument as instrument
+import src.data.schema as schema
+
+# the polars engine: the process_* functions of etl_functions as lazy polars query plans,
+# collected once at the end and returned as the same compact pandas tables
+
+
+def wide(sheet, label_name, group_name=None, columns=None):
+    """ Lazy wide frame of a parsed sheet: label (and group) columns followed by the values
+        sheet: ico_sheet.SheetBlock
+        label_name: name for the row label column
+        group_name: name for the group column (None leaves it out)
+        columns: names for the value columns (default: the sheet headers)
+    """
+    import polars as pl
+
+    data = {label_name: pl.Series(list(sheet.labels), dtype=pl.String)}
+    if group_name is not None:
+        data[group_name] = pl.Series(list(sheet.groups), dtype=pl.String)
+    for j, col in enumerate(columns or sheet.columns):
+        data[str(col)] = pl.Series(sheet.values[:, j], dtype=pl.Float64, nan_to_null=False)
+    return (pl.LazyFrame(data))
+
+
+def long(lf, sheet, id_vars, var_name, value_name):
+    """ Stack the value columns of a lazy wide frame, in the column-major order of pandas melt
+        lf: LazyFrame returned by wide
+        sheet: ico_sheet.SheetBlock the frame was built from
+        id_vars: label columns kept on every row
+        var_name, value_name: names of the header and value columns
+
+        integer headers (calendar years) are cast back to integers
+    """
+    import polars as pl
+
+    lf = lf.unpivot(index=id_vars, variable_name=var_name, value_name=value_name)
+    if all(isinstance(col, int) for col in sheet.columns):
+        lf = lf.with_columns(pl.col(var_name).cast(pl.Int64))
+    return (lf)
+
+
+def dollars(cents):
+    """ Dollar prices of a cents expression
+        cents: polars expression
+
+        polars divides by a literal as a multiplication by its reciprocal, which can differ
+        from pandas in the last bit; dividing through numpy keeps the two engines identical
+    """
+    return (np.divide(cents, 100))
+
+
+def collect(lf, fixed_point=False):
+    """ Run a lazy plan and apply the compact schema to the result
+        lf: LazyFrame
+        fixed_point: store bag quantities as scaled integers
+    """
+    return (schema.compact(lf.collect().to_pandas(), fixed_point))
+
+
+@instrument.instrumented
+def process_producer(sheet, var_name, time_name, fixed_point=False):
+    """ Processes producer data (see etl_functions.process_producer)
+        sheet: ico_sheet.SheetBlock of the raw producer workbook
+        var_name:   variable name to process (production, consumption, openstock, or exports)
+        time_name:  crop_year or calendar_year
+        fixed_point: store bag quantities as scaled integers
+    """
+    import polars as pl
+
+    value = f'{var_name}_1k_bags'
+    lf = long(wide(sheet, 'country', 'harvest_group'), sheet, ['country', 'harvest_group'],
+              time_name, value)
+    if time_name == 'crop_year':
+        beg = pl.col('crop_year').str.slice(0, 4).cast(pl.Int64)
+        lf = lf.select(
+            'country', 'harvest_group', 'crop_year',
+            beg.alias('crop_year_beg'), (beg + 1).alias('crop_year_end'), value
+        )
+    else:
+        lf = lf.select('country', 'calendar_year', value)
+    return (collect(lf, fixed_point))
+
+
+@instrument.instrumented
+def process_importer(sheet, var_name, region_map, fixed_point=False, splits=()):
+    """ Processes importer data (see etl_functions.process_importer)
+        sheet: ico_sheet.SheetBlock of the raw importer workbook
+        var_name:   variable name to process (imports, re_exports)
+        region_map:  pandas DataFrame containing regions to map
+        fixed_point: store bag quantities as scaled integers
+        splits: apportion.Rule list of jointly reported countries to split
+
+        the few aggregate rows are split by the shared pandas apportionment engine
+    """
+    import polars as pl
+
+    value = f'{var_name}_1k_bags'
+    regions = pl.LazyFrame({
+        'country': pl.Series(region_map['country'].astype(str).tolist(), dtype=pl.String),
+        'region': pl.Series(region_map['region'].astype(str).tolist(), dtype=pl.String)
+    })
+    lf = \
+        long(wide(sheet, 'country'), sheet, ['country'], 'calendar_year', value) \
+        .join(regions, on='country', how='left', maintain_order='left') \
+        .with_columns(pl.lit('member').alias('ico_member'))
+    x = apportion.split(lf.collect().to_pandas(), list(splits), [value])
+    x = x[['region', 'country', 'ico_member', 'calendar_year', value]]
+    return (schema.compact(x, fixed_point))
+
+
+@instrument.instrumented
+def process_nonmember(sheet, var_name, fixed_point=False):
+    """ Processes non-member importer data (see etl_functions.process_nonmember)
+        sheet: ico_sheet.SheetBlock of the raw non-member workbook
+        var_name:   variable name to process (imports, re_exports)
+        fixed_point: store bag quantities as scaled integers
+    """
+    import polars as pl
+
+    value = f'{var_name}_1k_bags'
+    lf = \
+        long(wide(sheet, 'country', 'region'), sheet, ['country', 'region'], 'calendar_year',
+             value) \
+        .select('region', 'country', pl.lit('non-member').alias('ico_member'), 'calendar_year',
+                value)
+    return (collect(lf, fixed_point))
+
+
+@instrument.instrumented
+def process_indicator_prices(sheet):
+    """ Processes ICO indicator price data (see etl_functions.process_indicator_prices)
+        sheet: ico_sheet.SheetBlock of raw monthly prices, grouped under annual average rows
+    """
+    import polars as pl
+
+    columns = etl_functions.indicator_columns(sheet)
+    cents = 'indicator_price_cents_per_lb'
+    monthly = long(
+        wide(sheet, 'calendar_month', 'calendar_year', columns), sheet,
+        ['calendar_month', 'calendar_year'], 'indicator_name', cents
+    )
+    annual = pl.LazyFrame({
+        'calendar_year': pl.Series(list(sheet.group_labels), dtype=pl.String),
+        **{col: pl.Series(sheet.group_values[:, j], dtype=pl.Float64, nan_to_null=False)
+           for j, col in enumerate(columns)}
+    }).unpivot(index='calendar_year', variable_name='indicator_name', value_name=cents)
+
+    def with_dollars(lf):
+        return (lf.with_columns(dollars(pl.col(cents)).alias('indicator_price_dollars_per_lb')))
+
+    lf = \
+        with_dollars(monthly) \
+        .join(with_dollars(annual), on=['calendar_year', 'indicator_name'], how='left',
+              suffix='_ann', maintain_order='left') \
+        .select(
+            'calendar_year', 'calendar_month', 'indicator_name', cents,
+            'indicator_price_dollars_per_lb', f'{cents}_ann', 'indicator_price_dollars_per_lb_ann'
+        )
+    return (collect(lf))
+
+
+@instrument.instrumented
+def process_grower_prices(sheet):
+    """ Processes prices paid to growers data (see etl_functions.process_grower_prices)
+        sheet: ico_sheet.SheetBlock of the raw grower price workbook
+    """
+    import polars as pl
+
+    cents = 'price_paid_cents_per_lb'
+    lf = \
+        long(wide(sheet, 'country', 'indicator_name'), sheet, ['country', 'indicator_name'],
+             'calendar_year', cents) \
+        .select(
+            'country',
+            pl.col('indicator_name').str.replace_all(' ', '_', literal=True).str.to_lowercase(),
+            'calendar_year',
+            cents,
+            dollars(pl.col(cents)).alias('price_paid_dollars_per_lb')
+        )
+    return (collect(lf))
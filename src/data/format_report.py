@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import click
+import glob
+import os
+import tempfile
+import time
+import pandas as pd
+import src.data.sinks as sinks
+from src.data.pipeline import PARTITIONS
+
+
+def disk_size(path):
+    """ Bytes used by a file or by every file below a directory
+    """
+    if os.path.isfile(path):
+        return (os.path.getsize(path))
+    return (sum(os.path.getsize(p) for p in glob.glob(f'{path}/**/*', recursive=True)
+                if os.path.isfile(p)))
+
+
+def load_seconds(path, fmt, columns=None, repeat=5):
+    """ Best of `repeat` load times for a table
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        sinks.read_table(path, fmt, columns=columns)
+        best = min(best, time.perf_counter() - start)
+    return (best)
+
+
+def compare_formats(csv_paths, compression='zstd'):
+    """ Size and load time of csv tables rewritten as parquet and arrow
+        csv_paths: csv files written by make_dataset
+        compression: parquet/arrow compression codec
+
+        returns a DataFrame with one row per table and format
+    """
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for csv_path in csv_paths:
+            name = os.path.basename(csv_path)[:-len('.csv')]
+            df = pd.read_csv(csv_path)
+            columns = list(df.columns[:2])
+            layouts = [('csv', None)] + [
+                (fmt, partition_cols) for fmt in sinks.FORMATS[1:]
+                for partition_cols in [None, PARTITIONS.get(name)]
+            ]
+            for fmt, partition_cols in layouts:
+                path = csv_path
+                if fmt != 'csv':
+                    path = sinks.table_path(f'{tmp}/{len(rows)}', name, fmt)
+                    sinks.write_table(df, path, fmt, partition_cols, compression)
+                rows.append({
+                    'table': name,
+                    'format': fmt,
+                    'partitioned': bool(partition_cols),
+                    'bytes': disk_size(path),
+                    'load_all_s': load_seconds(path, fmt),
+                    'load_2_cols_s': load_seconds(path, fmt, columns)
+                })
+    return (pd.DataFrame(rows))
+
+
+@click.command()
+@click.argument('csv_paths', nargs=-1, type=click.Path(exists=True))
+@click.option('--compression', default='zstd', help='parquet/arrow compression codec')
+def main(csv_paths, compression):
+    """ Compare size and load time of csv outputs against parquet and arrow ipc
+    """
+    report = compare_formats(csv_paths, None if compression == 'none' else compression)
+    click.echo(report.to_string(index=False, float_format=lambda v: f'{v:.4f}'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# schema Tableau reads extract tables from, and the table recording how each was last synced
+SCHEMA = 'Extract'
+META_TABLE = '_tables'
+
+# partition key of tables written without a partition column
+WHOLE_TABLE = 'all'
+
+
+def quote(*names):
+    """ Quoted (and dotted) Hyper identifier
+    """
+    from tableauhyperapi import escape_name
+
+    return ('.'.join(escape_name(str(name)) for name in names))
+
+
+def sql_type(dtype):
+    """ Column type of a pandas dtype
+    """
+    if pd.api.types.is_bool_dtype(dtype):
+        return ('BOOL')
+    if pd.api.types.is_integer_dtype(dtype):
+        return ('BIGINT')
+    if pd.api.types.is_float_dtype(dtype):
+        return ('DOUBLE PRECISION')
+    return ('TEXT')
+
+
+def column_types(df):
+    """ [column, type] pairs of a table
+    """
+    return ([[str(c), sql_type(t)] for c, t in df.dtypes.items()])
+
+
+def partition_hashes(df, partition=None):
+    """ Content hash of each partition of a table
+        df: table
+        partition: integer column the table is partitioned by (None: one partition)
+
+        returns a dict of partition value (as text) -> hash; row hashes are summed, so a
+        partition keeps its hash whatever order its rows come in
+    """
+    if not len(df):
+        return ({})
+    rows = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    if partition is None:
+        codes, values = np.zeros(len(df), dtype='int64'), [WHOLE_TABLE]
+    else:
+        codes, values = pd.factorize(df[partition].to_numpy().astype('int64'), sort=True)
+    counts = np.bincount(codes, minlength=len(values))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    sums = np.add.reduceat(rows[np.argsort(codes, kind='stable')], starts)
+    return ({str(v): f'{s:016x}-{n}' for v, s, n in zip(values, sums, counts)})
+
+
+def read_meta(conn):
+    """ dict of table -> {'hash', 'columns', 'partition', 'partitions'} of the synced tables
+    """
+    conn.execute_command(
+        f'CREATE TABLE IF NOT EXISTS {quote(META_TABLE)} (name TEXT, hash TEXT, '
+        'columns TEXT, partition TEXT, partitions TEXT, updated_at TEXT)'
+    )
+    rows = conn.execute_list_query(
+        f'SELECT name, hash, columns, partition, partitions FROM {quote(META_TABLE)}'
+    )
+    return ({
+        name: {
+            'hash': h,
+            'columns': json.loads(columns),
+            'partition': partition,
+            'partitions': json.loads(partitions)
+        }
+        for name, h, columns, partition, partitions in rows
+    })
+
+
+def write_meta(conn, name, content_hash, columns, partition, partitions):
+    """ Record the hash, columns and partition hashes a table was synced with
+    """
+    from tableauhyperapi import escape_string_literal
+
+    values = [
+        name, content_hash, json.dumps(columns), partition, json.dumps(partitions),
+        datetime.now(timezone.utc).isoformat()
+    ]
+    conn.execute_command(
+        f'DELETE FROM {quote(META_TABLE)} WHERE name = {escape_string_literal(name)}'
+    )
+    conn.execute_command(
+        f'INSERT INTO {quote(META_TABLE)} VALUES ('
+        + ', '.join('NULL' if v is None else escape_string_literal(v) for v in values) + ')'
+    )
+
+
+def create_table(conn, name, columns):
+    """ (Re)create an extract table
+        name: table name
+        columns: [column, type] pairs
+    """
+    table = quote(SCHEMA, name)
+    conn.execute_command(f'DROP TABLE IF EXISTS {table}')
+    conn.execute_command(
+        f'CREATE TABLE {table} ({", ".join(f"{quote(c)} {t}" for c, t in columns)})'
+    )
+
+
+def in_partitions(partition, values):
+    """ WHERE clause selecting the rows of some partitions ('' for a whole table)
+        partition: integer partition column, or None
+        values: partition values (as text)
+    """
+    if partition is None:
+        return ('')
+    return (f' WHERE {quote(partition)} IN ({", ".join(str(int(v)) for v in values)})')
+
+
+def insert(conn, name, df, scratch):
+    """ Bulk load rows into an extract table through a parquet file Hyper reads directly
+        name: table name
+        df: rows, in the table's column order
+        scratch: folder for the parquet file
+    """
+    from tableauhyperapi import escape_string_literal
+
+    if not len(df):
+        return (0)
+    path = os.path.join(scratch, f'{name}.parquet')
+    plain = df.astype({
+        col: object for col, dtype in df.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)
+    })
+    plain.to_parquet(path, index=False)
+    return (conn.execute_command(
+        f'INSERT INTO {quote(SCHEMA, name)} SELECT * FROM external({escape_string_literal(path)})'
+    ))
+
+
+def sync_table(conn, name, df, content_hash, partition=None, meta=None, scratch='.'):
+    """ Bring one extract table up to date with an output table
+        conn: open Hyper connection
+        name: table name
+        df: output table, as written to files (units expanded)
+        content_hash: content hash of the output
+        partition: integer column (a year) whose partitions are appended or replaced; tables
+                   without one are replaced whole
+        meta: how the table was last synced (see read_meta), or None
+        scratch: folder for bulk load files
+
+        partitions whose content changed are deleted and reloaded, new ones appended and
+        vanished ones deleted; the table is recreated when its columns or partition column
+        change
+
+        returns dict of appended/replaced/deleted partitions and inserted/deleted rows
+    """
+    df = df.reset_index(drop=True)
+    df.columns = [str(c) for c in df.columns]
+    columns = column_types(df)
+    parts = partition_hashes(df, partition)
+    if meta is None or meta['columns'] != columns or meta['partition'] != partition:
+        create_table(conn, name, columns)
+        meta = {'partitions': {}}
+    stored = meta['partitions']
+    changed = [p for p in parts if stored.get(p) != parts[p]]
+    gone = [p for p in stored if p not in parts]
+    replaced = [p for p in changed if p in stored]
+    deleted = 0
+    if replaced or gone:
+        deleted = conn.execute_command(
+            f'DELETE FROM {quote(SCHEMA, name)}{in_partitions(partition, replaced + gone)}'
+        )
+    rows = df if partition is None else df.loc[df[partition].astype('int64').isin(
+        [int(p) for p in changed]
+    )]
+    inserted = insert(conn, name, rows, scratch) if changed else 0
+    write_meta(conn, name, content_hash, columns, partition, parts)
+    return ({
+        'appended': len(changed) - len(replaced),
+        'replaced': len(replaced),
+        'deleted': len(gone),
+        'rows_inserted': inserted,
+        'rows_deleted': deleted
+    })
+
+
+def sync(path, hashes, load, partitions=None):
+    """ Write the tables whose content changed into a Tableau .hyper extract
+        path: extract file, created when missing
+        hashes: dict of table name -> content hash
+        load: function of a table name returning its output table
+        partitions: dict of table name -> integer partition column (see sync_table)
+
+        each table is updated in its own transaction through a local Hyper process; needs the
+        tableauhyperapi package
+
+        returns dict of table name -> partition and row counts of the tables written
+    """
+    from tableauhyperapi import Connection, CreateMode, HyperProcess, Telemetry
+
+    partitions = partitions or {}
+    written = {}
+    with HyperProcess(Telemetry.DO_NOT_SEND_USAGE_DATA_TO_TABLEAU,
+                      parameters={'log_config': ''}) as process, \
+            Connection(process.endpoint, str(path), CreateMode.CREATE_IF_NOT_EXISTS) as conn, \
+            tempfile.TemporaryDirectory() as scratch:
+        conn.catalog.create_schema_if_not_exists(SCHEMA)
+        stored = read_meta(conn)
+        for name, content_hash in hashes.items():
+            if stored.get(name, {}).get('hash') == content_hash:
+                continue
+            conn.execute_command('BEGIN TRANSACTION')
+            try:
+                written[name] = sync_table(
+                    conn, name, load(name), content_hash, partitions.get(name),
+                    stored.get(name), scratch
+                )
+                conn.execute_command('COMMIT')
+            except Exception:
+                conn.execute_command('ROLLBACK')
+                raise
+            logger.info('hyper table %s: %s', name, written[name])
+    return (written)
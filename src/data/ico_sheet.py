@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+import re
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+# row layout of an ICO sheet
+#   groups:      regex of group rows (harvest groups, regions, indicator categories, years)
+#   group_strip: regex removed from group labels to give the group name
+#   totals:      regex of total rows
+#   drop:        regex of aggregate rows that are neither data nor groups
+SheetSchema = namedtuple('SheetSchema', ['groups', 'group_strip', 'totals', 'drop'])
+
+# a parsed ICO sheet
+#   header:       label column header, e.g. 'Crop year'
+#   columns:      value column headers (years, crop years or indicator names)
+#   labels:       stripped label of each data row
+#   groups:       group name of each data row (None before the first group row)
+#   values:       float64 (data rows x columns) block
+#   group_labels: name of each group row
+#   group_values: float64 (group rows x columns) block, e.g. annual averages
+#   total_values: float64 (total rows x columns) block
+SheetBlock = namedtuple(
+    'SheetBlock',
+    ['header', 'columns', 'labels', 'groups', 'values',
+     'group_labels', 'group_values', 'total_values']
+)
+
+REGIONS = [
+    'Africa',
+    'Asia & Oceania',
+    'Caribbean',
+    'Central America & Mexico',
+    'Europe',
+    'North America',
+    'South America'
+]
+
+PRODUCER = SheetSchema(
+    groups=r'(April|July|October) [Gg]roup$', group_strip=r' [Gg]roup', totals=r'Total$', drop=None
+)
+MEMBER_IMPORTER = SheetSchema(
+    groups=None, group_strip=None, totals=r'Total$', drop=r'European Union$'
+)
+NON_MEMBER_IMPORTER = SheetSchema(
+    groups='(' + '|'.join(re.escape(r) for r in REGIONS) + ')$',
+    group_strip=None,
+    totals=r'Total$',
+    drop=re.escape("China, People's Republic of") + '$'
+)
+GROWER_PRICES = SheetSchema(
+    groups=r'(Colombian Milds|Other Milds|Brazilian Naturals|Robustas)$',
+    group_strip=None,
+    totals=r'Total$',
+    drop=None
+)
+INDICATOR_PRICES = SheetSchema(groups=r'[0-9]{4}', group_strip=None, totals=None, drop=None)
+
+# sheet layout of each raw workbook, by variable type
+SCHEMAS = {
+    'total_production': PRODUCER,
+    'domestic_consumption': PRODUCER,
+    'gross_opening_stocks': PRODUCER,
+    'exports_crop_year': PRODUCER,
+    'exports_calendar_year': PRODUCER,
+    'imports': MEMBER_IMPORTER,
+    're_exports': MEMBER_IMPORTER,
+    'non_member_imports': NON_MEMBER_IMPORTER,
+    'non_member_re_exports': NON_MEMBER_IMPORTER,
+    'prices_paid_to_growers': GROWER_PRICES,
+    'indicator_prices': INDICATOR_PRICES
+}
+
+
+def cell_value(cell):
+    """ Python value of a cell, converted the way pandas' excel reader does:
+        numeric cells become int when integral, strings are stripped and empty strings are None
+    """
+    value = cell.value
+    if isinstance(value, str):
+        value = value.strip()
+        if value == '':
+            return (None)
+    if cell.data_type == 'n' and value is not None:
+        value = float(value)
+        return (int(value) if value.is_integer() else value)
+    return (value)
+
+
+def to_number(value):
+    """ float of a value cell; labels and blanks become NaN
+    """
+    if value is None:
+        return (np.nan)
+    try:
+        return (float(value))
+    except (TypeError, ValueError):
+        return (np.nan)
+
+
+def header_value(value):
+    """ Column header with numeric years normalized to int, e.g. '1990' -> 1990
+    """
+    number = to_number(value)
+    if not np.isnan(number) and number.is_integer():
+        return (int(number))
+    return (value)
+
+
+def row_kind(schema, label):
+    """ Classify a sheet row by its label: 'total', 'drop', 'group' or 'data'
+        schema: SheetSchema of the sheet
+        label: row label (None for unlabelled rows)
+    """
+    if label is None:
+        return ('data')
+    text = str(label)
+    for kind, pattern in [('total', schema.totals), ('drop', schema.drop),
+                          ('group', schema.groups)]:
+        if pattern and re.match(pattern, text):
+            return (kind)
+    return ('data')
+
+
+def sheet_rows(ws):
+    """ Converted cell values of each row of a worksheet, up to the copyright footer
+        ws: openpyxl worksheet
+    """
+    for row in ws.iter_rows():
+        cells = [cell_value(cell) for cell in row]
+        if cells and isinstance(cells[0], str) and cells[0].startswith('©'):
+            return
+        yield (cells)
+
+
+def read_sheet(path, schema):
+    """ Parse the first sheet of an ICO workbook in a single read-only pass
+        path: excel file
+        schema: SheetSchema of the sheet
+
+        the header is the first row with at least two headed value columns; reading
+        stops at the copyright footer
+    """
+    import openpyxl
+
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = sheet_rows(wb.worksheets[0])
+        positions = []
+        for cells in rows:
+            positions = [i for i, v in enumerate(cells) if i > 0 and v is not None]
+            if len(positions) >= 2:
+                header, columns = cells[0], [header_value(cells[i]) for i in positions]
+                break
+        if len(positions) < 2:
+            raise ValueError(f'No header row found in {path}')
+
+        labels, groups, group_labels = [], [], []
+        parsed = {'data': [], 'group': [], 'total': [], 'drop': []}
+        group = None
+        for cells in rows:
+            cells = cells + [None] * (positions[-1] + 1 - len(cells))
+            numbers = [to_number(cells[i]) for i in positions]
+            if cells[0] is None and all(np.isnan(numbers)):
+                continue
+            kind = row_kind(schema, cells[0])
+            parsed[kind].append(numbers)
+            if kind == 'group':
+                group = re.sub(schema.group_strip or '^$', '', str(cells[0]))
+                group_labels.append(group)
+            elif kind == 'data':
+                labels.append(cells[0])
+                groups.append(group)
+    finally:
+        wb.close()
+
+    def block(values):
+        return (np.array(values, dtype='float64').reshape(len(values), len(positions)))
+
+    return (
+        SheetBlock(
+            header=header,
+            columns=columns,
+            labels=np.array(labels, dtype=object),
+            groups=np.array(groups, dtype=object),
+            values=block(parsed['data']),
+            group_labels=group_labels,
+            group_values=block(parsed['group']),
+            total_values=block(parsed['total'])
+        )
+    )
+
+
+def to_frame(sheet, label_name, group_name=None, columns=None):
+    """ Wide DataFrame of a parsed sheet: label (and group) columns followed by the values
+        sheet: SheetBlock
+        label_name: name for the row label column
+        group_name: name for the group column (None leaves it out)
+        columns: names for the value columns (default: the sheet headers)
+    """
+    data = {label_name: sheet.labels}
+    if group_name is not None:
+        data[group_name] = sheet.groups
+    x = pd.DataFrame(data)
+    values = pd.DataFrame(sheet.values, columns=columns or sheet.columns)
+    return (pd.concat([x, values], axis=1))
+
+
+def unpivot(ids, var_name, headers, value_name, values, categorical=()):
+    """ Long table of a (row x column) value block in the column-major row order of
+        DataFrame.melt, built straight from the block without a wide frame
+        ids: dict of id column -> label of each block row
+        var_name: name for the column holding the block's column headers
+        headers: header of each block column
+        value_name: name for the value column
+        values: 2-d array
+        categorical: id and header columns built as categoricals over their sorted labels
+
+        values are raveled column by column, labels tiled and headers repeated; categorical
+        columns tile their codes, so each distinct label is stored, and can be cleaned, once
+    """
+    n_rows, n_cols = values.shape
+
+    def column(name, labels, expand):
+        if name in categorical:
+            labels = pd.Categorical(labels)
+            return (pd.Categorical.from_codes(expand(labels.codes), labels.categories))
+        return (expand(np.asarray(labels)))
+
+    data = {
+        name: column(name, labels, lambda a: np.tile(a, n_cols)) for name, labels in ids.items()
+    }
+    data[var_name] = column(var_name, list(headers), lambda a: np.repeat(a, n_rows))
+    data[value_name] = values.ravel(order='F')
+    return (pd.DataFrame(data))
+
+
+def to_long(sheet, label_name, group_name, var_name, value_name, columns=None, categorical=()):
+    """ Long DataFrame of a parsed sheet, as to_frame followed by melt (see unpivot)
+        sheet: SheetBlock
+        label_name: name for the row label column
+        group_name: name for the group column (None leaves it out)
+        var_name: name for the column of value headers
+        value_name: name for the value column
+        columns: names for the value columns (default: the sheet headers)
+        categorical: columns built as categoricals
+    """
+    ids = {label_name: sheet.labels}
+    if group_name is not None:
+        ids[group_name] = sheet.groups
+    return (unpivot(ids, var_name, columns or sheet.columns, value_name, sheet.values,
+                    categorical))
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import glob
+import functools
+import hashlib
+import inspect
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import src.data.ico_sheet as ico_sheet
+
+logger = logging.getLogger(__name__)
+
+
+def source_files(input_filepath):
+    """ Map each raw ICO workbook to its variable type
+        input_filepath: directory containing the raw excel files
+
+        '1a - Total production.xlsx' is keyed as 'total_production'
+    """
+    files = {}
+    for path in sorted(glob.glob(f'{input_filepath}/*.xlsx')):
+        name = re.sub(r'^[0-9][a-z] - ', '', os.path.basename(path))
+        name = re.sub(r'\.xlsx$', '', name)
+        name = re.sub(r'\W{1,}', '_', name).lower()
+        files[name] = path
+    return (files)
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """ sha256 digest of a file's contents
+        path: file to hash
+        chunk_size: bytes read per iteration
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b''):
+            digest.update(chunk)
+    return (digest.hexdigest())
+
+
+@functools.lru_cache(maxsize=None)
+def parser_version():
+    """ Hash of the workbook parser's code; parsed sheets and stage keys follow parser changes
+    """
+    source = inspect.getsource(ico_sheet) + inspect.getsource(parse_workbook)
+    return (hashlib.sha256(source.encode('utf-8')).hexdigest())
+
+
+def parse_workbook(path, name=None):
+    """ Parse a single raw workbook
+        path: excel file to parse
+        name: variable type of the workbook
+
+        workbooks with a known ICO layout are streamed into an ico_sheet.SheetBlock; any
+        other workbook is read into an object-dtype DataFrame
+    """
+    if name in ico_sheet.SCHEMAS:
+        return (ico_sheet.read_sheet(path, ico_sheet.SCHEMAS[name]))
+    return (pd.read_excel(path))
+
+
+def read_workbooks(input_filepath, cache_dir=None, max_workers=None, names=None, hashes=None):
+    """ Read the raw workbooks, parsing cache misses concurrently
+        input_filepath: directory containing the raw excel files
+        cache_dir:  directory of parsed sheets keyed by content hash (None disables the cache)
+        max_workers: size of the process pool used for cache misses
+        names:  variable types to read (None reads every workbook)
+        hashes: precomputed content hashes by variable type
+
+        returns a dict of variable type -> parsed sheet (see parse_workbook)
+    """
+    files = source_files(input_filepath)
+    if names is not None:
+        files = {name: path for name, path in files.items() if name in names}
+    if not files:
+        return ({})
+    dfs = {}
+    misses = {}
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+
+    for name, path in files.items():
+        cache_path = None
+        if cache_dir is not None:
+            digest = hashes[name] if hashes and name in hashes else file_hash(path)
+            cache_path = os.path.join(cache_dir, f'{digest}-{name}-{parser_version()[:12]}.pkl')
+            if os.path.exists(cache_path):
+                dfs[name] = pd.read_pickle(cache_path)
+                continue
+        misses[name] = (path, cache_path)
+
+    if misses:
+        workers = min(len(misses), max_workers or os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parsed = pool.map(
+                parse_workbook, [path for path, _ in misses.values()], list(misses.keys())
+            )
+            for name, sheet in zip(misses.keys(), parsed):
+                dfs[name] = sheet
+                cache_path = misses[name][1]
+                if cache_path is not None:
+                    pd.to_pickle(sheet, cache_path)
+
+    logger.info(
+        'read %d workbooks: %d cache hits, %d cache misses',
+        len(files), len(files) - len(misses), len(misses)
+    )
+
+    return ({name: dfs[name] for name in files})
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+import contextlib
+import cProfile
+import functools
+import json
+import logging
+import threading
+import time
+import tracemalloc
+import pandas as pd
+import src.data.ico_sheet as ico_sheet
+
+logger = logging.getLogger(__name__)
+
+# recorder state: whether spans are kept and the kept records
+_state = {'enabled': False, 'tracing': False, 'records': []}
+
+# open spans, per thread, so stages run concurrently each nest their own calls
+_local = threading.local()
+
+
+def _stack():
+    """ Open spans of the calling thread, innermost last
+    """
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return (_local.stack)
+
+
+def enable(trace_memory=True):
+    """ Start recording spans, dropping any recorded before
+        trace_memory: trace peak memory of each span with tracemalloc
+    """
+    _state.update(enabled=True, records=[])
+    _local.stack = []
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _state['tracing'] = True
+
+
+def disable():
+    """ Stop recording spans; returns the records
+    """
+    if _state['tracing']:
+        tracemalloc.stop()
+        _state['tracing'] = False
+    _state['enabled'] = False
+    return (_state['records'])
+
+
+def enabled():
+    """ Whether spans are being recorded
+    """
+    return (_state['enabled'])
+
+
+def rows(values):
+    """ Rows held by tables, parsed sheets or dicts and lists of them; None when there are none
+        values: DataFrame, ico_sheet.SheetBlock, or a dict / list / tuple of them
+    """
+    if isinstance(values, ico_sheet.SheetBlock):
+        return (int(values.values.shape[0]))
+    if isinstance(values, (pd.DataFrame, pd.Series)):
+        return (len(values))
+    if isinstance(values, dict):
+        values = list(values.values())
+    if isinstance(values, (list, tuple)):
+        counts = [n for n in (rows(v) for v in values) if n is not None]
+        return (sum(counts) if counts else None)
+    return (None)
+
+
+@contextlib.contextmanager
+def span(name, kind, rows_in=None):
+    """ Measure a named step: wall time, CPU time and, while tracemalloc traces, the traced
+        bytes at its start and the peak traced bytes while it runs
+        name: step name, e.g. the stage or function name
+        kind: 'stage', 'function', 'read' or 'write'
+        rows_in: rows the step reads
+
+        spans opened in another thread start a stack of their own; tracemalloc has a single
+        peak, so memory is only attributed to a span when spans do not overlap in time
+
+        yields the record, so the step can set 'rows_out'; the record is kept when
+        recording is enabled
+    """
+    stack = _stack()
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        # fold the peak reached so far into the enclosing span before measuring this one
+        if stack:
+            parent = stack[-1]
+            parent['peak_bytes'] = max(parent['peak_bytes'], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+    parent = stack[-1] if stack else None
+    record = {
+        'name': name,
+        'kind': kind,
+        'stack': f"{parent['stack']};{name}" if parent else name,
+        'rows_in': rows_in,
+        'rows_out': None,
+        'start_bytes': tracemalloc.get_traced_memory()[0] if tracing else None,
+        'peak_bytes': 0 if tracing else None,
+        'children_s': 0.0
+    }
+    stack.append(record)
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield (record)
+    finally:
+        record['wall_s'] = time.perf_counter() - wall
+        record['cpu_s'] = time.process_time() - cpu
+        record['self_s'] = max(record['wall_s'] - record.pop('children_s'), 0.0)
+        stack.pop()
+        if stack:
+            stack[-1]['children_s'] += record['wall_s']
+        if tracing:
+            record['peak_bytes'] = max(record['peak_bytes'], tracemalloc.get_traced_memory()[1])
+            if stack:
+                parent = stack[-1]
+                parent['peak_bytes'] = max(parent['peak_bytes'], record['peak_bytes'])
+            tracemalloc.reset_peak()
+        if _state['enabled']:
+            _state['records'].append(record)
+            if kind == 'stage':
+                logger.info('span %s', json.dumps(record))
+
+
+def instrumented(fn):
+    """ Record a function call as a span, counting the rows of its table arguments and result;
+        a plain call when recording is off
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not _state['enabled']:
+            return (fn(*args, **kwargs))
+        with span(fn.__name__, 'function', rows(list(args) + list(kwargs.values()))) as record:
+            out = fn(*args, **kwargs)
+            record['rows_out'] = rows(out)
+        return (out)
+    return (wrapper)
+
+
+def folded_stacks(records):
+    """ Collapsed stacks ('stage;function self_microseconds' lines) of recorded spans, the
+        input format of flamegraph.pl and speedscope
+        records: span records
+    """
+    totals = {}
+    for record in records:
+        totals[record['stack']] = totals.get(record['stack'], 0.0) + record['self_s']
+    return ([f'{stack} {round(seconds * 1e6)}' for stack, seconds in totals.items()])
+
+
+def write_report(records, path):
+    """ Write recorded spans as JSON
+        records: span records
+        path: json file
+    """
+    with open(path, 'w') as fh:
+        json.dump({'spans': records}, fh, indent=2)
+
+
+@contextlib.contextmanager
+def profile(path):
+    """ Run a block under cProfile and dump the stats (pstats format, readable by snakeviz,
+        gprof2dot or flameprof) to path
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield (profiler)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
@@ -1,511 +1,160 @@
 # -*- coding: utf-8 -*-
 import click
+import contextlib
 import logging
 from pathlib import Path
-from dotenv import find_dotenv, load_dotenv
-import src.data.etl_functions as f
-import pandas as pd
-import numpy as np
-import glob
+import src.data.sinks as sinks
 import warnings
 warnings.filterwarnings('ignore')
 
+# choices of --engine and --only, spelled out here (see pipeline.ENGINES and pipeline.TARGETS)
+# so that --help and argument errors return without importing pandas and the pipeline
+ENGINES = ['pandas', 'polars']
+TARGETS = ['population', 'producer', 'importer', 'prices']
+
 
 @click.command()
 @click.argument('input_filepath', type=click.Path(exists=True))
 @click.argument('external_filepath', type=click.Path(exists=True))
 @click.argument('interim_filepath', type=click.Path())
 @click.argument('output_filepath', type=click.Path())
-def main(input_filepath, external_filepath, interim_filepath, output_filepath):
+@click.option('--cache-dir', type=click.Path(), default=None,
+              help='stage and workbook cache (default: INTERIM_FILEPATH/.cache)')
+@click.option('--no-cache', is_flag=True, help='always parse the raw workbooks')
+@click.option('--force', is_flag=True, help='rerun every stage even if its inputs are unchanged')
+@click.option('--workers', type=int, default=None, help='processes used to parse workbooks')
+@click.option('--output-format', type=click.Choice(sinks.FORMATS), default='csv',
+              help='write tables as csv, or as partitioned parquet / arrow ipc')
+@click.option('--compression', default=None,
+              help='parquet/arrow compression codec (default: zstd for parquet, none for arrow '
+                   'so its files can be memory-mapped)')
+@click.option('--partition', is_flag=True,
+              help='partition parquet/arrow tables by year and region or harvest group')
+@click.option('--float-precision', type=int, default=None,
+              help='digits after the decimal point of csv floats (default: shortest repr)')
+@click.option('--csv-compression', type=click.Choice(['none'] + list(sinks.CSV_COMPRESSION)),
+              default='none', help='write csv tables gzip or zstd compressed')
+@click.option('--csv-encoder', type=click.Choice(sinks.CSV_ENCODERS), default='pandas',
+              help='format csv with pandas, or with the faster multithreaded polars writer')
+@click.option('--write-workers', type=int, default=None,
+              help='threads serializing output tables')
+@click.option('--stage-workers', type=int, default=None,
+              help='threads running independent stages concurrently (default: one per CPU)')
+@click.option('--graph', 'graph_mode', is_flag=True,
+              help='print the stage graph as graphviz source, with the seconds and critical '
+                   'path of the last build, and exit')
+@click.option('--fixed-point', is_flag=True,
+              help='store bag quantities as scaled integers (1k bags to 4 decimals)')
+@click.option('--memory-report', is_flag=True,
+              help='record peak and per-table memory of each stage in the build manifest')
+@click.option('--database', 'database_path', type=click.Path(), default=None,
+              help='also upsert every table into this SQLite (or .duckdb) file')
+@click.option('--hyper', 'hyper_path', type=click.Path(), default=None,
+              help='also write the processed tables into this Tableau .hyper extract, '
+                   'replacing only the years that changed (needs tableauhyperapi)')
+@click.option('--only', type=click.Choice(TARGETS), multiple=True,
+              help='run only the stages of these targets; the outputs of the other stages are '
+                   'taken from the last build (repeatable)')
+@click.option('--engine', type=click.Choice(ENGINES), default='pandas',
+              help='run the etl functions eagerly in pandas or as lazy polars plans')
+@click.option('--projection-years', type=int, default=10,
+              help='crop years of closing stock projected past the last observed one')
+@click.option('--scenarios', type=int, default=1000,
+              help='production/consumption scenarios simulated for the stock projection')
+@click.option('--quality-sample', type=click.FloatRange(0, 1, min_open=True), default=None,
+              help='share of rows the data-quality checks sample (default: every row)')
+@click.option('--watch', 'watch_mode', is_flag=True,
+              help='stay resident and rebuild from memory whenever a raw or external file '
+                   'changes')
+@click.option('--poll-interval', type=float, default=1.0,
+              help='seconds between checks of the watched folders')
+@click.option('--instrument', 'instrument_path', type=click.Path(), default=None,
+              help='write wall/CPU time, peak memory and rows of every stage and ETL call '
+                   'to this JSON file')
+@click.option('--profile', 'profile_path', type=click.Path(), default=None,
+              help='write a cProfile dump to this file and collapsed stacks to PROFILE.folded')
+def main(input_filepath, external_filepath, interim_filepath, output_filepath,
+         cache_dir, no_cache, force, workers, output_format, compression, partition,
+         float_precision, csv_compression, csv_encoder, write_workers, stage_workers,
+         graph_mode, fixed_point,
+         memory_report, database_path, hyper_path, only, engine, projection_years, scenarios,
+         quality_sample, watch_mode, poll_interval, instrument_path, profile_path):
     """ Runs data processing scripts to turn raw data from (../raw) into
         cleaned data ready to be analyzed (saved in ../processed).
     """
+    import src.data.instrument as instrument
+    import src.data.pipeline as pipeline
+    import src.data.stages as stages
+    import src.data.watch as watch
+
     logger = logging.getLogger(__name__)
     logger.info('making final data set from raw data')
 
-    # read raw data files
-    source_path = sorted(glob.glob(f'{input_filepath}/*.xlsx'))
-    source_files = pd.DataFrame({'file_path': source_path})
-    source_files['variable_type'] = \
-        source_files['file_path'] \
-        .replace(f'{input_filepath}/[0-9][a-z] - ', '', regex=True) \
-        .replace('.xlsx', '', regex=True) \
-        .replace(r'\W{1,}', '_', regex=True) \
-        .str.lower()
-
-    dfs = {}
-    for i in source_files.index:
-        dfs[source_files.loc[i, 'variable_type']] = \
-            pd.read_excel(source_files.loc[i, 'file_path'])
-
-    # load external population data from UN
-    population = \
-        pd.read_csv(f'{external_filepath}/WPP2022_Demographic_Indicators_Medium.csv',
-                    usecols=['Location', 'Time', 'TPopulation1Jan', 'TPopulation1July'])
-    population = population.rename(columns={'Location': 'country',
-                                            'Time': 'year',
-                                            'TPopulation1Jan': 'population_boy',
-                                            'TPopulation1July': 'population_mid'})
-    population['population_boy'] = population['population_boy'] * 1000
-    population['population_mid'] = population['population_mid'] * 1000
-
-    # aggregate country-level data for Yugoslavia and Netherlands Antilles
-    yugoslavia_countries = ['Serbia', 'Croatia', 'Slovenia', 'Bosnia and Herzegovina', 'Macedonia']
-    fmr_yugoslavia = \
-        population \
-        .loc[lambda x: x.country.isin(yugoslavia_countries)] \
-        .groupby('year') \
-        .agg({'population_boy': sum, 'population_mid': sum}) \
-        .reset_index() \
-        .assign(country='Yugoslavia SFR') \
-        .loc[:, ['country', 'year', 'population_boy', 'population_mid']]
-
-    antilles_countries = ['Curacao', 'Bonaire', 'Aruba', 'Sint Maarten (Dutch part)',
-                          'Sint Eustatius', 'Saba', 'Netherlands Antilles']
-
-    net_antilles = \
-        population \
-        .loc[lambda x: x.country.isin(antilles_countries)] \
-        .groupby('year') \
-        .agg({'population_boy': sum, 'population_mid': sum}) \
-        .reset_index() \
-        .assign(country='Netherlands Antilles (former)') \
-        .loc[:, ['country', 'year', 'population_boy', 'population_mid']]
-
-    population = pd.concat([population, fmr_yugoslavia, net_antilles])
-
-    # process producer data
-    dfs['total_production'] = \
-        f.process_producer(
-            dfs['total_production'],
-            'production',
-            'crop_year'
-            )
-    dfs['domestic_consumption'] = \
-        f.process_producer(
-            dfs['domestic_consumption'],
-            'consumption',
-            'crop_year'
-            )
-    dfs['gross_opening_stocks'] = \
-        f.process_producer(
-            dfs['gross_opening_stocks'],
-            'openstock',
-            'crop_year'
-            )
-    dfs['exports_crop_year'] = \
-        f.process_producer(
-            dfs['exports_crop_year'],
-            'exports',
-            'crop_year'
-            )
-    dfs['exports_calendar_year'] = \
-        f.process_producer(
-            dfs['exports_calendar_year'],
-            'exports',
-            'calendar_year'
-            )
-
-    # merge producer data
-    producer_cropyear = \
-        dfs['gross_opening_stocks'] \
-        .merge(
-            dfs['total_production'],
-            how='left',
-            on=['country', 'harvest_group', 'crop_year', 'crop_year_beg', 'crop_year_end']
-            )
-
-    producer_cropyear = \
-        producer_cropyear \
-        .merge(
-            dfs['domestic_consumption'],
-            how='left',
-            on=['country', 'harvest_group', 'crop_year', 'crop_year_beg', 'crop_year_end']
-            )
-
-    producer_cropyear = \
-        producer_cropyear \
-        .merge(
-            dfs['exports_crop_year'],
-            how='left',
-            on=['country', 'harvest_group', 'crop_year', 'crop_year_beg', 'crop_year_end']
-            )
-
-    # Calculate closing stock, assumed imports, and stock adjustment between EOY (t-1) and BOY (t)
-    producer_cropyear['closestock_1k_bags'] = f.close_stock_calc(producer_cropyear, '1k_bags')
-    producer_cropyear['closestock_kg'] = f.close_stock_calc(producer_cropyear, 'kg')
-    producer_cropyear['closestock_lb'] = f.close_stock_calc(producer_cropyear, 'lb')
-
-    producer_cropyear['imports_1k_bags'] = f.producer_imports(producer_cropyear, '1k_bags')
-    producer_cropyear['imports_kg'] = f.producer_imports(producer_cropyear, 'kg')
-    producer_cropyear['imports_lb'] = f.producer_imports(producer_cropyear, 'lb')
-
-    producer_cropyear.sort_values(['country', 'crop_year_beg'], inplace=True)
-    producer_cropyear['stock_adj_1k_bags'] = f.stock_adj(producer_cropyear, '1k_bags')
-    producer_cropyear['stock_adj_kg'] = f.stock_adj(producer_cropyear, 'kg')
-    producer_cropyear['stock_adj_lb'] = f.stock_adj(producer_cropyear, 'lb')
-
-    # Merge country population data
-    countrymap = pd.DataFrame(
-        {
-            'country':
-                [
-                    'Democratic Republic of Congo',
-                    'Tanzania',
-                    'Trinidad & Tobago',
-                    'Venezuela'
-                ],
-            'country_pop':
-                [
-                    'Democratic Republic of the Congo',
-                    'United Republic of Tanzania',
-                    'Trinidad and Tobago',
-                    'Venezuela (Bolivarian Republic of)'
-                ]
-        }
-    )
-
-    producer_cropyear = \
-        producer_cropyear \
-        .merge(
-            countrymap,
-            how='left',
-            on='country',
-            suffixes=['', '_pop']
-            ) \
-        .assign(country_pop=lambda x: np.where(x.country_pop.isna(), x.country, x.country_pop))
-
-    producer_cropyear = \
-        producer_cropyear \
-        .merge(
-            population,
-            how='left',
-            left_on=['country_pop', 'crop_year_beg'],
-            right_on=['country', 'year'],
-            suffixes=['', '_y']
-            ) \
-        .drop(columns=['country_y', 'year']) \
-        .rename(columns={'population_boy': 'population_beg'})
-
-    producer_cropyear = \
-        producer_cropyear \
-        .merge(
-            population,
-            how='left',
-            left_on=['country_pop', 'crop_year_end'],
-            right_on=['country', 'year'],
-            suffixes=['', '_y']
-            ) \
-        .drop(columns=['country_y', 'year', 'population_mid_y']) \
-        .rename(columns={'population_boy': 'population_end'})
-
-    producer_cropyear.drop(columns='country_pop', inplace=True)
-
-    # calendar year export data
-    exports_calendar_year = \
-        dfs['exports_calendar_year'] \
-        .merge(
-            countrymap,
-            how='left',
-            on='country',
-            suffixes=['', '_pop']
-            ) \
-        .assign(country_pop=lambda x: np.where(x.country_pop.isna(), x.country, x.country_pop))
-
-    exports_calendar_year = \
-        exports_calendar_year \
-        .merge(
-            population,
-            how='left',
-            left_on=['country_pop', 'calendar_year'],
-            right_on=['country', 'year'],
-            suffixes=['', '_y']
-            ) \
-        .drop(columns=['country_y', 'year'])
-
-    exports_calendar_year.drop(columns='country_pop', inplace=True)
+    if cache_dir is None:
+        cache_dir = f'{interim_filepath}/.cache'
+    if compression is None:
+        compression = sinks.COMPRESSION.get(output_format) or 'none'
 
-    # process importer data
-    region_map = pd.DataFrame(
-        {
-            'country':
-                [
-                    'Austria',
-                    'Belgium',
-                    'Belgium/Luxembourg',
-                    'Bulgaria',
-                    'Croatia',
-                    'Cyprus',
-                    'Czechia',
-                    'Denmark',
-                    'Estonia',
-                    'Finland',
-                    'France',
-                    'Germany',
-                    'Greece',
-                    'Hungary',
-                    'Ireland',
-                    'Italy',
-                    'Latvia',
-                    'Lithuania',
-                    'Luxembourg',
-                    'Malta',
-                    'Netherlands',
-                    'Poland',
-                    'Portugal',
-                    'Romania',
-                    'Slovakia',
-                    'Slovenia',
-                    'Spain',
-                    'Sweden',
-                    'Japan',
-                    'Norway',
-                    'Russian Federation',
-                    'Switzerland',
-                    'Tunisia',
-                    'United Kingdom',
-                    'United States of America'
-                ],
-            'region':
-                [
-                    'Europe',
-                    'Europe',
-                    'Europe',
-                    'Europe',
-                    'Europe',
-                    'Europe',
-                    'Europe',
-                    'Europe',
-                    'Europe',
-                    'Europe',
-                    'Europe',
-                    'Europe',
-                    'Europe',
-                    'Europe',
-                    'Europe',
-                    'Europe',
-                    'Europe',
-                    'Europe',
-                    'Europe',
-                    'Europe',
-                    'Europe',
-                    'Europe',
-                    'Europe',
-                    'Europe',
-                    'Europe',
-                    'Europe',
-                    'Europe',
-                    'Europe',
-                    'Asia & Oceania',
-                    'Europe',
-                    'Europe',
-                    'Europe',
-                    'Africa',
-                    'Europe',
-                    'North America'
-                ]
-            }
-        )
-
-    dfs['imports'] = f.process_importer(dfs['imports'], 'imports', region_map)
-    dfs['re_exports'] = f.process_importer(dfs['re_exports'], 're_exports', region_map)
-
-    member = \
-        dfs['imports'] \
-        .merge(
-            dfs['re_exports'],
-            how='outer',
-            on=['region', 'country', 'ico_member', 'calendar_year']
-            )
-
-    # process non-member importer data
-    dfs['non_member_imports'] = f.process_nonmember(dfs['non_member_imports'], 'imports')
-    dfs['non_member_re_exports'] = f.process_nonmember(dfs['non_member_re_exports'], 're_exports')
-
-    non_member = \
-        dfs['non_member_imports'] \
-        .merge(
-            dfs['non_member_re_exports'],
-            how='outer',
-            on=['region', 'country', 'ico_member', 'calendar_year'])
-
-    # combine member/non-member import/re-export data
-    imports_re_exports = pd.concat([member, non_member]).reset_index(drop=True)
-
-    # add population data by country; country names are different for some countries.
-    countrymap = \
-        pd.DataFrame(
-            {
-                'country':
-                    [
-                        'Abu Dhabi',
-                        'China (Mainland)',
-                        "Democratic People's Republic of Korea",
-                        'Dubai',
-                        'Hong Kong',
-                        'Macao',
-                        'Micronesia (Federated States of)',
-                        'Netherlands Antilles (former)',
-                        'Saint Vincent & the Grenadines',
-                        'Taiwan',
-                        'Turkey',
-                        'USSR',
-                        'Yugoslavia SFR'
-                    ],
-
-                'country_pop':
-                    [
-                        'United Arab Emirates',
-                        'China',
-                        "Dem. People's Republic of Korea",
-                        'United Arab Emirates',
-                        'China, Hong Kong SAR',
-                        'China, Macao SAR',
-                        'Micronesia',
-                        'Netherlands Antilles (former)',
-                        'Saint Vincent and the Grenadines',
-                        'China, Taiwan Province of China',
-                        'Türkiye',
-                        'Russian Federation',
-                        'Yugoslavia SFR'
-                    ]
-            }
-        )
-
-    # map country names so that ICO data and UN population data are aligned
-    imports_re_exports = \
-        imports_re_exports \
-        .merge(countrymap, how='left', on='country', suffixes=['', '_pop']) \
-        .assign(country_pop=lambda x: np.where(x.country_pop.isna(), x.country, x.country_pop))
-
-    # merge population data
-    imports_re_exports = \
-        imports_re_exports \
-        .merge(
-            population,
-            how='left',
-            left_on=['country_pop', 'calendar_year'],
-            right_on=['country', 'year'],
-            suffixes=['', '_y']
-            ) \
-        .drop(columns=['year', 'country_y'])
-
-    imports_re_exports.drop(columns='country_pop', inplace=True)
+    if instrument_path or profile_path:
+        instrument.enable(trace_memory=instrument_path is not None)
+    profiler = instrument.profile(profile_path) if profile_path else contextlib.nullcontext()
 
-    # process indicator prices
-    x = dfs['indicator_prices']
-    x.columns = x.iloc[2, :]
-    x = x.iloc[3:424, :]
-    x = x.dropna(how='all')
-    x.columns = \
-        x.columns \
-        .fillna('calendar_month') \
-        .str.replace('\\n', '', regex=True) \
-        .str.replace(' ', '_', regex=True) \
-        .str.lower()
-    x = x.melt(
-            id_vars='calendar_month',
-            var_name='indicator_name',
-            value_name='indicator_price_cents_per_lb'
-            )
-    x['indicator_price_cents_per_lb'] = \
-        x['indicator_price_cents_per_lb'].astype('float', errors='ignore')
-    x['indicator_price_dollars_per_lb'] = \
-        x['indicator_price_cents_per_lb'] / 100
-    year_rows = x['calendar_month'].astype('str').str.match(r'[0-9]{4}')
-    x['calendar_year'] = np.where(year_rows, x['calendar_month'], np.NaN)
-    x['calendar_year'] = x['calendar_year'].fillna(method='ffill')
-    avg_annual = x[year_rows].drop(columns='calendar_month')
-    x = x[~year_rows]
-    x = x.merge(
-        avg_annual,
-        how='left',
-        on=['calendar_year', 'indicator_name'],
-        suffixes=['', '_ann']
+    stage_list = pipeline.build_stages(
+        fixed_point=fixed_point, engine=engine, projection_years=projection_years,
+        scenarios=scenarios, quality_sample=quality_sample
         )
-    x = x[
-            [
-                'calendar_year',
-                'calendar_month',
-                'indicator_name',
-                'indicator_price_cents_per_lb',
-                'indicator_price_dollars_per_lb',
-                'indicator_price_cents_per_lb_ann',
-                'indicator_price_dollars_per_lb_ann'
-            ]
-        ]
-    dfs['indicator_prices'] = x
-
-    # process prices paid to grower data
-    x = dfs['prices_paid_to_growers']
-    x.columns = x.iloc[2, :]
-    x = x.iloc[3:76, :]
-    x = x.dropna(how='all')
-    x.rename(columns={'Calendar years': 'country'}, inplace=True)
-    x = x.melt(id_vars='country', var_name='calendar_year', value_name='price_paid_cents_per_lb')
-    x['country'] = x['country'].str.strip()
-    x['price_paid_cents_per_lb'] = x['price_paid_cents_per_lb'].astype('float', errors='ignore')
-    x['price_paid_dollars_per_lb'] = x['price_paid_cents_per_lb'] / 100
-    categories = ['Colombian Milds', 'Other Milds', 'Brazilian Naturals', 'Robustas']
-    totals = ['Total', '']
-    x['indicator_name'] = np.where(x['country'].isin(categories), x['country'], np.NaN)
-    x['indicator_name'] = x['indicator_name'].ffill()
-    cat_rows = x.iloc[:, 0].isin(categories)
-    tot_rows = x.iloc[:, 0].isin(totals)
-    x = x.loc[~(cat_rows | tot_rows)]
-    x['indicator_name'] = x['indicator_name'].str.replace(' ', '_').str.lower()
-    x = x[
-            [
-                'country',
-                'indicator_name',
-                'calendar_year',
-                'price_paid_cents_per_lb',
-                'price_paid_dollars_per_lb'
-            ]
-        ]
-    dfs['prices_paid_to_growers'] = x
-
-    # Combine Indicator and Grower data
-    annual_indicators = \
-        dfs['indicator_prices'] \
-        .loc[
-            lambda x: x.calendar_month == 'January',
-            [
-                'calendar_year',
-                'indicator_name',
-                'indicator_price_cents_per_lb_ann',
-                'indicator_price_dollars_per_lb_ann'
-            ]
-        ]
-
-    annual_indicators['calendar_year'] = annual_indicators['calendar_year'].astype('int64')
-
-    grower_vs_indicator = dfs['prices_paid_to_growers']
-    grower_vs_indicator['calendar_year'] = grower_vs_indicator['calendar_year'].astype('int64')
-
-    grower_vs_indicator = \
-        grower_vs_indicator \
-        .merge(
-            annual_indicators,
-            how='left',
-            on=['indicator_name', 'calendar_year']
-        )
-
-    # Create a helper file for Tableau waterfall
-    tableau_waterfall = pd.DataFrame({'point': [x for x in range(1, 21)]})
-
-    # Write Interim Files
-    for k in dfs.keys():
-        dfs[k].to_csv(f'{interim_filepath}/{k}.csv', index=False)
-
-    population.to_csv(f'{interim_filepath}/population_data.csv', index=False)
-
-    # Write Output Files
-    producer_cropyear.to_csv(f'{output_filepath}/producer_cropyear.csv', index=False)
-    imports_re_exports.to_csv(f'{output_filepath}/imports_re_exports.csv', index=False)
-    exports_calendar_year.to_csv(f'{output_filepath}/exports_calyear.csv', index=False)
-    grower_vs_indicator.to_csv(f'{output_filepath}/grower_vs_indicator.csv', index=False)
-    tableau_waterfall.to_csv(f'{output_filepath}/tableau_waterfall.csv', index=False)
+    if graph_mode:
+        last_build = stages.load_build(f'{cache_dir}/build_manifest.json')
+        click.echo(stages.graph_dot(stage_list, last_build))
+        return
+
+    # only stages whose workbooks, parameters or code changed are rerun and rewritten
+    def build(warm=None):
+        return (stages.run_stages(
+            stage_list,
+            input_filepath,
+            external_filepath,
+            interim_filepath,
+            output_filepath,
+            cache_dir,
+            force=force,
+            max_workers=workers,
+            workbook_cache=not no_cache,
+            output_format=output_format,
+            partitions=pipeline.PARTITIONS if partition else None,
+            compression=None if compression == 'none' else compression,
+            memory_report=memory_report,
+            database_path=database_path,
+            table_keys=pipeline.TABLE_KEYS,
+            table_indexes=pipeline.TABLE_INDEXES,
+            hyper_path=hyper_path,
+            hyper_partitions=pipeline.HYPER_PARTITIONS,
+            float_precision=float_precision,
+            csv_compression=None if csv_compression == 'none' else csv_compression,
+            csv_encoder=csv_encoder,
+            write_workers=write_workers,
+            stage_workers=stage_workers,
+            only={name for target in only for name in pipeline.TARGETS[target]} or None,
+            warm=warm
+            ))
+
+    with profiler:
+        if watch_mode:
+            watch.watch(build, stage_list, input_filepath, external_filepath, poll_interval)
+        else:
+            manifest = build()
+            logger.info('skipped unchanged stages: %s',
+                        ', '.join(manifest['skipped']) or 'none')
+
+    if instrument_path or profile_path:
+        records = instrument.disable()
+        if instrument_path:
+            instrument.write_report(records, instrument_path)
+            logger.info('instrumentation written to %s', instrument_path)
+        if profile_path:
+            with open(f'{profile_path}.folded', 'w') as fh:
+                fh.write('\n'.join(instrument.folded_stacks(records)) + '\n')
+            logger.info('profile written to %s and %s.folded', profile_path, profile_path)
 
 
 if __name__ == '__main__':
@@ -517,6 +166,8 @@ if __name__ == '__main__':
 
     # find .env automagically by walking up directories until it's found, then
     # load up the .env entries as environment variables
+    from dotenv import find_dotenv, load_dotenv
+
     load_dotenv(find_dotenv())
 
     main()
@@ -0,0 +1,811 @@
+# -*- coding: utf-8 -*-
+import inspect
+import pandas as pd
+import src.data.apportion as apportion
+import src.data.cube as cube
+import src.data.etl_functions as f
+import src.data.etl_polars as etl_polars
+import src.data.ico_sheet as ico_sheet
+import src.data.population as population
+import src.data.price_panel as price_panel
+import src.data.prices as prices
+import src.data.quality as quality
+import src.data.schema as schema
+import src.data.stocks as stocks
+from src.data.stages import Stage
+
+# ICO producer names that differ from the UN population names
+PRODUCER_COUNTRY_MAP = {
+    'Democratic Republic of Congo': 'Democratic Republic of the Congo',
+    'Tanzania': 'United Republic of Tanzania',
+    'Trinidad & Tobago': 'Trinidad and Tobago',
+    'Venezuela': 'Venezuela (Bolivarian Republic of)'
+}
+
+# ICO importer names that differ from the UN population names
+IMPORTER_COUNTRY_MAP = {
+    'Abu Dhabi': 'United Arab Emirates',
+    'China (Mainland)': 'China',
+    "Democratic People's Republic of Korea": "Dem. People's Republic of Korea",
+    'Dubai': 'United Arab Emirates',
+    'Hong Kong': 'China, Hong Kong SAR',
+    'Macao': 'China, Macao SAR',
+    'Micronesia (Federated States of)': 'Micronesia',
+    'Netherlands Antilles (former)': 'Netherlands Antilles (former)',
+    'Saint Vincent & the Grenadines': 'Saint Vincent and the Grenadines',
+    'Taiwan': 'China, Taiwan Province of China',
+    'Turkey': 'Türkiye',
+    'USSR': 'Russian Federation',
+    'Yugoslavia SFR': 'Yugoslavia SFR'
+}
+
+# regions of the ICO member importers
+MEMBER_REGIONS = {
+    'Austria': 'Europe',
+    'Belgium': 'Europe',
+    'Belgium/Luxembourg': 'Europe',
+    'Bulgaria': 'Europe',
+    'Croatia': 'Europe',
+    'Cyprus': 'Europe',
+    'Czechia': 'Europe',
+    'Denmark': 'Europe',
+    'Estonia': 'Europe',
+    'Finland': 'Europe',
+    'France': 'Europe',
+    'Germany': 'Europe',
+    'Greece': 'Europe',
+    'Hungary': 'Europe',
+    'Ireland': 'Europe',
+    'Italy': 'Europe',
+    'Latvia': 'Europe',
+    'Lithuania': 'Europe',
+    'Luxembourg': 'Europe',
+    'Malta': 'Europe',
+    'Netherlands': 'Europe',
+    'Poland': 'Europe',
+    'Portugal': 'Europe',
+    'Romania': 'Europe',
+    'Slovakia': 'Europe',
+    'Slovenia': 'Europe',
+    'Spain': 'Europe',
+    'Sweden': 'Europe',
+    'Japan': 'Asia & Oceania',
+    'Norway': 'Europe',
+    'Russian Federation': 'Europe',
+    'Switzerland': 'Europe',
+    'Tunisia': 'Africa',
+    'United Kingdom': 'Europe',
+    'United States of America': 'North America'
+}
+
+# population aggregates for entities that no longer exist, summed from their successors
+POPULATION_AGGREGATES = [
+    apportion.Rule(
+        'Yugoslavia SFR',
+        ['Serbia', 'Croatia', 'Slovenia', 'Bosnia and Herzegovina', 'Macedonia'],
+        'population'
+    ),
+    apportion.Rule(
+        'Netherlands Antilles (former)',
+        ['Curacao', 'Bonaire', 'Aruba', 'Sint Maarten (Dutch part)',
+         'Sint Eustatius', 'Saba', 'Netherlands Antilles'],
+        'population'
+    )
+]
+
+# importers reported jointly in early years, split by their shares since separate reporting
+IMPORTER_SPLITS = [
+    apportion.Rule('Belgium/Luxembourg', ['Belgium', 'Luxembourg'], 'historical', since=1999)
+]
+
+POPULATION_FILE = 'WPP2022_Demographic_Indicators_Medium.csv'
+
+# trailing windows (months) of the indicator price features
+PRICE_WINDOWS = [3, 12]
+
+# indicator price spreads: (indicator, other indicator) priced as indicator less other
+PRICE_SPREADS = [
+    ('colombian_milds', 'other_milds'),
+    ('other_milds', 'brazilian_naturals'),
+    ('other_milds', 'robustas'),
+    ('colombian_milds', 'robustas'),
+    ('brazilian_naturals', 'robustas')
+]
+
+# etl modules by engine; polars is only imported when its engine runs
+ENGINES = {'pandas': f, 'polars': etl_polars}
+
+# primary keys of the database tables; tables without one are replaced whole on change
+TABLE_KEYS = {
+    'population_data': ['country', 'year'],
+    'total_production': ['country', 'crop_year'],
+    'domestic_consumption': ['country', 'crop_year'],
+    'gross_opening_stocks': ['country', 'crop_year'],
+    'exports_crop_year': ['country', 'crop_year'],
+    'producer_cropyear': ['country', 'crop_year'],
+    'stock_projection': ['country', 'crop_year'],
+    'exports_calendar_year': ['country', 'calendar_year'],
+    'exports_calyear': ['country', 'calendar_year'],
+    'imports': ['country', 'calendar_year'],
+    're_exports': ['country', 'calendar_year'],
+    'non_member_imports': ['country', 'calendar_year'],
+    'non_member_re_exports': ['country', 'calendar_year'],
+    'imports_re_exports': ['country', 'calendar_year'],
+    'indicator_prices': ['indicator_name', 'calendar_year', 'calendar_month'],
+    'prices_paid_to_growers': ['country', 'indicator_name', 'calendar_year'],
+    'grower_vs_indicator': ['country', 'indicator_name', 'calendar_year'],
+    'indicator_features': ['indicator_name', 'calendar_year', 'calendar_month'],
+    'indicator_spreads':
+        ['indicator_name', 'other_indicator_name', 'calendar_year', 'calendar_month'],
+    'price_panel': ['country', 'indicator_name', 'calendar_year'],
+    'rollup_cube': ['table', 'dimension', 'group', 'year', 'measure'],
+    'tableau_waterfall': ['point']
+}
+
+# secondary indexes of the database tables
+TABLE_INDEXES = {
+    'prices_paid_to_growers': [['indicator_name', 'calendar_year']],
+    'grower_vs_indicator': [['indicator_name', 'calendar_year']],
+    'price_panel': [['indicator_name', 'calendar_year']]
+}
+
+# partition columns of the parquet/arrow outputs
+PARTITIONS = {
+    'population_data': ['year'],
+    'total_production': ['harvest_group', 'crop_year_beg'],
+    'domestic_consumption': ['harvest_group', 'crop_year_beg'],
+    'gross_opening_stocks': ['harvest_group', 'crop_year_beg'],
+    'exports_crop_year': ['harvest_group', 'crop_year_beg'],
+    'producer_cropyear': ['harvest_group', 'crop_year_beg'],
+    'exports_calendar_year': ['calendar_year'],
+    'exports_calyear': ['calendar_year'],
+    'imports': ['region', 'calendar_year'],
+    're_exports': ['region', 'calendar_year'],
+    'non_member_imports': ['region', 'calendar_year'],
+    'non_member_re_exports': ['region', 'calendar_year'],
+    'imports_re_exports': ['region', 'calendar_year'],
+    'indicator_prices': ['indicator_name', 'calendar_year'],
+    'prices_paid_to_growers': ['indicator_name', 'calendar_year'],
+    'grower_vs_indicator': ['indicator_name', 'calendar_year'],
+    'stock_projection': ['crop_year_beg'],
+    'indicator_features': ['indicator_name', 'calendar_year'],
+    'indicator_spreads': ['indicator_name', 'calendar_year'],
+    'price_panel': ['indicator_name', 'calendar_year'],
+    'rollup_cube': ['dimension', 'year']
+}
+
+# year column of each processed table whose partitions are appended or replaced in the
+# Tableau extract; other tables are replaced whole when they change
+HYPER_PARTITIONS = {
+    'producer_cropyear': 'crop_year_beg',
+    'exports_calyear': 'calendar_year',
+    'imports_re_exports': 'calendar_year',
+    'indicator_features': 'calendar_year',
+    'indicator_spreads': 'calendar_year',
+    'grower_vs_indicator': 'calendar_year',
+    'price_panel': 'calendar_year',
+    'stock_projection': 'crop_year_beg',
+    'rollup_cube': 'year'
+}
+
+# invariants the quality stage checks on the joined output tables
+QUALITY_CHECKS = {
+    'producer_cropyear': quality.TableChecks(
+        keys=['country', 'crop_year'],
+        year='crop_year_beg',
+        population=['population_beg', 'population_mid', 'population_end'],
+        country_map=PRODUCER_COUNTRY_MAP
+    ),
+    'exports_calyear': quality.TableChecks(
+        keys=['country', 'calendar_year'],
+        year='calendar_year',
+        population=['population_boy', 'population_mid'],
+        country_map=PRODUCER_COUNTRY_MAP
+    ),
+    'imports_re_exports': quality.TableChecks(
+        keys=['country', 'calendar_year'],
+        year='calendar_year',
+        population=['population_boy', 'population_mid'],
+        country_map=IMPORTER_COUNTRY_MAP
+    )
+}
+
+# stock adjustment, in 1k bags, reported as a stock identity residual
+QUALITY_TOLERANCE = 1.0
+
+# dimensions and measures the rollup cube aggregates each joined table by
+CUBE_SPECS = {
+    'producer_cropyear': cube.CubeSpec(
+        dimensions=['harvest_group'],
+        year='crop_year_beg',
+        population='population_mid',
+        measures=['production', 'consumption', 'exports', 'openstock', 'closestock']
+    ),
+    'imports_re_exports': cube.CubeSpec(
+        dimensions=['region', 'ico_member'],
+        year='calendar_year',
+        population='population_mid',
+        measures=['imports', 're_exports']
+    )
+}
+
+
+def region_map_frame(region_map):
+    """ DataFrame of member country -> region
+        region_map: dict of member country -> region
+    """
+    return (pd.DataFrame({'country': list(region_map.keys()), 'region': list(region_map.values())}))
+
+
+def producer_frame(openstock, production, consumption, exports):
+    """ Join the processed producer tables into one row per country and crop year, sorted
+        for the stock roll-forward
+        openstock, production, consumption, exports: processed producer tables
+    """
+    keys = ['country', 'harvest_group', 'crop_year', 'crop_year_beg', 'crop_year_end']
+    openstock, production, consumption, exports = \
+        schema.unify([openstock, production, consumption, exports])
+    producer_cropyear = \
+        openstock \
+        .merge(production, how='left', on=keys) \
+        .merge(consumption, how='left', on=keys) \
+        .merge(exports, how='left', on=keys)
+    producer_cropyear.sort_values(['country', 'crop_year_beg'], inplace=True)
+    return (producer_cropyear)
+
+
+def sheet_countries(*sheets):
+    """ Country and group (region) labels of parsed ICO sheets
+        sheets: ico_sheet.SheetBlock of raw ICO workbooks
+    """
+    labels = set()
+    for sheet in sheets:
+        labels.update(label for label in sheet.labels if isinstance(label, str))
+        labels.update(sheet.group_labels)
+    return (labels)
+
+
+def sheet_years(*sheets):
+    """ First and last year covered by parsed ICO sheets; crop years also cover their end year
+        sheets: ico_sheet.SheetBlock of raw ICO workbooks
+    """
+    years = []
+    for sheet in sheets:
+        for value in sheet.columns:
+            if isinstance(value, str):
+                if value[0:4].isdigit():
+                    years.extend([int(value[0:4]), int(value[0:4]) + 1])
+            else:
+                years.append(int(value))
+    return ((min(years), max(years)))
+
+
+def population_stage(population_file, gross_opening_stocks, exports_calendar_year,
+                     imports, re_exports, non_member_imports, non_member_re_exports,
+                     aggregates, country_maps):
+    """ Load UN population data for the ICO countries and years, with aggregates for
+        former countries
+        population_file: path to the UN WPP demographic indicators csv
+        gross_opening_stocks ... non_member_re_exports: raw ICO workbooks joined to population
+        aggregates: apportion.Rule list of former countries and their successors
+        country_maps: dicts of ICO name -> population name
+    """
+    frames = [gross_opening_stocks, exports_calendar_year, imports, re_exports,
+              non_member_imports, non_member_re_exports]
+    countries = sheet_countries(*frames)
+    for country_map in country_maps:
+        countries.update(country_map.get(c, c) for c in list(countries))
+
+    population_data = \
+        population.load_population(
+            population_file,
+            countries=countries,
+            years=sheet_years(*frames),
+            aggregates=aggregates
+            )
+    population_data = schema.compact(population_data)
+
+    return ({'population_data': population_data})
+
+
+def producer_stage(total_production, domestic_consumption, gross_opening_stocks,
+                   exports_crop_year, population_data, country_map, fixed_point=False,
+                   engine='pandas'):
+    """ Build the producer crop year data set
+        total_production, domestic_consumption, gross_opening_stocks, exports_crop_year:
+            raw ICO producer workbooks
+        population_data: UN population data
+        country_map: dict of ICO name -> population name
+        fixed_point: store bag quantities as scaled integers
+        engine: etl engine (see ENGINES)
+    """
+    etl = ENGINES[engine]
+    names = ['gross_opening_stocks', 'total_production', 'domestic_consumption',
+             'exports_crop_year']
+    frames = schema.unify([
+        etl.process_producer(gross_opening_stocks, 'openstock', 'crop_year', fixed_point),
+        etl.process_producer(total_production, 'production', 'crop_year', fixed_point),
+        etl.process_producer(domestic_consumption, 'consumption', 'crop_year', fixed_point),
+        etl.process_producer(exports_crop_year, 'exports', 'crop_year', fixed_point)
+    ])
+    out = dict(zip(names, frames))
+    producer_cropyear = producer_frame(*frames)
+
+    # Calculate closing stock, assumed imports, and stock adjustment between EOY (t-1) and BOY (t)
+    producer_cropyear = pd.concat([producer_cropyear, f.stock_calcs(producer_cropyear)], axis=1)
+
+    # gather country population at the start and end of each crop year
+    index = population.build_index(population_data)
+    producer_cropyear = producer_cropyear.reset_index(drop=True)
+    producer_cropyear = population.enrich(
+        producer_cropyear, index, 'crop_year_beg',
+        {'population_beg': 'population_boy', 'population_mid': 'population_mid'},
+        country_map
+    )
+    producer_cropyear = population.enrich(
+        producer_cropyear, index, 'crop_year_end', {'population_end': 'population_boy'},
+        country_map
+    )
+    out['producer_cropyear'] = producer_cropyear
+
+    return (out)
+
+
+def exports_calendar_year_stage(exports_calendar_year, population_data, country_map,
+                                fixed_point=False, engine='pandas'):
+    """ Build the calendar year export data set
+        exports_calendar_year: raw ICO calendar year exports workbook
+        population_data: UN population data
+        country_map: dict of ICO name -> population name
+        fixed_point: store bag quantities as scaled integers
+        engine: etl engine (see ENGINES)
+    """
+    exports = ENGINES[engine].process_producer(
+        exports_calendar_year, 'exports', 'calendar_year', fixed_point
+    )
+
+    exports_calyear = population.enrich(
+        exports, population.build_index(population_data), 'calendar_year',
+        {'population_boy': 'population_boy', 'population_mid': 'population_mid'},
+        country_map
+    )
+
+    return ({'exports_calendar_year': exports, 'exports_calyear': exports_calyear})
+
+
+def importer_stage(imports, re_exports, non_member_imports, non_member_re_exports,
+                   population_data, region_map, country_map, splits=(), fixed_point=False,
+                   engine='pandas'):
+    """ Build the member and non-member import/re-export data set
+        imports, re_exports: raw ICO member importer workbooks
+        non_member_imports, non_member_re_exports: raw ICO non-member importer workbooks
+        population_data: UN population data
+        region_map: dict of member country -> region
+        country_map: dict of ICO name -> population name
+        splits: apportion.Rule list of jointly reported importers to split
+        fixed_point: store bag quantities as scaled integers
+        engine: etl engine (see ENGINES)
+    """
+    etl = ENGINES[engine]
+    region_map = region_map_frame(region_map)
+    keys = ['region', 'country', 'ico_member', 'calendar_year']
+    out = {
+        'imports': etl.process_importer(imports, 'imports', region_map, fixed_point, splits),
+        're_exports':
+            etl.process_importer(re_exports, 're_exports', region_map, fixed_point, splits),
+        'non_member_imports': etl.process_nonmember(non_member_imports, 'imports', fixed_point),
+        'non_member_re_exports':
+            etl.process_nonmember(non_member_re_exports, 're_exports', fixed_point)
+    }
+
+    member = \
+        schema.unify([out['imports'], out['re_exports']])
+    member = member[0].merge(member[1], how='outer', on=keys)
+    non_member = \
+        schema.unify([out['non_member_imports'], out['non_member_re_exports']])
+    non_member = non_member[0].merge(non_member[1], how='outer', on=keys)
+
+    # combine member/non-member import/re-export data
+    imports_re_exports = \
+        pd.concat(schema.unify([member, non_member])).reset_index(drop=True)
+
+    # gather population, mapping country names onto the UN population names
+    imports_re_exports = population.enrich(
+        imports_re_exports, population.build_index(population_data), 'calendar_year',
+        {'population_boy': 'population_boy', 'population_mid': 'population_mid'},
+        country_map
+    )
+    out['imports_re_exports'] = imports_re_exports
+
+    return (out)
+
+
+def indicator_prices_stage(indicator_prices, engine='pandas'):
+    """ Build the monthly indicator price data set
+        indicator_prices: raw ICO indicator prices workbook
+        engine: etl engine (see ENGINES)
+    """
+    return ({'indicator_prices': ENGINES[engine].process_indicator_prices(indicator_prices)})
+
+
+def indicator_features_stage(indicator_prices, windows, spreads):
+    """ Build the monthly indicator price features and spreads between indicators
+        indicator_prices: processed indicator prices
+        windows: trailing windows of the rolling features, in months
+        spreads: list of (indicator_name, other_indicator_name) spreads
+    """
+    panel = prices.panel(indicator_prices)
+    return ({
+        'indicator_features': prices.indicator_features(panel, windows),
+        'indicator_spreads': prices.indicator_spreads(panel, spreads, windows)
+    })
+
+
+def grower_prices_stage(prices_paid_to_growers, engine='pandas'):
+    """ Build the prices paid to growers data set
+        prices_paid_to_growers: raw ICO grower prices workbook
+        engine: etl engine (see ENGINES)
+    """
+    return ({
+        'prices_paid_to_growers': ENGINES[engine].process_grower_prices(prices_paid_to_growers)
+    })
+
+
+def price_panel_stage(indicator_prices, prices_paid_to_growers, retail_prices):
+    """ Align indicator, grower and retail prices in one dense panel, and derive grower
+        prices against their indicator and the annual price table from it
+        indicator_prices: processed indicator prices
+        prices_paid_to_growers: processed grower prices
+        retail_prices: raw ICO retail prices workbook
+    """
+    panel = price_panel.build(
+        indicator_prices, prices_paid_to_growers, price_panel.retail_frame(retail_prices)
+    )
+    return ({
+        'grower_vs_indicator': price_panel.grower_vs_indicator(panel, prices_paid_to_growers),
+        'price_panel': price_panel.annual_table(panel)
+    })
+
+
+def retail_prices_stage(retail_prices):
+    """ Pass the raw retail prices through to the interim data
+        retail_prices: raw ICO retail prices workbook
+    """
+    return ({'retail_prices': retail_prices})
+
+
+def stock_projection_stage(producer_cropyear, projection_years=10, scenarios=1000, seed=0):
+    """ Project closing stocks forward, with quantiles over perturbed production and
+        consumption scenarios
+        producer_cropyear: producer crop year data set
+        projection_years: crop years to project past the last observed one
+        scenarios: number of simulated scenarios
+        seed: random seed of the scenarios
+    """
+    stock_panel = stocks.panel(producer_cropyear)
+    stock_projection = \
+        stocks.projection_table(stock_panel, projection_years, scenarios, seed=seed)
+    return ({'stock_projection': schema.compact(stock_projection)})
+
+
+def quality_stage(producer_cropyear, exports_calyear, imports_re_exports, population_data,
+                  checks, tolerance, quality_sample=None):
+    """ Check the stock identity, population join coverage and keys of the joined tables
+        producer_cropyear, exports_calyear, imports_re_exports: joined output tables
+        population_data: UN population data the tables were joined to
+        checks: dict of table name -> quality.TableChecks
+        tolerance: stock adjustment, in 1k bags, reported as a residual
+        quality_sample: share of rows the row-wise checks sample (None checks every row)
+    """
+    tables = {
+        'producer_cropyear': producer_cropyear,
+        'exports_calyear': exports_calyear,
+        'imports_re_exports': imports_re_exports
+    }
+    report = quality.check_tables(tables, checks, population_data, tolerance, quality_sample)
+    return ({'quality_report': report})
+
+
+def rollup_cube_stage(producer_cropyear, imports_re_exports, specs):
+    """ Pre-aggregate the joined tables by region, harvest group, ICO membership and year, so
+        dashboards read a few hundred rows instead of every country
+        producer_cropyear, imports_re_exports: joined output tables
+        specs: dict of table name -> cube.CubeSpec
+    """
+    tables = {
+        'producer_cropyear': producer_cropyear,
+        'imports_re_exports': imports_re_exports
+    }
+    return ({'rollup_cube': cube.build(tables, specs)})
+
+
+def tableau_waterfall_stage():
+    """ Create a helper file for Tableau waterfall
+    """
+    return ({'tableau_waterfall': pd.DataFrame({'point': [x for x in range(1, 21)]})})
+
+
+# code behind the population lookups of the joined stages
+POPULATION_LOOKUP = [
+    population.build_index,
+    population.country_ids,
+    population.positions,
+    population.enrich
+]
+
+# code behind the pandas engine's reshaping of parsed sheets
+RESHAPE = [ico_sheet.unpivot, ico_sheet.to_long, f.long_table, f.crop_year_begin]
+
+# code behind the polars engine's reshaping, and its producer/importer functions
+POLARS_RESHAPE = [etl_polars.wide, etl_polars.long, etl_polars.dollars, etl_polars.collect]
+POLARS_ETL = [
+    etl_polars.process_producer,
+    etl_polars.process_importer,
+    etl_polars.process_nonmember
+] + POLARS_RESHAPE
+
+# code behind apportioning aggregate entities
+APPORTION = [
+    apportion.pairs,
+    apportion.historical_shares,
+    apportion.population_shares,
+    apportion.fixed_shares,
+    apportion.shares,
+    apportion.split,
+    apportion.rollup
+]
+
+# stages in dependency order; outputs map each table to the folder it is written to
+STAGES = [
+    Stage(
+        name='population',
+        func=population_stage,
+        workbooks=[
+            'gross_opening_stocks',
+            'exports_calendar_year',
+            'imports',
+            're_exports',
+            'non_member_imports',
+            'non_member_re_exports'
+        ],
+        external={'population_file': POPULATION_FILE},
+        upstream=[],
+        params={
+            'aggregates': POPULATION_AGGREGATES,
+            'country_maps': [PRODUCER_COUNTRY_MAP, IMPORTER_COUNTRY_MAP]
+        },
+        code=[
+            sheet_countries,
+            sheet_years,
+            population.stream_population,
+            population.load_population
+        ] + APPORTION,
+        outputs={'population_data': 'interim'}
+    ),
+    Stage(
+        name='producer',
+        func=producer_stage,
+        workbooks=[
+            'total_production',
+            'domestic_consumption',
+            'gross_opening_stocks',
+            'exports_crop_year'
+        ],
+        external={},
+        upstream=['population_data'],
+        params={'country_map': PRODUCER_COUNTRY_MAP},
+        code=[producer_frame, f.process_producer, f.stock_calcs] + RESHAPE + POLARS_ETL
+        + POPULATION_LOOKUP,
+        outputs={
+            'total_production': 'interim',
+            'domestic_consumption': 'interim',
+            'gross_opening_stocks': 'interim',
+            'exports_crop_year': 'interim',
+            'producer_cropyear': 'processed'
+        }
+    ),
+    Stage(
+        name='exports_calendar_year',
+        func=exports_calendar_year_stage,
+        workbooks=['exports_calendar_year'],
+        external={},
+        upstream=['population_data'],
+        params={'country_map': PRODUCER_COUNTRY_MAP},
+        code=[f.process_producer] + RESHAPE + POLARS_ETL + POPULATION_LOOKUP,
+        outputs={'exports_calendar_year': 'interim', 'exports_calyear': 'processed'}
+    ),
+    Stage(
+        name='importer',
+        func=importer_stage,
+        workbooks=['imports', 're_exports', 'non_member_imports', 'non_member_re_exports'],
+        external={},
+        upstream=['population_data'],
+        params={
+            'region_map': MEMBER_REGIONS,
+            'country_map': IMPORTER_COUNTRY_MAP,
+            'splits': IMPORTER_SPLITS
+        },
+        code=[region_map_frame, f.process_importer, f.process_nonmember] + RESHAPE
+        + POLARS_ETL + APPORTION + POPULATION_LOOKUP,
+        outputs={
+            'imports': 'interim',
+            're_exports': 'interim',
+            'non_member_imports': 'interim',
+            'non_member_re_exports': 'interim',
+            'imports_re_exports': 'processed'
+        }
+    ),
+    Stage(
+        name='indicator_prices',
+        func=indicator_prices_stage,
+        workbooks=['indicator_prices'],
+        external={},
+        upstream=[],
+        params={},
+        code=[f.process_indicator_prices, etl_polars.process_indicator_prices]
+        + RESHAPE + POLARS_RESHAPE,
+        outputs={'indicator_prices': 'interim'}
+    ),
+    Stage(
+        name='indicator_features',
+        func=indicator_features_stage,
+        workbooks=[],
+        external={},
+        upstream=['indicator_prices'],
+        params={'windows': PRICE_WINDOWS, 'spreads': PRICE_SPREADS},
+        code=[
+            prices.panel,
+            prices.window_sums,
+            prices.rolling_mean,
+            prices.log_returns,
+            prices.rolling_volatility,
+            prices.drawdown,
+            prices.change,
+            prices.to_frame,
+            prices.indicator_features,
+            prices.indicator_spreads
+        ],
+        outputs={'indicator_features': 'processed', 'indicator_spreads': 'processed'}
+    ),
+    Stage(
+        name='grower_prices',
+        func=grower_prices_stage,
+        workbooks=['prices_paid_to_growers'],
+        external={},
+        upstream=[],
+        params={},
+        code=[f.process_grower_prices, etl_polars.process_grower_prices] + RESHAPE
+        + POLARS_RESHAPE,
+        outputs={'prices_paid_to_growers': 'interim'}
+    ),
+    Stage(
+        name='retail_prices',
+        func=retail_prices_stage,
+        workbooks=['retail_prices'],
+        external={},
+        upstream=[],
+        params={},
+        code=[],
+        outputs={'retail_prices': 'interim'}
+    ),
+    Stage(
+        name='price_panel',
+        func=price_panel_stage,
+        workbooks=[],
+        external={},
+        upstream=['indicator_prices', 'prices_paid_to_growers', 'retail_prices'],
+        params={},
+        code=[
+            prices.panel,
+            ico_sheet.unpivot,
+            price_panel.retail_frame,
+            price_panel.annual_block,
+            price_panel.build,
+            price_panel.annual_view,
+            price_panel.grower_vs_indicator,
+            price_panel.annual_table
+        ],
+        outputs={'grower_vs_indicator': 'processed', 'price_panel': 'processed'}
+    ),
+    Stage(
+        name='stock_projection',
+        func=stock_projection_stage,
+        workbooks=[],
+        external={},
+        upstream=['producer_cropyear'],
+        params={},
+        code=[
+            stocks.panel,
+            stocks.roll_forward,
+            stocks.carry_forward,
+            stocks.baseline_flows,
+            stocks.project,
+            stocks.simulate,
+            stocks.to_frame,
+            stocks.projection_table
+        ],
+        outputs={'stock_projection': 'processed'}
+    ),
+    Stage(
+        name='quality',
+        func=quality_stage,
+        workbooks=[],
+        external={},
+        upstream=['producer_cropyear', 'exports_calyear', 'imports_re_exports',
+                  'population_data'],
+        params={'checks': QUALITY_CHECKS, 'tolerance': QUALITY_TOLERANCE},
+        code=[
+            quality.sample_rows,
+            quality.anomalies,
+            quality.duplicate_keys,
+            quality.stock_checks,
+            quality.population_checks,
+            quality.check_table,
+            quality.check_tables,
+            population.country_ids
+        ],
+        outputs={'quality_report': 'interim'}
+    ),
+    Stage(
+        name='rollup_cube',
+        func=rollup_cube_stage,
+        workbooks=[],
+        external={},
+        upstream=['producer_cropyear', 'imports_re_exports'],
+        params={'specs': CUBE_SPECS},
+        code=[cube.group_codes, cube.rollup, cube.build],
+        outputs={'rollup_cube': 'processed'}
+    ),
+    Stage(
+        name='tableau_waterfall',
+        func=tableau_waterfall_stage,
+        workbooks=[],
+        external={},
+        upstream=[],
+        params={},
+        code=[],
+        outputs={'tableau_waterfall': 'processed'}
+    )
+]
+
+# stages run by each make_dataset --only target, with every stage downstream of them so no
+# output built from a rerun stage is left stale; the other stages' outputs are taken from the
+# last build
+TARGETS = {
+    'population': [
+        'population',
+        'producer',
+        'exports_calendar_year',
+        'importer',
+        'stock_projection',
+        'quality',
+        'rollup_cube'
+    ],
+    'producer': [
+        'producer',
+        'exports_calendar_year',
+        'stock_projection',
+        'quality',
+        'rollup_cube'
+    ],
+    'importer': ['importer', 'quality', 'rollup_cube'],
+    'prices': [
+        'indicator_prices',
+        'indicator_features',
+        'grower_prices',
+        'retail_prices',
+        'price_panel'
+    ]
+}
+
+
+def build_stages(**options):
+    """ STAGES with run options added to the params of the stages that accept them
+        options: e.g. fixed_point=True
+    """
+    stages = []
+    for stage in STAGES:
+        accepted = inspect.signature(stage.func).parameters
+        extra = {k: v for k, v in options.items() if k in accepted}
+        stages.append(stage._replace(params={**stage.params, **extra}))
+    return (stages)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import os
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+import src.data.apportion as apportion
+import src.data.instrument as instrument
+
+logger = logging.getLogger(__name__)
+
+WPP_COLUMNS = {
+    'Location': 'country',
+    'Time': 'year',
+    'TPopulation1Jan': 'population_boy',
+    'TPopulation1July': 'population_mid'
+}
+
+# ICO year columns population can be looked up by
+YEAR_BASES = ['crop_year_beg', 'crop_year_end', 'calendar_year']
+
+# dense (country x year) population lookup
+#   countries:  dict of population country -> row id
+#   first_year: year of the first column
+#   n_years:    number of year columns
+#   measures:   dict of measure -> flat float64 array of countries * years values, followed
+#               by a NaN slot that missing lookups point at
+PopulationIndex = namedtuple('PopulationIndex', ['countries', 'first_year', 'n_years', 'measures'])
+
+
+def sidecar_key(path, countries, years, aggregates):
+    """ Identify a filtered extract of a population file
+        path: UN WPP csv
+        countries: countries kept
+        years: (first, last) years kept
+        aggregates: apportion.Rule list of aggregate countries
+    """
+    stat = os.stat(path)
+    payload = {
+        'file': [os.path.basename(path), stat.st_size, stat.st_mtime_ns],
+        'countries': sorted(countries) if countries is not None else None,
+        'years': list(years) if years is not None else None,
+        'aggregates': [[r.aggregate, sorted(r.components)] for r in aggregates]
+    }
+    return (hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest())
+
+
+def stream_population(path, countries=None, years=None, aggregates=None, chunksize=200000):
+    """ Stream the UN WPP csv, keeping only the countries and years that are joined
+        path: UN WPP csv
+        countries: countries to keep (None keeps every location)
+        years: (first, last) years to keep, inclusive (None keeps every year)
+        aggregates: apportion.Rule list of aggregate countries, summed from their components
+        chunksize: rows parsed per chunk
+
+        peak memory grows with the rows kept rather than the size of the file
+    """
+    aggregates = list(aggregates or [])
+    components = {c for rule in aggregates for c in rule.components}
+    kept = []
+    parts = []
+    reader = pd.read_csv(path, usecols=list(WPP_COLUMNS), chunksize=chunksize)
+    for chunk in reader:
+        chunk = chunk.rename(columns=WPP_COLUMNS)
+        if years is not None:
+            chunk = chunk.loc[chunk.year.between(years[0], years[1])]
+        chunk = chunk.loc[:, list(WPP_COLUMNS.values())]
+        chunk['population_boy'] = chunk['population_boy'] * 1000
+        chunk['population_mid'] = chunk['population_mid'] * 1000
+        if components:
+            parts.append(chunk.loc[chunk.country.isin(components)])
+        kept.append(chunk if countries is None else chunk.loc[chunk.country.isin(countries)])
+
+    population = pd.concat(kept)
+    parts = pd.concat(parts) if parts else population.iloc[0:0]
+
+    combined = [population]
+    if aggregates:
+        combined.append(
+            apportion.rollup(parts, aggregates, ['population_boy', 'population_mid'])
+        )
+
+    return (pd.concat(combined))
+
+
+@instrument.instrumented
+def load_population(path, countries=None, years=None, aggregates=None, chunksize=200000):
+    """ Filtered UN population data, read from a binary sidecar when one matches
+        path: UN WPP csv
+        countries: countries to keep (None keeps every location)
+        years: (first, last) years to keep, inclusive (None keeps every year)
+        aggregates: apportion.Rule list of aggregate countries, summed from their components
+        chunksize: rows parsed per chunk
+
+        the sidecar sits next to the csv and is replaced whenever the file or filter changes
+    """
+    aggregates = list(aggregates or [])
+    sidecar = f'{path}.filtered.pkl'
+    key = sidecar_key(path, countries, years, aggregates)
+    if os.path.exists(sidecar):
+        cached = pd.read_pickle(sidecar)
+        if cached['key'] == key:
+            logger.info('population loaded from sidecar %s', sidecar)
+            return (cached['population'])
+
+    population = stream_population(path, countries, years, aggregates, chunksize)
+    pd.to_pickle({'key': key, 'population': population}, sidecar)
+    logger.info('population streamed from %s: %d rows kept', path, len(population))
+    return (population)
+
+
+def build_index(population_data, measures=('population_boy', 'population_mid')):
+    """ Lay population out as dense (country x year) arrays
+        population_data: population table with one row per country and year
+        measures: population columns to index
+    """
+    countries = sorted(population_data['country'].dropna().unique())
+    country_ids = {country: i for i, country in enumerate(countries)}
+    years = population_data['year'].to_numpy().astype('int64')
+    first_year = int(years.min())
+    n_years = int(years.max()) - first_year + 1
+    rows = population_data['country'].map(country_ids).to_numpy().astype('int64')
+    flat = rows * n_years + (years - first_year)
+
+    arrays = {}
+    for measure in measures:
+        values = np.full(len(countries) * n_years + 1, np.nan)
+        values[flat] = population_data[measure].to_numpy(dtype='float64')
+        arrays[measure] = values
+    return (PopulationIndex(country_ids, first_year, n_years, arrays))
+
+
+def country_ids(index, countries, country_map=None):
+    """ Row ids of ICO countries in a population index (-1 when unknown)
+        index: PopulationIndex
+        countries: Series of ICO country names
+        country_map: dict of ICO name -> population name
+
+        each distinct name is resolved once; rows gather the result by their code
+    """
+    country_map = country_map or {}
+    if isinstance(countries.dtype, pd.CategoricalDtype):
+        codes, labels = countries.cat.codes.to_numpy(), countries.cat.categories
+    else:
+        codes, labels = pd.factorize(countries)
+    resolved = np.array(
+        [index.countries.get(country_map.get(label, label), -1) for label in labels] + [-1],
+        dtype='int64'
+    )
+    return (resolved[codes])
+
+
+def positions(index, countries, years, country_map=None):
+    """ Flat positions of (country, year) pairs in a population index; pairs outside the
+        index point at its NaN slot
+        index: PopulationIndex
+        countries: Series of ICO country names
+        years: Series of years
+        country_map: dict of ICO name -> population name
+    """
+    rows = country_ids(index, countries, country_map)
+    cols = years.to_numpy().astype('int64') - index.first_year
+    found = (rows >= 0) & (cols >= 0) & (cols < index.n_years)
+    missing = len(index.countries) * index.n_years
+    return (np.where(found, rows * index.n_years + cols, missing))
+
+
+@instrument.instrumented
+def enrich(df, index, year, columns, country_map=None):
+    """ Add population columns to an ICO table by gathering from a population index
+        df: ICO table with a country column
+        index: PopulationIndex
+        year: year column to look population up by (crop_year_beg, crop_year_end or
+              calendar_year)
+        columns: dict of new column -> population measure
+        country_map: dict of ICO name -> population name
+    """
+    if year not in YEAR_BASES:
+        raise ValueError(f'Unrecognized population year basis: {year}')
+    flat = positions(index, df['country'], df[year], country_map)
+    return (
+        df.assign(**{
+            column: np.take(index.measures[measure], flat)
+            for column, measure in columns.items()
+        })
+    )
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+import re
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+import src.data.ico_sheet as ico_sheet
+import src.data.instrument as instrument
+import src.data.prices as prices
+import src.data.schema as schema
+
+# price series of the panel, in US cents per lb
+#   indicator:        monthly price of the entity's reference indicator
+#   indicator_annual: ICO annual average of the reference indicator
+#   grower:           annual price paid to growers
+#   retail:           annual retail price of roasted coffee
+SERIES = ['indicator', 'indicator_annual', 'grower', 'retail']
+
+# series holding one value per year, repeated over its twelve months
+ANNUAL_SERIES = ['indicator_annual', 'grower', 'retail']
+
+# indicator retail prices are compared against
+RETAIL_REFERENCE = 'ico_composite_indicator'
+
+# prices of every series as one dense (series x entity x month) array
+#   countries:  country of each entity
+#   indicators: reference indicator_name of each entity; a grower country reporting under
+#               two indicator groups is one entity per group
+#   first_year: calendar year of the first month, which is January
+#   values:     float64 array, NaN where a series has no price
+Panel = namedtuple('Panel', ['countries', 'indicators', 'first_year', 'values'])
+
+
+def retail_frame(raw):
+    """ Long retail prices of the raw ICO retail workbook
+        raw: object DataFrame of the workbook as read by pandas (see retail_prices_stage)
+
+        country rows follow the 'Calendar years' header row; region rows without prices,
+        footnotes ('1 Soluble coffee') and the copyright line are dropped, and the markers of
+        those footnotes are stripped from country names ('Malta 1')
+    """
+    labels = raw.iloc[:, 0].astype(object)
+    header = labels.index[labels.astype(str).str.strip() == 'Calendar years'][0]
+    years = raw.loc[header].iloc[1:]
+    body = raw.loc[header + 1:]
+    body = body.loc[body.iloc[:, 0].notna()]
+    names = body.iloc[:, 0].astype(str).str.strip()
+    footnotes = names.str.extract(r'^(\d+)\s', expand=False).dropna().tolist()
+    body = body.loc[~names.str.match(r'^(\d|©)')]
+    marker = re.compile(rf"\s+({'|'.join(footnotes)})$") if footnotes else None
+    countries = [
+        marker.sub('', str(c).strip()) if marker else str(c).strip() for c in body.iloc[:, 0]
+    ]
+    x = ico_sheet.unpivot(
+        {'country': countries}, 'calendar_year',
+        years.to_numpy(dtype='float64').astype('int64'), 'retail_price_dollars_per_lb',
+        body.iloc[:, 1:].to_numpy(dtype='float64')
+    )
+    x = x.loc[x['retail_price_dollars_per_lb'].notna()].reset_index(drop=True)
+    return (schema.compact(x))
+
+
+def annual_block(codes, years, values, shape, first_year):
+    """ Dense (entity x year) array of annual values at integer positions
+        codes: entity position of each value
+        years: calendar year of each value
+        values: values
+        shape: (entities, years)
+        first_year: calendar year of the first column
+    """
+    out = np.full(shape, np.nan)
+    out[codes, np.asarray(years, dtype='int64') - first_year] = values
+    return (out)
+
+
+@instrument.instrumented
+def build(indicator_prices, growers, retail):
+    """ Lay indicator, grower and retail prices out in one Panel
+        indicator_prices: processed indicator prices
+        growers: processed prices paid to growers
+        retail: long retail prices (see retail_frame)
+
+        entities are the grower (country, indicator group) pairs followed by the retail
+        countries, whose reference is the composite indicator
+    """
+    keys = pd.concat([
+        pd.DataFrame({'country': growers['country'].astype(object),
+                      'indicator_name': growers['indicator_name'].astype(object)}),
+        pd.DataFrame({'country': retail['country'].astype(object),
+                      'indicator_name': RETAIL_REFERENCE})
+    ]).drop_duplicates().reset_index(drop=True)
+    countries, indicators = keys['country'].tolist(), keys['indicator_name'].tolist()
+
+    monthly = prices.panel(indicator_prices)
+    years = np.concatenate([
+        np.asarray(growers['calendar_year'], dtype='int64'),
+        np.asarray(retail['calendar_year'], dtype='int64'),
+        [monthly.first_year, monthly.first_year + monthly.values.shape[1] // 12 - 1]
+    ])
+    first_year = int(years.min())
+    shape = (len(keys), int(years.max()) - first_year + 1)
+
+    # indicator rows of each entity's reference, NaN-filled where the indicator is missing
+    position = {name: i for i, name in enumerate(monthly.indicators)}
+    rows = np.array([position.get(name, -1) for name in indicators])
+    ann = indicator_prices.loc[indicator_prices['calendar_month'] == 'January']
+    ann_block = np.full((len(monthly.indicators), monthly.values.shape[1] // 12), np.nan)
+    ann_block[
+        ann['indicator_name'].astype(object).map(position).to_numpy(),
+        ann['calendar_year'].to_numpy().astype('int64') - monthly.first_year
+    ] = ann['indicator_price_cents_per_lb_ann'].to_numpy(dtype='float64')
+
+    values = np.full((len(SERIES), shape[0], shape[1] * 12), np.nan)
+    offset = (monthly.first_year - first_year) * 12
+    span = slice(offset, offset + monthly.values.shape[1])
+    found = rows >= 0
+    values[0, found, span] = monthly.values[rows[found]]
+    annual = np.full(shape, np.nan)
+    annual[found, offset // 12:offset // 12 + ann_block.shape[1]] = ann_block[rows[found]]
+    values[1] = np.repeat(annual, 12, axis=-1)
+
+    entity = {key: i for i, key in enumerate(zip(countries, indicators))}
+    grower_codes = [
+        entity[key] for key in zip(growers['country'].astype(object),
+                                   growers['indicator_name'].astype(object))
+    ]
+    values[2] = np.repeat(annual_block(
+        grower_codes, growers['calendar_year'],
+        growers['price_paid_cents_per_lb'].to_numpy(dtype='float64'), shape, first_year
+    ), 12, axis=-1)
+    retail_codes = [entity[(c, RETAIL_REFERENCE)] for c in retail['country'].astype(object)]
+    values[3] = np.repeat(annual_block(
+        retail_codes, retail['calendar_year'],
+        retail['retail_price_dollars_per_lb'].to_numpy(dtype='float64') * 100, shape,
+        first_year
+    ), 12, axis=-1)
+    return (Panel(countries, indicators, first_year, values))
+
+
+def monthly_view(panel, series):
+    """ (entity x month) prices of a series; a view of the panel buffer
+        panel: Panel
+        series: one of SERIES
+    """
+    return (panel.values[SERIES.index(series)])
+
+
+def annual_view(panel, series):
+    """ (entity x year) prices of an annual series: the January column of each year, a
+        strided view of the panel buffer
+        panel: Panel
+        series: one of ANNUAL_SERIES
+    """
+    if series not in ANNUAL_SERIES:
+        raise ValueError(f'{series} is not an annual series; use one of {ANNUAL_SERIES}')
+    return (panel.values[SERIES.index(series), :, ::12])
+
+
+@instrument.instrumented
+def grower_vs_indicator(panel, growers):
+    """ Grower prices with the annual average price of their indicator, gathered from the
+        panel at each grower row's (entity, year) position
+        panel: Panel
+        growers: processed prices paid to growers, the rows of the result
+    """
+    entity = {key: i for i, key in enumerate(zip(panel.countries, panel.indicators))}
+    codes = np.array([
+        entity[key] for key in zip(growers['country'].astype(object),
+                                   growers['indicator_name'].astype(object))
+    ], dtype='int64')
+    years = growers['calendar_year'].to_numpy().astype('int64') - panel.first_year
+    cents = annual_view(panel, 'indicator_annual')[codes, years]
+    return (growers.assign(
+        indicator_price_cents_per_lb_ann=cents,
+        indicator_price_dollars_per_lb_ann=cents / 100
+    ))
+
+
+@instrument.instrumented
+def annual_table(panel):
+    """ Long (country, indicator, year) table of the annual series with grower share of the
+        indicator and retail markup over it, computed on the aligned arrays
+        panel: Panel
+    """
+    indicator = annual_view(panel, 'indicator_annual')
+    grower = annual_view(panel, 'grower')
+    retail = annual_view(panel, 'retail')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        columns = {
+            'indicator_price_cents_per_lb_ann': indicator,
+            'grower_price_cents_per_lb': grower,
+            'retail_price_cents_per_lb': retail,
+            'grower_share_of_indicator': grower / indicator,
+            'retail_markup_cents_per_lb': retail - indicator,
+            'retail_to_indicator_ratio': retail / indicator
+        }
+    n_entities, n_years = grower.shape
+    frame = pd.DataFrame({
+        'country': np.repeat(np.array(panel.countries, dtype=object), n_years),
+        'indicator_name': np.repeat(np.array(panel.indicators, dtype=object), n_years),
+        'calendar_year': np.tile(np.arange(panel.first_year, panel.first_year + n_years),
+                                 n_entities),
+        **{column: values.ravel() for column, values in columns.items()}
+    })
+    priced = np.isfinite(grower.ravel()) | np.isfinite(retail.ravel())
+    return (schema.compact(frame.loc[priced].reset_index(drop=True)))
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import calendar
+import warnings
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+import src.data.instrument as instrument
+import src.data.schema as schema
+
+MONTHS = list(calendar.month_name)[1:]
+
+# monthly indicator prices as a dense (indicator x month) array in cents per lb
+#   indicators: indicator_name of each row
+#   first_year: calendar year of the first column, which is January
+#   values:     float64 array, NaN where an indicator has no price for a month
+PricePanel = namedtuple('PricePanel', ['indicators', 'first_year', 'values'])
+
+
+def panel(df):
+    """ Lay monthly indicator prices out as a PricePanel
+        df: table with indicator_name, calendar_year, calendar_month (month names) and
+            indicator_price_cents_per_lb (e.g. indicator_prices)
+    """
+    rows, indicators = pd.factorize(df['indicator_name'].astype(object), sort=True)
+    years = df['calendar_year'].to_numpy().astype('int64')
+    months = df['calendar_month'].astype(object).map(MONTHS.index).to_numpy().astype('int64')
+    first_year = int(years.min())
+    cols = (years - first_year) * 12 + months
+    values = np.full((len(indicators), (int(years.max()) - first_year + 1) * 12), np.nan)
+    values[rows, cols] = df['indicator_price_cents_per_lb'].to_numpy(dtype='float64')
+    return (PricePanel(list(indicators), first_year, values))
+
+
+def window_sums(values, window):
+    """ Sums and counts of the finite values in every trailing window along the last axis,
+        from one cumulative sum
+        values: array, time along the last axis
+        window: window length
+
+        returns (sums, counts), aligned to the last element of each window and 0 until the
+        first full window
+    """
+    finite = np.isfinite(values)
+    zero = np.zeros(values.shape[:-1] + (1,))
+    sums = np.concatenate([zero, np.cumsum(np.where(finite, values, 0), axis=-1)], axis=-1)
+    counts = np.concatenate([zero, np.cumsum(finite, axis=-1)], axis=-1)
+    out_sums = np.zeros_like(values)
+    out_counts = np.zeros_like(values)
+    out_sums[..., window - 1:] = sums[..., window:] - sums[..., :-window]
+    out_counts[..., window - 1:] = counts[..., window:] - counts[..., :-window]
+    return (out_sums, out_counts)
+
+
+def rolling_mean(values, window):
+    """ Trailing mean over complete windows (NaN where any value in the window is missing)
+        values: array, time along the last axis
+        window: window length
+    """
+    sums, counts = window_sums(values, window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (np.where(counts == window, sums / window, np.nan))
+
+
+def log_returns(values):
+    """ Period-on-period log returns, NaN for the first period
+    """
+    out = np.full_like(values, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out[..., 1:] = np.log(values[..., 1:] / values[..., :-1])
+    return (out)
+
+
+def rolling_volatility(values, window, periods_per_year=12):
+    """ Annualized standard deviation of log returns over complete trailing windows
+        values: array of prices, time along the last axis
+        window: window length, in returns
+        periods_per_year: periods in a year, to annualize
+    """
+    returns = log_returns(values)
+    sums, counts = window_sums(returns, window)
+    squares, _ = window_sums(returns ** 2, window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variance = np.fmax(0, (squares - sums ** 2 / window) / (window - 1))
+        return (np.where(counts == window, np.sqrt(variance * periods_per_year), np.nan))
+
+
+def drawdown(values):
+    """ Fall from the running peak, as a fraction of the peak (0 at a new high)
+        values: array of prices, time along the last axis
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        peak = np.fmax.accumulate(values, axis=-1)
+        return (values / peak - 1)
+
+
+def change(values, lag=12):
+    """ Relative change from `lag` periods before (12 months: year over year)
+        values: array, time along the last axis
+        lag: periods between the compared values
+    """
+    out = np.full_like(values, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out[..., lag:] = values[..., lag:] / values[..., :-lag] - 1
+    return (out)
+
+
+def to_frame(prices, columns, names=None):
+    """ Long (indicator, year, month) table of (indicator x month) arrays
+        prices: PricePanel
+        columns: dict of column -> (row x month) array
+        names: dict of column -> name of each array row (default: the indicator names)
+    """
+    n_rows, n_months = next(iter(columns.values())).shape
+    month = np.tile(np.arange(n_months), n_rows)
+    frame = pd.DataFrame({
+        **{col: np.repeat(labels, n_months) for col, labels in (names or {
+            'indicator_name': prices.indicators
+        }).items()},
+        'calendar_year': prices.first_year + month // 12,
+        'calendar_month': np.array(MONTHS, dtype=object)[month % 12]
+    })
+    frame = frame.assign(**{column: values.ravel() for column, values in columns.items()})
+    return (schema.compact(frame.loc[np.isfinite(columns[next(iter(columns))].ravel())]
+                           .reset_index(drop=True)))
+
+
+@instrument.instrumented
+def indicator_features(prices, windows=(3, 12)):
+    """ Rolling means and volatility, drawdown and year-over-year change of every indicator,
+        each computed over all indicators and months at once
+        prices: PricePanel
+        windows: trailing windows, in months
+    """
+    values = prices.values
+    columns = {'indicator_price_cents_per_lb': values}
+    for window in windows:
+        columns[f'mean_{window}m_cents_per_lb'] = rolling_mean(values, window)
+    for window in windows:
+        columns[f'volatility_{window}m'] = rolling_volatility(values, window)
+    columns['drawdown'] = drawdown(values)
+    columns['yoy_change'] = change(values, 12)
+    return (to_frame(prices, columns))
+
+
+@instrument.instrumented
+def indicator_spreads(prices, pairs, windows=(3, 12)):
+    """ Price spreads between pairs of indicators, with their rolling means and changes
+        prices: PricePanel
+        pairs: list of (indicator_name, other_indicator_name); pairs not in the panel are
+               left out
+        windows: trailing windows, in months
+    """
+    position = {name: i for i, name in enumerate(prices.indicators)}
+    pairs = [(a, b) for a, b in pairs if a in position and b in position]
+    if not pairs:
+        return (pd.DataFrame())
+    first = prices.values[[position[a] for a, _ in pairs]]
+    second = prices.values[[position[b] for _, b in pairs]]
+    spread = first - second
+    columns = {'spread_cents_per_lb': spread}
+    for window in windows:
+        columns[f'spread_mean_{window}m_cents_per_lb'] = rolling_mean(spread, window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        columns['price_ratio'] = first / second
+    columns['spread_yoy_change_cents_per_lb'] = np.full_like(spread, np.nan)
+    columns['spread_yoy_change_cents_per_lb'][:, 12:] = spread[:, 12:] - spread[:, :-12]
+    names = {
+        'indicator_name': [a for a, _ in pairs],
+        'other_indicator_name': [b for _, b in pairs]
+    }
+    return (to_frame(prices, columns, names))
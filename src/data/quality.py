@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+import logging
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+import src.data.instrument as instrument
+import src.data.population as population
+import src.data.schema as schema
+import src.data.units  # noqa: F401  registers the DataFrame.units accessor
+
+logger = logging.getLogger(__name__)
+
+# invariants checked on one output table
+#   keys:        columns that identify a row; duplicated keys are reported
+#   year:        integer year column anomalies are reported by
+#   population:  population columns joined to the table (empty for none)
+#   country_map: dict of ICO name -> population name used by the join
+TableChecks = namedtuple('TableChecks', ['keys', 'year', 'population', 'country_map'])
+
+# columns of the anomaly report; one row per anomalous table row, except for duplicate keys
+# and unknown countries, which are reported once with the rows they affect
+#   check: duplicate_key, stock_residual, negative_close, population_country or
+#          population_missing
+#   value: stock adjustment or the clipped closing stock in 1k bags, NaN for the others
+REPORT_COLUMNS = ['table', 'check', 'country', 'year', 'value', 'rows']
+
+# checks and their description, in report order
+CHECKS = {
+    'duplicate_key': 'key columns identify more than one row',
+    'stock_residual': 'next opening stock differs from the rolled-forward closing stock',
+    'negative_close': 'rolled-forward closing stock was negative and clipped to 0',
+    'population_country': 'country is not in the population data (country map gap)',
+    'population_missing': 'country is known but has no population for the year'
+}
+
+
+def sample_rows(n, fraction=None, seed=0):
+    """ Rows the row-wise checks look at: every row, or a sorted random sample
+        n: rows in the table
+        fraction: share of rows to check (None or 1 checks every row)
+        seed: random seed of the sample
+
+        returns a slice over every row, so full checks index views of the columns
+    """
+    if fraction is None or fraction >= 1:
+        return (slice(None))
+    size = max(1, int(round(n * fraction)))
+    return (np.sort(np.random.default_rng(seed).choice(n, size=min(size, n), replace=False)))
+
+
+def anomalies(table, check, countries, years, mask, values=None, rows=None):
+    """ Report rows of the table rows flagged by a mask
+        table: table name
+        check: check name (see CHECKS)
+        countries, years: arrays of the checked rows
+        mask: boolean array of the anomalous rows
+        values: array of the value reported with each row
+        rows: array of the table rows each report row stands for (default 1)
+    """
+    count = int(mask.sum())
+    return (pd.DataFrame({
+        'table': [table] * count,
+        'check': [check] * count,
+        'country': countries[mask],
+        'year': years[mask],
+        'value': values[mask] if values is not None else np.full(count, np.nan),
+        'rows': rows[mask] if rows is not None else np.ones(count, dtype='int64')
+    }))
+
+
+def duplicate_keys(table, df, checks):
+    """ Key combinations of a table held by more than one row, hashed once over every row
+        table: table name
+        df: output table
+        checks: TableChecks
+    """
+    duplicated = df.duplicated(checks.keys, keep=False).to_numpy()
+    if not duplicated.any():
+        return (None)
+    dup = df.loc[duplicated, list(dict.fromkeys(checks.keys + ['country', checks.year]))]
+    counts = dup.groupby(checks.keys, observed=True, sort=False)[checks.year].transform('size')
+    first = ~dup.duplicated(checks.keys).to_numpy()
+    return (anomalies(
+        table, 'duplicate_key', dup['country'].to_numpy(dtype=object),
+        dup[checks.year].to_numpy(), first, rows=counts.to_numpy()
+    ))
+
+
+def stock_checks(table, df, rows, countries, years, tolerance):
+    """ Stock identity residuals and clipped negative closing stocks of the checked rows
+        table: table name
+        df: table with stock_adj and imports (the clipped part of the closing stock)
+        rows: checked rows (see sample_rows)
+        countries, years: arrays of the checked rows
+        tolerance: stock adjustment, in 1k bags, reported as a residual
+    """
+    adj = df.units.get('stock_adj', '1k_bags').to_numpy(dtype='float64')[rows]
+    clipped = df.units.get('imports', '1k_bags').to_numpy(dtype='float64')[rows]
+    with np.errstate(invalid='ignore'):
+        return ([
+            anomalies(table, 'stock_residual', countries, years, np.abs(adj) > tolerance, adj),
+            anomalies(table, 'negative_close', countries, years, clipped > 0, -clipped)
+        ])
+
+
+def population_checks(table, df, rows, countries, years, checks, index):
+    """ Countries the population join cannot resolve, and known countries without population
+        for a year, among the checked rows
+        table: table name
+        df: table with joined population columns
+        rows: checked rows (see sample_rows)
+        countries, years: arrays of the checked rows
+        checks: TableChecks
+        index: PopulationIndex of the population data the table was joined to
+    """
+    ids = population.country_ids(index, df['country'], checks.country_map)[rows]
+    unknown = ids < 0
+    missing = ~unknown & np.column_stack([
+        np.isnan(df[col].to_numpy(dtype='float64')[rows]) for col in checks.population
+    ]).any(axis=1)
+    _, first, counts = np.unique(countries[unknown].astype(str), return_index=True,
+                                 return_counts=True)
+    per_country = np.zeros(len(countries), dtype=bool)
+    per_country[np.flatnonzero(unknown)[first]] = True
+    rows_of = np.zeros(len(countries), dtype='int64')
+    rows_of[np.flatnonzero(unknown)[first]] = counts
+    return ([
+        anomalies(table, 'population_country', countries, years, per_country, rows=rows_of),
+        anomalies(table, 'population_missing', countries, years, missing)
+    ])
+
+
+@instrument.instrumented
+def check_table(table, df, checks, index=None, tolerance=1.0, fraction=None, seed=0):
+    """ Every invariant of one table in a single pass over its columns
+        table: table name
+        df: output table
+        checks: TableChecks
+        index: PopulationIndex the table was joined to (None skips the population checks)
+        tolerance: stock adjustment, in 1k bags, reported as a residual
+        fraction: share of rows the row-wise checks sample (None checks every row); duplicate
+                  keys are always checked over the whole table
+        seed: random seed of the sample
+
+        columns are read as arrays, so a full check copies no table data
+    """
+    rows = sample_rows(len(df), fraction, seed)
+    countries = df['country'].to_numpy(dtype=object)[rows]
+    years = df[checks.year].to_numpy()[rows]
+    frames = [duplicate_keys(table, df, checks)]
+    if 'stock_adj_1k_bags' in df.columns:
+        frames += stock_checks(table, df, rows, countries, years, tolerance)
+    if index is not None and checks.population:
+        frames += population_checks(table, df, rows, countries, years, checks, index)
+    frames = [frame for frame in frames if frame is not None and len(frame)]
+    if not frames:
+        return (pd.DataFrame(columns=REPORT_COLUMNS))
+    return (pd.concat(frames, ignore_index=True))
+
+
+def summary(report):
+    """ Anomaly counts by table and check
+        report: anomaly report
+    """
+    return (report.groupby(['table', 'check'], observed=True, sort=False).size())
+
+
+@instrument.instrumented
+def check_tables(tables, checks, population_data=None, tolerance=1.0, fraction=None, seed=0):
+    """ Anomaly report of several output tables
+        tables: dict of table name -> output table
+        checks: dict of table name -> TableChecks
+        population_data: population table the tables were joined to
+        tolerance: stock adjustment, in 1k bags, reported as a residual
+        fraction: share of rows the row-wise checks sample (None checks every row)
+        seed: random seed of the sample
+
+        anomaly counts are logged as warnings
+    """
+    index = None if population_data is None else population.build_index(population_data)
+    report = pd.concat(
+        [check_table(name, tables[name], table_checks, index, tolerance, fraction, seed)
+         for name, table_checks in checks.items()],
+        ignore_index=True
+    )
+    report['check'] = pd.Categorical(report['check'], categories=list(CHECKS))
+    report = report.sort_values(['table', 'check'], kind='stable').reset_index(drop=True)
+    for (table, check), count in summary(report).items():
+        logger.warning('quality %s: %d %s (%s)', table, count, check, CHECKS[check])
+    return (schema.compact(report.astype({'year': 'int64', 'rows': 'int64'})))
@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+import click
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import pandas as pd
+import src.data.sinks as sinks
+
+logger = logging.getLogger(__name__)
+
+# processed datasets served, with the columns they are indexed on
+#   keys: columns with a hash index (value -> row positions)
+#   year: column with a sorted index, for year ranges
+DATASETS = {
+    'producer_cropyear': {'keys': ['country', 'harvest_group'], 'year': 'crop_year_beg'},
+    'imports_re_exports': {'keys': ['region', 'country', 'ico_member'], 'year': 'calendar_year'},
+    'grower_vs_indicator': {'keys': ['country', 'indicator_name'], 'year': 'calendar_year'}
+}
+
+AGGREGATES = ['sum', 'mean', 'median', 'min', 'max', 'count']
+
+# a loaded dataset and its indexes
+#   frame:        the table
+#   keys:         dict of key column -> dict of value -> sorted row positions
+#   year:         year column
+#   year_order:   row positions sorted by year
+#   sorted_years: year of each position in year_order
+Table = namedtuple('Table', ['frame', 'keys', 'year', 'year_order', 'sorted_years'])
+
+# loaded datasets with a bounded cache of query results
+#   tables:     dict of dataset -> Table
+#   cache:      OrderedDict of query key -> result, least recently used first
+#   cache_size: results kept before the least recently used is evicted
+#   stats:      dict of cache hits, misses and evictions
+#   lock:       guards cache and stats across server threads
+Store = namedtuple('Store', ['tables', 'cache', 'cache_size', 'stats', 'lock'])
+
+
+def index_table(df, keys, year):
+    """ Build the hash and sorted indexes of a dataset
+        df: pandas DataFrame
+        keys: key columns to hash
+        year: year column to sort
+    """
+    df = df.reset_index(drop=True)
+    hashed = {
+        col: {
+            str(value): np.sort(positions)
+            for value, positions in df.groupby(col, sort=False, observed=True).indices.items()
+        }
+        for col in keys
+    }
+    years = df[year].to_numpy(dtype='float64')
+    order = np.argsort(years, kind='stable')
+    return (Table(df, hashed, year, order, years[order]))
+
+
+def load_store(folder, fmt='csv', datasets=None, cache_size=256):
+    """ Load processed datasets once and index them
+        folder: processed folder
+        fmt: format the tables were written in (csv, parquet, arrow)
+        datasets: dataset names to load (default: every name in DATASETS)
+        cache_size: query results kept in the cache (0 disables caching)
+    """
+    tables = {}
+    for name in datasets or list(DATASETS):
+        df = sinks.read_table(sinks.table_path(folder, name, fmt), fmt)
+        tables[name] = index_table(df, DATASETS[name]['keys'], DATASETS[name]['year'])
+    stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+    return (Store(tables, OrderedDict(), cache_size, stats, threading.Lock()))
+
+
+def numeric_measures(frame, measures):
+    """ Check that aggregated measures are numeric columns of a dataset
+        frame: the dataset
+        measures: measure columns
+
+        raises ValueError naming the missing and non-numeric measures
+    """
+    missing = [c for c in measures if c not in frame.columns]
+    if missing:
+        raise ValueError(f'Unrecognized measures: {missing}')
+    text = [c for c in measures if not pd.api.types.is_numeric_dtype(frame[c])]
+    if text:
+        raise ValueError(f'Measures must be numeric columns to aggregate: {text}')
+
+
+def normalize(where=None, years=None, group_by=None, measures=None, agg=None, frame=None):
+    """ Canonical form of a query's arguments, so equal queries share a cache entry
+        where: dict of key column -> value or list of values
+        years: (first, last) years, inclusive; either may be None
+        group_by: columns to group by
+        measures: measure columns to return or aggregate
+        agg: one of AGGREGATES, or None to return the matching rows
+        frame: dataset the query runs against; aggregated measures must be its numeric columns
+    """
+    where = {
+        col: sorted({str(v) for v in (values if isinstance(values, (list, tuple, set))
+                                      else [values])})
+        for col, values in (where or {}).items()
+    }
+    if agg is not None and agg not in AGGREGATES:
+        raise ValueError(f'Unrecognized aggregate: {agg}')
+    if agg is not None and frame is not None:
+        numeric_measures(frame, list(measures or []))
+    years = None if years is None or years == (None, None) else list(years)
+    return ({
+        'where': where,
+        'years': years,
+        'group_by': list(group_by or []),
+        'measures': list(measures or []),
+        'agg': agg
+    })
+
+
+def positions(table, where, years):
+    """ Sorted positions of the rows matching the filters, None when nothing is filtered
+        table: Table
+        where, years: normalized filters (see normalize)
+    """
+    found = None
+    for col, values in where.items():
+        if col not in table.keys:
+            raise ValueError(f'{col} is not an indexed column; use one of {list(table.keys)}')
+        index = table.keys[col]
+        hits = [index[v] for v in values if v in index]
+        rows = np.concatenate(hits) if hits else np.empty(0, dtype=np.intp)
+        found = rows if found is None else np.intersect1d(found, rows, assume_unique=True)
+    if years is not None:
+        first = -np.inf if years[0] is None else years[0]
+        last = np.inf if years[1] is None else years[1]
+        lo = np.searchsorted(table.sorted_years, first, side='left')
+        hi = np.searchsorted(table.sorted_years, last, side='right')
+        rows = table.year_order[lo:hi]
+        found = rows if found is None else np.intersect1d(found, rows, assume_unique=True)
+    return (None if found is None else np.sort(found))
+
+
+def aggregate(rows, group_by, measures, agg):
+    """ Group and aggregate matching rows, or select their columns when agg is None
+        rows: matching rows
+        group_by, measures, agg: normalized query (see normalize)
+    """
+    if agg is None:
+        columns = group_by + measures
+        return (rows[columns].reset_index(drop=True) if columns else rows.reset_index(drop=True))
+    if not measures:
+        raise ValueError('aggregate queries need measures')
+    if not group_by:
+        return (rows[measures].agg(agg).to_frame().T.reset_index(drop=True))
+    return (
+        rows
+        .groupby(group_by, sort=True, observed=True)[measures]
+        .agg(agg)
+        .reset_index()
+    )
+
+
+def evaluate(table, spec):
+    """ Answer a normalized query from a table's indexes
+        table: Table
+        spec: normalized query (see normalize)
+    """
+    found = positions(table, spec['where'], spec['years'])
+    rows = table.frame if found is None else table.frame.take(found)
+    return (aggregate(rows, spec['group_by'], spec['measures'], spec['agg']))
+
+
+def query(store, dataset, where=None, years=None, group_by=None, measures=None, agg=None):
+    """ Filter and aggregate a loaded dataset, answering repeated queries from the cache
+        store: Store returned by load_store
+        dataset: dataset name
+        where: dict of key column -> value or list of values
+        years: (first, last) years, inclusive
+        group_by: columns to group by
+        measures: measure columns to return or aggregate
+        agg: one of AGGREGATES, or None to return the matching rows
+
+        cached results are shared between callers and must not be modified
+    """
+    if dataset not in store.tables:
+        raise ValueError(f'Unrecognized dataset: {dataset}')
+    spec = normalize(where, years, group_by, measures, agg, store.tables[dataset].frame)
+    key = json.dumps([dataset, spec], sort_keys=True)
+    with store.lock:
+        if key in store.cache:
+            store.cache.move_to_end(key)
+            store.stats['hits'] += 1
+            return (store.cache[key])
+        store.stats['misses'] += 1
+
+    result = evaluate(store.tables[dataset], spec)
+
+    with store.lock:
+        if store.cache_size > 0:
+            store.cache[key] = result
+            while len(store.cache) > store.cache_size:
+                store.cache.popitem(last=False)
+                store.stats['evictions'] += 1
+    return (result)
+
+
+def filter_frame(df, dataset, spec):
+    """ Boolean-mask filtering of a freshly read table, the baseline the indexes replace
+        df: pandas DataFrame
+        dataset: dataset name
+        spec: normalized query (see normalize)
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for col, values in spec['where'].items():
+        mask &= df[col].astype(str).isin(values).to_numpy()
+    if spec['years'] is not None:
+        years = df[DATASETS[dataset]['year']]
+        first, last = spec['years']
+        if first is not None:
+            mask &= (years >= first).to_numpy()
+        if last is not None:
+            mask &= (years <= last).to_numpy()
+    return (df.loc[mask])
+
+
+def reread_query(folder, dataset, spec, fmt='csv'):
+    """ Answer a normalized query by re-reading the dataset from disk
+        folder: processed folder
+        dataset: dataset name
+        spec: normalized query (see normalize)
+        fmt: format the tables were written in
+    """
+    df = sinks.read_table(sinks.table_path(folder, dataset, fmt), fmt)
+    rows = filter_frame(df, dataset, spec)
+    return (aggregate(rows, spec['group_by'], spec['measures'], spec['agg']))
+
+
+def workload(store, n, distinct=50, seed=0):
+    """ Random dashboard-like queries: countries, a year range, an optional grouping and
+        aggregate over a few measures
+        store: Store
+        n: number of queries
+        distinct: number of different queries the workload draws from
+        seed: random seed
+
+        returns a list of (dataset, normalized query)
+    """
+    rng = np.random.default_rng(seed)
+    pool = []
+    for _ in range(distinct):
+        dataset = str(rng.choice(list(store.tables)))
+        table = store.tables[dataset]
+        countries = sorted(table.keys['country'])
+        where = {'country': list(rng.choice(countries, size=min(3, len(countries)),
+                                            replace=False))}
+        years = table.sorted_years[~np.isnan(table.sorted_years)]
+        first = int(rng.integers(years.min(), years.max() + 1))
+        measures = [
+            c for c in table.frame.select_dtypes('number').columns
+            if c != table.year and c.endswith(('_1k_bags', '_per_lb'))
+        ]
+        group_by = [str(rng.choice(DATASETS[dataset]['keys']))]
+        spec = normalize(where, (first, None), group_by, measures[:3], 'sum', table.frame)
+        pool.append((dataset, spec))
+    return ([pool[i] for i in rng.integers(0, distinct, size=n)])
+
+
+def latency(fn, queries):
+    """ Per-query latencies and throughput of answering a workload
+        fn: function of (dataset, spec)
+        queries: workload
+
+        returns dict of p50/p95/mean latency in milliseconds and queries per second
+    """
+    times = []
+    start = time.perf_counter()
+    for dataset, spec in queries:
+        t = time.perf_counter()
+        fn(dataset, spec)
+        times.append(time.perf_counter() - t)
+    total = time.perf_counter() - start
+    times = np.array(times) * 1000
+    return ({
+        'p50_ms': float(np.percentile(times, 50)),
+        'p95_ms': float(np.percentile(times, 95)),
+        'mean_ms': float(times.mean()),
+        'qps': len(queries) / total
+    })
+
+
+def compare_backends(folder, fmt='csv', n=500, distinct=50, seed=0, cache_size=256):
+    """ Latency and throughput of CSV re-reads, indexed queries and cached indexed queries
+        over the same workload, after checking they return the same results
+        folder: processed folder
+        fmt: format the tables were written in
+        n, distinct, seed: workload (see workload)
+        cache_size: results kept by the cached store
+    """
+    start = time.perf_counter()
+    cached = load_store(folder, fmt, cache_size=cache_size)
+    load_s = time.perf_counter() - start
+    uncached = load_store(folder, fmt, cache_size=0)
+    queries = workload(cached, n, distinct, seed)
+
+    def run(store):
+        return (lambda dataset, spec: query(store, dataset, **spec))
+
+    for dataset, spec in queries[:distinct]:
+        pd.testing.assert_frame_equal(
+            reread_query(folder, dataset, spec, fmt), run(uncached)(dataset, spec),
+            check_dtype=False, check_categorical=False
+        )
+
+    rows = [
+        {'backend': 'reread', **latency(lambda d, s: reread_query(folder, d, s, fmt), queries)},
+        {'backend': 'indexed', **latency(run(uncached), queries)},
+        {'backend': 'indexed+cache', **latency(run(cached), queries)}
+    ]
+    return (pd.DataFrame(rows), load_s, dict(cached.stats))
+
+
+def query_arguments(params):
+    """ Query arguments of an HTTP query string
+        params: dict of parameter -> list of values, as parsed by parse_qs
+
+        key columns filter by one or more values (country=Brazil&country=Peru); year_from,
+        year_to, group_by, measures (comma-separated) and agg shape the result
+    """
+    params = dict(params)
+    single = {k: params.pop(k)[-1] for k in ['year_from', 'year_to', 'group_by', 'measures',
+                                             'agg'] if k in params}
+    years = tuple(
+        None if single.get(k) is None else float(single[k]) for k in ['year_from', 'year_to']
+    )
+    return ({
+        'where': params,
+        'years': years,
+        'group_by': [c for c in single.get('group_by', '').split(',') if c],
+        'measures': [c for c in single.get('measures', '').split(',') if c],
+        'agg': single.get('agg')
+    })
+
+
+def make_handler(store):
+    """ HTTP request handler answering queries from a store
+
+        GET /datasets            dataset names, columns, indexed columns and rows
+        GET /query/<dataset>?... query results as JSON records (see query_arguments)
+        GET /stats               cache hits, misses, evictions and size
+    """
+    class QueryHandler(BaseHTTPRequestHandler):
+        def send(self, status, body):
+            payload = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = [p for p in url.path.split('/') if p]
+            try:
+                if parts == ['datasets']:
+                    self.send(200, json.dumps({
+                        name: {'columns': list(t.frame.columns), 'keys': list(t.keys),
+                               'year': t.year, 'rows': len(t.frame)}
+                        for name, t in store.tables.items()
+                    }))
+                elif parts == ['stats']:
+                    with store.lock:
+                        self.send(200, json.dumps({**store.stats, 'size': len(store.cache)}))
+                elif len(parts) == 2 and parts[0] == 'query':
+                    args = query_arguments(parse_qs(url.query))
+                    result = query(store, parts[1], **args)
+                    self.send(200, result.to_json(orient='records'))
+                else:
+                    self.send(404, json.dumps({'error': f'no route {url.path}'}))
+            except (KeyError, ValueError) as e:
+                self.send(400, json.dumps({'error': str(e)}))
+
+        def log_message(self, fmt, *args):
+            logger.debug(fmt, *args)
+
+    return (QueryHandler)
+
+
+@click.group()
+def main():
+    """ Query the processed datasets through in-memory indexes
+    """
+
+
+@main.command()
+@click.argument('processed_filepath', type=click.Path(exists=True))
+@click.option('--output-format', type=click.Choice(sinks.FORMATS), default='csv',
+              help='format the processed tables were written in')
+@click.option('--host', default='127.0.0.1', help='address to listen on')
+@click.option('--port', default=8050, help='port to listen on')
+@click.option('--cache-size', default=256, help='query results kept in the LRU cache')
+def serve(processed_filepath, output_format, host, port, cache_size):
+    """ Serve queries over HTTP until interrupted
+    """
+    store = load_store(processed_filepath, output_format, cache_size=cache_size)
+    server = ThreadingHTTPServer((host, port), make_handler(store))
+    logger.info('serving %s on http://%s:%s', ', '.join(store.tables), host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+@main.command()
+@click.argument('processed_filepath', type=click.Path(exists=True))
+@click.option('--output-format', type=click.Choice(sinks.FORMATS), default='csv',
+              help='format the processed tables were written in')
+@click.option('--queries', default=500, help='queries in the workload')
+@click.option('--distinct', default=50, help='different queries the workload draws from')
+@click.option('--seed', default=0, help='random seed of the workload')
+@click.option('--cache-size', default=256, help='query results kept in the LRU cache')
+def bench(processed_filepath, output_format, queries, distinct, seed, cache_size):
+    """ Compare query latency and throughput against re-reading the tables
+    """
+    results, load_s, stats = compare_backends(
+        processed_filepath, output_format, queries, distinct, seed, cache_size
+    )
+    click.echo(f'loaded and indexed in {load_s * 1000:.1f} ms; cache {stats}')
+    click.echo(results.to_string(index=False, float_format=lambda v: f'{v:.3f}'))
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+    main()
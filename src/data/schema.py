@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import functools
+import hashlib
+import inspect
+import sys
+import pandas as pd
+
+# key columns stored as categoricals
+CATEGORY_COLUMNS = [
+    'country',
+    'region',
+    'harvest_group',
+    'ico_member',
+    'crop_year',
+    'indicator_name',
+    'other_indicator_name',
+    'calendar_month'
+]
+
+# year columns stored as small integers
+YEAR_COLUMNS = ['year', 'calendar_year', 'crop_year_beg', 'crop_year_end']
+YEAR_DTYPE = 'int16'
+
+# opt-in fixed-point storage of bag quantities: 1k bags to 4 decimals (a tenth of a bag)
+FIXED_POINT_DECIMALS = 4
+FIXED_POINT_DTYPE = 'Int32'
+
+
+@functools.lru_cache(maxsize=None)
+def version():
+    """ Hash of the storage schema code; stage keys follow changes to the compacted dtypes
+    """
+    source = inspect.getsource(sys.modules[__name__])
+    return (hashlib.sha256(source.encode('utf-8')).hexdigest())
+
+
+def is_fixed_point(values):
+    """ Whether a bag quantity is stored as fixed-point integers
+        values: pandas Series
+    """
+    return (pd.api.types.is_integer_dtype(values.dtype))
+
+
+def to_fixed_point(values):
+    """ Store 1k bag quantities as scaled integers
+        values: pandas Series of floats
+    """
+    return ((values * 10 ** FIXED_POINT_DECIMALS).round().astype(FIXED_POINT_DTYPE))
+
+
+def from_fixed_point(values):
+    """ Float 1k bag quantities from a column that may be stored as fixed-point
+        values: pandas Series
+    """
+    if not is_fixed_point(values):
+        return (values)
+    return (values.astype('float64') / 10 ** FIXED_POINT_DECIMALS)
+
+
+def compact(df, fixed_point=False):
+    """ Apply the compact schema to a table
+        df: pandas DataFrame
+        fixed_point: store '<measure>_1k_bags' columns as scaled integers
+
+        key columns become categoricals over their sorted values, complete year columns
+        become int16; categorical columns already present drop unused categories
+    """
+    casts = {}
+    for col in df.columns:
+        values = df[col]
+        if col in CATEGORY_COLUMNS:
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                casts[col] = values.cat.remove_unused_categories()
+            else:
+                casts[col] = values.astype(pd.CategoricalDtype(sorted(values.dropna().unique())))
+        elif col in YEAR_COLUMNS and values.notna().all() and values.dtype != YEAR_DTYPE:
+            casts[col] = values.astype(YEAR_DTYPE)
+        elif fixed_point and str(col).endswith('_1k_bags') and not is_fixed_point(values):
+            casts[col] = to_fixed_point(values.astype('float64'))
+    if not casts:
+        return (df)
+    return (df.assign(**casts))
+
+
+def unify(frames, columns=None):
+    """ Recast key columns of several tables onto shared categorical dictionaries, so
+        merges and concats between them run on the category codes
+        frames: list of pandas DataFrames
+        columns: columns to unify (default: every categorical key column in all frames)
+
+        returns the list of recast frames
+    """
+    if columns is None:
+        columns = [c for c in CATEGORY_COLUMNS if all(c in df.columns for df in frames)]
+    for col in columns:
+        values = set()
+        for df in frames:
+            values.update(df[col].dropna().unique())
+        dtype = pd.CategoricalDtype(sorted(values))
+        frames = [df.assign(**{col: df[col].astype(dtype)}) for df in frames]
+    return (frames)
+
+
+def memory_usage(df):
+    """ Bytes held by a table, including the contents of object columns
+        df: pandas DataFrame
+    """
+    return (int(df.memory_usage(deep=True, index=True).sum()))
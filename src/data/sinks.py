@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# pandas and pyarrow are imported where tables are read or written, so the output options
+# below can be listed without loading them
+
+FORMATS = ['csv', 'parquet', 'arrow']
+
+EXTENSIONS = {'csv': 'csv', 'parquet': 'parquet', 'arrow': 'arrow'}
+
+# default codec of each binary format; arrow ipc files are left uncompressed, since a
+# compressed one has to be decoded into memory rather than memory-mapped
+COMPRESSION = {'parquet': 'zstd', 'arrow': None}
+
+# csv compression codecs and the suffix added to compressed csv files
+CSV_COMPRESSION = {'gzip': 'gz', 'zstd': 'zst'}
+
+CSV_ENCODERS = ['pandas', 'polars']
+
+
+def table_path(folder, name, fmt='csv', csv_compression=None):
+    """ File (or partitioned directory) a table is written to
+        folder: interim or processed folder
+        name: table name
+        fmt: output format (csv, parquet, arrow)
+        csv_compression: codec of compressed csv files (gzip, zstd, None)
+    """
+    if fmt == 'csv' and csv_compression:
+        return (f'{folder}/{name}.csv.{CSV_COMPRESSION[csv_compression]}')
+    return (f'{folder}/{name}.{EXTENSIONS[fmt]}')
+
+
+def temp_path(path):
+    """ Hidden sibling a table is written to before it is swapped into place
+        path: output file or directory
+    """
+    folder, name = os.path.split(path)
+    return (os.path.join(folder, f'.{name}.tmp'))
+
+
+def remove(path):
+    """ Delete a file or directory, if it exists
+    """
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def arrow_table(df):
+    """ Typed Arrow table of a DataFrame; mixed-type object columns are stored as strings
+        df: pandas DataFrame
+    """
+    import pandas as pd
+    import pyarrow as pa
+
+    df = df.copy()
+    df.columns = [str(col) for col in df.columns]
+    for col in df.columns[df.dtypes == object]:
+        if pd.api.types.infer_dtype(df[col], skipna=True).startswith('mixed'):
+            df[col] = df[col].map(lambda v: None if pd.isna(v) else str(v))
+    return (pa.Table.from_pandas(df, preserve_index=False))
+
+
+def encode_csv(df, float_precision=None, encoder='pandas'):
+    """ csv text of a table, as bytes
+        df: pandas DataFrame
+        float_precision: digits after the decimal point of float columns (None writes the
+                         shortest repr that reads back to the same float)
+        encoder: 'pandas', or 'polars', whose writer formats floats without holding the GIL
+
+        the encoders write the same text except for the exponent of very small or large floats
+        ('1e-09' in pandas, '1e-9' in polars); with a float_precision they are identical
+    """
+    if encoder == 'pandas':
+        float_format = None if float_precision is None else f'%.{float_precision}f'
+        return (df.to_csv(index=False, float_format=float_format).encode('utf-8'))
+    if encoder != 'polars':
+        raise ValueError(f'Unrecognized csv encoder: {encoder}')
+
+    import polars as pl
+
+    frame = pl.from_pandas(df.set_axis([str(col) for col in df.columns], axis=1))
+    return (frame.write_csv(float_precision=float_precision).encode('utf-8'))
+
+
+def write_csv(df, path, float_precision=None, compression=None, encoder='pandas'):
+    """ Write a table as csv, optionally gzip or zstd compressed
+        df: pandas DataFrame
+        path: output file
+        float_precision: digits after the decimal point of float columns (see encode_csv)
+        compression: gzip, zstd or None
+        encoder: pandas or polars (see encode_csv)
+    """
+    data = encode_csv(df, float_precision, encoder)
+    if compression is None:
+        with open(path, 'wb') as fh:
+            fh.write(data)
+        return
+    if compression not in CSV_COMPRESSION:
+        raise ValueError(f'Unrecognized csv compression: {compression}')
+
+    import pyarrow as pa
+
+    with pa.CompressedOutputStream(path, compression) as out:
+        out.write(data)
+
+
+def write_table(df, path, fmt='csv', partition_cols=None, compression='zstd',
+                float_precision=None, csv_compression=None, csv_encoder='pandas'):
+    """ Write a table as csv, or as Parquet / Arrow IPC partitioned on hive-style directories
+        df: pandas DataFrame
+        path: output file or directory (see table_path)
+        fmt: output format (csv, parquet, arrow)
+        partition_cols: columns to partition parquet/arrow output by
+        compression: parquet/arrow compression codec (None for uncompressed)
+        float_precision: digits after the decimal point of csv float columns
+        csv_compression: csv compression codec (gzip, zstd, None)
+        csv_encoder: pandas or polars (see encode_csv)
+
+        uncompressed arrow files can be memory-mapped by readers
+    """
+    if fmt == 'csv':
+        write_csv(df, path, float_precision, csv_compression, csv_encoder)
+        return
+    if fmt not in FORMATS:
+        raise ValueError(f'Unrecognized output format: {fmt}')
+
+    import pyarrow.dataset as ds
+
+    table = arrow_table(df)
+    partition_cols = [col for col in (partition_cols or []) if col in table.column_names]
+    if fmt == 'parquet':
+        file_format = ds.ParquetFileFormat()
+        options = file_format.make_write_options(compression=compression or 'none')
+    else:
+        file_format = ds.IpcFileFormat()
+        options = file_format.make_write_options(compression=compression)
+
+    remove(path)
+    ds.write_dataset(
+        table,
+        path,
+        format=file_format,
+        file_options=options,
+        partitioning=partition_cols or None,
+        partitioning_flavor='hive' if partition_cols else None,
+        basename_template=f'part-{{i}}.{EXTENSIONS[fmt]}',
+        existing_data_behavior='delete_matching'
+    )
+
+
+def write_tables(jobs, max_workers=None):
+    """ Write tables concurrently, each to the temporary path next to its target
+        jobs: list of (DataFrame, path, write_table keyword arguments)
+        max_workers: writer threads (default: ThreadPoolExecutor's default)
+
+        returns dict of path -> seconds spent writing; when any table fails the temporary
+        files are removed and the error raised, leaving every target untouched
+    """
+    def write(job):
+        df, path, kwargs = job
+        start = time.perf_counter()
+        write_table(df, temp_path(path), **kwargs)
+        return (path, time.perf_counter() - start)
+
+    try:
+        with ThreadPoolExecutor(max_workers) as pool:
+            return (dict(pool.map(write, jobs)))
+    except BaseException:
+        for _, path, _ in jobs:
+            remove(temp_path(path))
+        raise
+
+
+def swap(paths):
+    """ Move tables written by write_tables from their temporary paths over their targets
+        paths: target paths
+
+        files are replaced by atomic renames; directories cannot be renamed over, so the old
+        one is moved aside first. Called once every table of a build is written, a failed
+        build leaves all of the previous outputs in place
+    """
+    for path in paths:
+        if os.path.isdir(temp_path(path)) or os.path.isdir(path):
+            old = f'{temp_path(path)}.old'
+            remove(old)
+            if os.path.exists(path):
+                os.rename(path, old)
+            os.rename(temp_path(path), path)
+            remove(old)
+        else:
+            os.replace(temp_path(path), path)
+
+
+def read_table(path, fmt='csv', columns=None, filter=None):
+    """ Read a table written by write_table, loading only the columns and partitions needed
+        path: file or directory written by write_table
+        fmt: format the table was written in (csv, parquet, arrow)
+        columns: columns to read (None reads every column)
+        filter: pyarrow.dataset expression, e.g. ds.field('calendar_year') >= 2010
+
+        arrow files are read through memory maps; gzip/zstd csv files are decompressed by
+        pyarrow, so zstd does not need the zstandard package
+    """
+    if fmt == 'csv':
+        import pandas as pd
+
+        if not str(path).endswith(tuple(CSV_COMPRESSION.values())):
+            return (pd.read_csv(path, usecols=columns, float_precision='round_trip'))
+
+        import pyarrow as pa
+
+        with pa.input_stream(str(path), compression='detect') as stream:
+            return (pd.read_csv(stream, usecols=columns, float_precision='round_trip'))
+
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+
+    dataset = ds.dataset(
+        path,
+        format='parquet' if fmt == 'parquet' else 'ipc',
+        partitioning='hive',
+        filesystem=fs.LocalFileSystem(use_mmap=True)
+    )
+    return (dataset.to_table(columns=columns, filter=filter).to_pandas())
@@ -0,0 +1,888 @@
+# -*- coding: utf-8 -*-
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+import pandas as pd
+import src.data.database as database
+import src.data.hyper as hyper
+import src.data.ingest as ingest
+import src.data.instrument as instrument
+import src.data.schema as schema
+import src.data.sinks as sinks
+import src.data.units as units  # also registers the DataFrame.units accessor
+
+logger = logging.getLogger(__name__)
+
+# a memoized unit of the pipeline
+#   name:       stage name
+#   func:       function returning a dict of output name -> DataFrame
+#   workbooks:  raw workbook variable types passed to func by name
+#   external:   dict of func argument -> file in the external data folder
+#   upstream:   outputs of earlier stages passed to func by name
+#   params:     constant keyword arguments passed to func
+#   code:       further functions whose source is part of the stage key; the repo code func and
+#               these reach by name is followed from them (see stage_code)
+#   outputs:    dict of output name -> 'interim' or 'processed'
+Stage = namedtuple(
+    'Stage',
+    ['name', 'func', 'workbooks', 'external', 'upstream', 'params', 'code', 'outputs']
+)
+
+# state a resident process (see watch.py) keeps between builds
+#   workbooks: dict of workbook -> (content hash, parsed sheet)
+#   results:   dict of (stage name, stage key) -> outputs of the stage
+#   digests:   dict of input file -> ((modification time in ns, size), content hash)
+Warm = namedtuple('Warm', ['workbooks', 'results', 'digests'])
+
+
+def warm_state():
+    """ Empty Warm state, filled by the first run_stages call it is passed to
+    """
+    return (Warm({}, {}, {}))
+
+
+def code_names(code):
+    """ Global and attribute names a code object uses, with those of the functions,
+        lambdas and comprehensions nested in it
+    """
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= code_names(const)
+    return (names)
+
+
+def is_repo_code(value):
+    """ Whether a value is a function or class defined in this package
+    """
+    return (
+        (inspect.isfunction(value) or inspect.isclass(value))
+        and (getattr(value, '__module__', None) or '').startswith('src.')
+    )
+
+
+def modules_in(value):
+    """ Repo modules a global refers to: itself, or those held in a dict or list (e.g. ENGINES)
+    """
+    if isinstance(value, dict):
+        value = list(value.values())
+    values = value if isinstance(value, (list, tuple)) else [value]
+    return ([v for v in values if inspect.ismodule(v) and v.__name__.startswith('src.')])
+
+
+def referenced(obj):
+    """ Values a function, or the methods of a class, refer to by name: globals, and
+        attributes of the modules those globals hold
+
+        returns a dict of qualified name -> value
+    """
+    functions = [obj] if inspect.isfunction(obj) else [
+        inspect.unwrap(v) for v in vars(obj).values() if inspect.isfunction(inspect.unwrap(v))
+    ]
+    found = {}
+    for fn in functions:
+        names = code_names(fn.__code__)
+        scope = fn.__globals__
+        for name in names & set(scope):
+            found[f'{scope.get("__name__")}.{name}'] = scope[name]
+            for module in modules_in(scope[name]):
+                found.update({
+                    f'{module.__name__}.{attr}': getattr(module, attr)
+                    for attr in names if hasattr(module, attr)
+                })
+    return (found)
+
+
+@functools.lru_cache(maxsize=None)
+def code_source(obj):
+    """ Source of a repo function or class (the fields of a namedtuple, which has none)
+    """
+    try:
+        return (inspect.getsource(obj))
+    except (OSError, TypeError):
+        return (repr(getattr(obj, '_fields', obj.__qualname__)))
+
+
+def stage_code(stage):
+    """ Source of every repo function and class a stage's code reaches, and the constants it
+        reads, keyed by qualified name
+        stage: Stage
+
+        the stage function and its code list are followed through the names they use, so an
+        edit to any helper they call (however deep) changes the stage key; callables reached
+        other than by name (e.g. a DataFrame accessor) still belong in stage.code
+    """
+    return (reachable_code(tuple(inspect.unwrap(fn) for fn in [stage.func] + list(stage.code))))
+
+
+@functools.lru_cache(maxsize=None)
+def reachable_code(roots):
+    """ Sources and constants reached from some functions (see stage_code); kept for the life
+        of the process, whose loaded code does not change
+        roots: tuple of functions
+    """
+    code = {}
+    constants = {}
+    todo = list(roots)
+    while todo:
+        obj = todo.pop()
+        name = f'{obj.__module__}.{obj.__qualname__}'
+        if name in code:
+            continue
+        code[name] = code_source(obj)
+        for ref, value in referenced(obj).items():
+            value = inspect.unwrap(value) if inspect.isfunction(value) else value
+            if is_repo_code(value):
+                todo.append(value)
+            elif ref.startswith('src.') and not callable(value) and not modules_in(value):
+                try:
+                    constants[ref] = json.dumps(value, sort_keys=True)
+                except TypeError:
+                    pass
+    return ({'code': code, 'constants': constants})
+
+
+def input_key(stage, input_hashes):
+    """ Hash of a stage's own inputs, parameters and code
+        stage: Stage
+        input_hashes: dict of raw/external input -> content hash
+
+        the workbook parser, units and storage schema code run inside every stage without
+        being listed in its code, so their versions are part of every key
+    """
+    payload = {
+        'name': stage.name,
+        'inputs': input_hashes,
+        'params': stage.params,
+        'parser': ingest.parser_version() if stage.workbooks else None,
+        'units': units.version(),
+        'schema': schema.version(),
+        'code': stage_code(stage)
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=repr).encode('utf-8')
+    return (hashlib.sha256(encoded).hexdigest())
+
+
+def stage_key(own_key, upstream_hashes):
+    """ Hash of everything a stage's outputs depend on
+        own_key: input_key of the stage
+        upstream_hashes: dict of upstream output -> content hash
+
+        keying on upstream content rather than upstream keys lets a rerun stage whose
+        outputs did not change leave its downstream stages untouched
+    """
+    payload = {'own': own_key, 'upstream': upstream_hashes}
+    encoded = json.dumps(payload, sort_keys=True).encode('utf-8')
+    return (hashlib.sha256(encoded).hexdigest())
+
+
+def output_hash(df):
+    """ Content hash of an output table as written: the stored table and the units code that
+        expands it (see units.UnitsAccessor.expand)
+        df: pandas DataFrame
+    """
+    digest = hashlib.sha256(units.version().encode('utf-8'))
+    digest.update(repr([(str(c), str(t)) for c, t in df.dtypes.items()]).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return (digest.hexdigest())
+
+
+def output_path(name, location, interim_filepath, output_filepath, fmt='csv',
+                csv_compression=None):
+    """ file an output table is written to
+        name: output table name
+        location: 'interim' or 'processed'
+        fmt: output format (csv, parquet, arrow)
+        csv_compression: codec of compressed csv outputs (gzip, zstd, None)
+    """
+    folder = interim_filepath if location == 'interim' else output_filepath
+    return (sinks.table_path(folder, name, fmt, csv_compression))
+
+
+def stage_paths(stage, interim_filepath, output_filepath, fmt='csv', csv_compression=None):
+    """ dict of output name -> file each output of a stage is written to (see output_path)
+    """
+    return ({
+        name: output_path(name, loc, interim_filepath, output_filepath, fmt, csv_compression)
+        for name, loc in stage.outputs.items()
+    })
+
+
+def stage_graph(stages):
+    """ Dependency graph of a list of stages
+        stages: list of Stage, upstream stages first
+
+        returns a dict of stage name -> names of the stages in the list producing its upstream
+        outputs, in the order of the list
+    """
+    producers = {out: stage.name for stage in stages for out in stage.outputs}
+    return ({
+        stage.name: list(dict.fromkeys(producers[up] for up in stage.upstream if up in producers))
+        for stage in stages
+    })
+
+
+def graph_dot(stages, manifest=None):
+    """ Graphviz source of the stage graph, edges labelled with the outputs they carry
+        stages: list of Stage
+        manifest: build manifest; stages are labelled with the seconds they took in that build
+                  and its critical path is drawn in bold
+    """
+    entries = (manifest or {}).get('stages', {})
+    critical = (manifest or {}).get('critical_path', {}).get('stages', [])
+    producers = {out: stage.name for stage in stages for out in stage.outputs}
+    lines = ['digraph stages {', '  rankdir=LR;', '  node [shape=box];']
+    for stage in stages:
+        seconds = entries.get(stage.name, {}).get('seconds')
+        label = stage.name if seconds is None else f'{stage.name}\\n{seconds:.2f}s'
+        style = ', style=bold' if stage.name in critical else ''
+        lines.append(f'  "{stage.name}" [label="{label}"{style}];')
+    for stage in stages:
+        for up in stage.upstream:
+            if up in producers:
+                on_path = producers[up] in critical and stage.name in critical
+                style = ', style=bold' if on_path else ''
+                lines.append(f'  "{producers[up]}" -> "{stage.name}" [label="{up}"{style}];')
+    return ('\n'.join(lines + ['}']))
+
+
+def schedule(graph, run, done, max_workers=None):
+    """ Run tasks in a thread pool, each as soon as the tasks it depends on are done
+        graph: dict of task -> tasks it depends on (see stage_graph), in a valid order
+        run: function of a task, called in a worker thread
+        done: function of a task and its result, called in the calling thread as tasks finish
+              and before their dependents start
+        max_workers: worker threads
+
+        threads share the interpreter, so tables pass from task to task without being pickled
+        or copied; ready tasks are started in graph order
+    """
+    waiting = {task: set(deps) for task, deps in graph.items()}
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while waiting or running:
+            for task in [task for task, deps in waiting.items() if not deps]:
+                del waiting[task]
+                running[pool.submit(run, task)] = task
+            if not running:
+                raise ValueError(f'tasks depend on tasks never run: {", ".join(waiting)}')
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in [future for future in running if future in finished]:
+                task = running.pop(future)
+                done(task, future.result())
+                for deps in waiting.values():
+                    deps.discard(task)
+
+
+def critical_path(graph, seconds):
+    """ Longest chain of dependent tasks by run time, the least wall time a build can take
+        however many workers run it
+        graph: dict of task -> tasks it depends on, in a valid order
+        seconds: dict of task -> seconds it took
+
+        returns (tasks along the chain, seconds of the chain)
+    """
+    finish = {}
+    before = {}
+    for task, deps in graph.items():
+        before[task] = max(deps, key=finish.get, default=None)
+        finish[task] = seconds.get(task, 0.0) + (finish[before[task]] if before[task] else 0.0)
+    task = max(finish, key=finish.get, default=None)
+    total = finish.get(task, 0.0)
+    path = []
+    while task is not None:
+        path.append(task)
+        task = before[task]
+    return (path[::-1], total)
+
+
+def schedule_report(graph, entries, wall_seconds):
+    """ Where the time of a build went: its critical path against the wall time of the
+        scheduled stages and the time they took together
+        graph: dict of stage name -> upstream stage names of the stages run
+        entries: dict of stage name -> manifest entry holding the seconds the stage took
+        wall_seconds: seconds from the first stage starting to the last finishing
+
+        the report is logged and kept in the build manifest
+    """
+    seconds = {name: entries[name]['seconds'] for name in graph}
+    path, length = critical_path(graph, seconds)
+    report = {
+        'stages': path,
+        'seconds': round(length, 4),
+        'wall_seconds': round(wall_seconds, 4),
+        'stage_seconds': round(sum(seconds.values()), 4)
+    }
+    logger.info(
+        'stages took %.2fs in %.2fs of wall time; critical path %.2fs: %s',
+        report['stage_seconds'], report['wall_seconds'], report['seconds'],
+        ' -> '.join(f'{name} ({seconds[name]:.2f}s)' for name in path) or 'none'
+    )
+    return (report)
+
+
+def stage_cache_path(cache_dir, name, key):
+    """ pickle holding the outputs of a stage for a given key
+    """
+    return (f'{cache_dir}/stages/{name}-{key}.pkl')
+
+
+def cached_result(cache_dir, name, key, warm=None):
+    """ Outputs of a stage stored under a key, from memory when a Warm state holds them
+        cache_dir: stage cache folder
+        name: stage name
+        key: stage key
+        warm: Warm state, or None
+
+        returns None when the stage never ran with this key
+    """
+    if warm is not None and (name, key) in warm.results:
+        return (warm.results[(name, key)])
+    cache_path = stage_cache_path(cache_dir, name, key)
+    if not os.path.exists(cache_path):
+        return (None)
+    return (pd.read_pickle(cache_path))
+
+
+def keep_warm(warm, dfs, workbook_hashes, keys, load):
+    """ Hold the parsed workbooks and stage outputs of a build for the next one
+        warm: Warm state, or None
+        dfs: dict of workbook -> parsed sheet read by the build
+        workbook_hashes: dict of workbook -> content hash
+        keys: dict of stage name -> stage key of the build
+        load: function of a stage name returning its outputs
+
+        outputs of skipped stages are loaded too, and those of older keys dropped, so the
+        state holds exactly one build
+    """
+    if warm is None:
+        return
+    results = {(name, key): load(name) for name, key in keys.items()}
+    warm.workbooks.update({name: (workbook_hashes[name], df) for name, df in dfs.items()})
+    warm.results.clear()
+    warm.results.update(results)
+
+
+def load_build(path):
+    """ Read the previous build manifest, if any
+        path: manifest json file
+    """
+    if not os.path.exists(path):
+        return ({})
+    with open(path) as fh:
+        return (json.load(fh))
+
+
+def load_manifest(path):
+    """ Stage entries of the previous build manifest, if any
+        path: manifest json file
+    """
+    return (load_build(path).get('stages', {}))
+
+
+def call_stage(stage, kwargs, memory_report=False):
+    """ Run a stage function inside an instrumentation span
+        stage: Stage
+        kwargs: arguments for stage.func
+        memory_report: trace peak memory while the stage runs
+
+        returns (dict of outputs, memory report or None); the report holds the traced
+        peak of the stage and the steady-state size of each output table
+    """
+    started = memory_report and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        with instrument.span(stage.name, 'stage', instrument.rows(kwargs)) as record:
+            out = stage.func(**kwargs)
+            record['rows_out'] = instrument.rows(out)
+    finally:
+        if started:
+            tracemalloc.stop()
+    if not memory_report:
+        return (out, None)
+    report = {
+        'peak_bytes': record['peak_bytes'],
+        'table_bytes': {name: schema.memory_usage(df) for name, df in out.items()}
+    }
+    logger.info('stage %s memory: peak %d bytes, tables %s', stage.name, record['peak_bytes'],
+                report['table_bytes'])
+    return (out, report)
+
+
+def write_settings(fmt='csv', options=None, partitions=None, names=()):
+    """ Settings that shape the written bytes of a stage's outputs, recorded in its manifest
+        entry so that changing any of them rewrites the outputs
+        fmt: output format (csv, parquet, arrow)
+        options: other sinks.write_table keyword arguments (see changed_outputs)
+        partitions: dict of output name -> partition columns for parquet/arrow
+        names: output names of the stage
+    """
+    options = options or {}
+    if fmt == 'csv':
+        return ({
+            'format': fmt,
+            **{k: options.get(k) for k in ['float_precision', 'csv_compression', 'csv_encoder']}
+        })
+    return ({
+        'format': fmt,
+        'compression': options.get('compression'),
+        'partitions': {name: list((partitions or {}).get(name) or []) for name in names}
+    })
+
+
+def changed_outputs(outputs, paths, previous, fmt='csv', partitions=None, options=None):
+    """ Hash stage outputs and collect the writes of those whose content or format changed
+        outputs: dict of output name -> DataFrame
+        paths: dict of output name -> output path
+        previous: manifest entry of the stage from the last build
+        fmt: output format (csv, parquet, arrow)
+        partitions: dict of output name -> partition columns for parquet/arrow
+        options: other sinks.write_table keyword arguments (compression, float_precision,
+                 csv_compression, csv_encoder)
+
+        returns (dict of output name -> content hash, list of sinks.write_tables jobs)
+    """
+    partitions = partitions or {}
+    options = options or {}
+    settings = write_settings(fmt, options, partitions, paths)
+    hashes = {}
+    jobs = []
+    for name, path in paths.items():
+        hashes[name] = output_hash(outputs[name])
+        unchanged = \
+            previous.get('write') == settings \
+            and previous.get('output_hashes', {}).get(name) == hashes[name]
+        if unchanged and os.path.exists(path):
+            continue
+        jobs.append((
+            outputs[name].units.expand(),
+            path,
+            dict(options, fmt=fmt, partition_cols=partitions.get(name))
+        ))
+    return (hashes, jobs)
+
+
+def write_files(jobs, max_workers=None):
+    """ Write every changed output of a build concurrently, then swap them all into place
+        jobs: sinks.write_tables jobs
+        max_workers: writer threads
+    """
+    if not jobs:
+        return
+    with instrument.span('write outputs', 'write', instrument.rows([df for df, _, _ in jobs])):
+        seconds = sinks.write_tables(jobs, max_workers)
+        sinks.swap([path for _, path, _ in jobs])
+    logger.info('wrote %d tables (%.3fs of writer time): %s', len(jobs), sum(seconds.values()),
+                ', '.join(os.path.basename(path) for path in seconds))
+
+
+def remove_outputs(paths):
+    """ Delete output files a build no longer writes (see superseded_outputs)
+    """
+    for path in paths:
+        sinks.remove(path)
+    if paths:
+        logger.info('removed superseded outputs: %s', ', '.join(paths))
+
+
+def write_database(path, hashes, load, keys=None, indexes=None):
+    """ Upsert changed outputs into an embedded database file, if one is given
+        path: database file, or None
+        hashes: dict of output name -> content hash (see output_hash)
+        load: function of an output name returning the output
+        keys, indexes: primary keys and indexed columns by output name
+
+        the database holds the expanded tables, so it is keyed on output_hash, which covers
+        the units code expanding them as well as the stored table
+    """
+    if not path:
+        return
+    with instrument.span('write database', 'write'):
+        database.sync(path, hashes, lambda name: load(name).units.expand(), keys, indexes)
+
+
+def write_extract(path, hashes, load, stages, partitions=None):
+    """ Append or replace the changed partitions of the processed outputs in a Tableau .hyper
+        extract, if one is given
+        path: extract file, or None
+        hashes: dict of output name -> content hash
+        load: function of an output name returning the output
+        stages: list of Stage; only their 'processed' outputs are extracted
+        partitions: dict of output name -> integer partition column
+    """
+    if not path:
+        return
+    processed = {
+        name for stage in stages for name, location in stage.outputs.items()
+        if location == 'processed'
+    }
+    with instrument.span('write extract', 'write'):
+        hyper.sync(
+            path, {name: h for name, h in hashes.items() if name in processed},
+            lambda name: load(name).units.expand(), partitions
+        )
+
+
+def write_manifest(path, entries, critical=None):
+    """ Record the stages of a build and which were skipped
+        path: manifest json file
+        entries: dict of stage name -> manifest entry
+        critical: critical path report of the build (see schedule_report)
+    """
+    manifest = {
+        'built_at': datetime.now(timezone.utc).isoformat(),
+        'stages': entries,
+        'skipped': [name for name, entry in entries.items() if entry['status'] == 'skipped'],
+        'critical_path': critical
+    }
+    with open(path, 'w') as fh:
+        json.dump(manifest, fh, indent=2)
+    return (manifest)
+
+
+def is_current(previous, key, paths, settings=None):
+    """ Whether a stage's written outputs are up to date
+        previous: manifest entry of the stage from the last build
+        key: stage key for this build
+        paths: dict of output name -> output path
+        settings: write settings of this build (see write_settings)
+    """
+    return (
+        previous.get('key') == key
+        and previous.get('write') == (settings or write_settings())
+        and set(previous.get('output_hashes', {})) == set(paths)
+        and all(os.path.exists(path) for path in paths.values())
+    )
+
+
+def previous_outputs(stage, previous, paths, cache_dir, fmt='csv'):
+    """ Outputs of a stage left out of this run: the cached result of its last build, or else
+        its written tables read back
+        stage: Stage
+        previous: manifest entry of the stage from the last build
+        paths: dict of output name -> output path
+        cache_dir: stage cache folder
+        fmt: format the outputs were written in
+    """
+    cache_path = stage_cache_path(cache_dir, stage.name, previous.get('key'))
+    if previous.get('key') and os.path.exists(cache_path):
+        return (pd.read_pickle(cache_path))
+    missing = [path for path in paths.values() if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(
+            f'stage {stage.name} is not selected and its outputs were never written: '
+            f'{", ".join(missing)}'
+        )
+    logger.info('stage %s: reading its written outputs', stage.name)
+    return ({name: schema.compact(sinks.read_table(path, fmt)) for name, path in paths.items()})
+
+
+def superseded_outputs(previous, entries):
+    """ Files the last build wrote for a stage that this build writes under another name in
+        the same folder (another format or csv compression); the swap leaves them behind
+        previous: stage entries of the previous build manifest
+        entries: stage entries of this build
+    """
+    stale = set()
+    for name, entry in entries.items():
+        current = set(entry['outputs'])
+        folders = {os.path.dirname(path) for path in current}
+        stale |= {
+            path for path in previous.get(name, {}).get('outputs', [])
+            if path not in current and os.path.dirname(path) in folders
+        }
+    return (sorted(stale))
+
+
+def carried_entries(stages, selected, previous):
+    """ Manifest entries and output hashes of the last build of the stages left out of a run
+        stages: list of Stage
+        selected: names of the stages in the run
+        previous: stage entries of the previous build manifest
+    """
+    entries = {
+        stage.name: previous[stage.name] for stage in stages
+        if stage.name not in selected and stage.name in previous
+    }
+    hashes = {name: h for entry in entries.values() for name, h in entry['output_hashes'].items()}
+    return (entries, hashes)
+
+
+def stage_result(stage, key, previous, paths, cache_dir, execute, force=False, settings=None,
+                 warm=None):
+    """ Status of a selected stage and its outputs, unless its written outputs are current
+        stage: Stage
+        key: stage key for this build
+        previous: manifest entry of the stage from the last build
+        paths: dict of output name -> output path
+        cache_dir: stage cache folder
+        execute: function of a Stage running it
+        force: rerun the stage
+        warm: Warm state holding stage outputs in memory, or None
+
+        returns ('skipped', None), ('restored', outputs) from the stage cache or ('ran', outputs)
+    """
+    if not force and is_current(previous, key, paths, settings):
+        return ('skipped', None)
+    out = None if force else cached_result(cache_dir, stage.name, key, warm)
+    if out is not None:
+        return ('restored', out)
+    return ('ran', execute(stage))
+
+
+def workbook_reader(reader, dfs):
+    """ Function reading the workbooks it is given that are not in dfs yet into it
+        reader: function of workbook names returning parsed sheets (see ingest.read_workbooks)
+        dfs: dict of workbook -> parsed sheet, filled in place
+
+        stages running concurrently read one at a time, so no workbook is parsed twice
+    """
+    lock = threading.Lock()
+
+    def read(names):
+        with lock:
+            names = set(names) - set(dfs)
+            if names:
+                with instrument.span('read_workbooks', 'read') as record:
+                    dfs.update(reader(names=names))
+                    record['rows_out'] = instrument.rows({name: dfs[name] for name in names})
+    return (read)
+
+
+def stale_workbooks(stages, own_keys, previous, force=False):
+    """ Workbooks read by stages whose own inputs changed since the last build
+        stages: list of Stage
+        own_keys: dict of stage name -> input key
+        previous: stage entries of the previous build manifest
+    """
+    return ({
+        name for stage in stages
+        if force or previous.get(stage.name, {}).get('input_key') != own_keys[stage.name]
+        for name in stage.workbooks
+    })
+
+
+def content_hash(path, digests=None):
+    """ Content hash of an input file, rehashed only when its size or modification time changed
+        path: file to hash
+        digests: dict of path -> (stat signature, content hash) kept between builds (None
+                 hashes every time)
+    """
+    if digests is None:
+        return (ingest.file_hash(path))
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    if path not in digests or digests[path][0] != signature:
+        digests[path] = (signature, ingest.file_hash(path))
+    return (digests[path][1])
+
+
+def input_keys(stages, input_filepath, external_filepath, digests=None):
+    """ Compute the input key of every stage
+        stages: list of Stage
+        input_filepath: raw workbook folder
+        external_filepath: external data folder
+        digests: file hashes kept between builds (see content_hash)
+
+        returns (dict of stage name -> input key, dict of workbook -> content hash)
+    """
+    files = ingest.source_files(input_filepath)
+    workbook_hashes = {}
+    keys = {}
+    for stage in stages:
+        input_hashes = {}
+        for name in stage.workbooks:
+            if name not in workbook_hashes:
+                workbook_hashes[name] = content_hash(files[name], digests)
+            input_hashes[name] = workbook_hashes[name]
+        for arg, file_name in stage.external.items():
+            input_hashes[arg] = content_hash(f'{external_filepath}/{file_name}', digests)
+        keys[stage.name] = input_key(stage, input_hashes)
+    return (keys, workbook_hashes)
+
+
+def run_stages(stages, input_filepath, external_filepath, interim_filepath, output_filepath,
+               cache_dir, force=False, max_workers=None, workbook_cache=True,
+               output_format='csv', partitions=None, compression='zstd', memory_report=False,
+               database_path=None, table_keys=None, table_indexes=None, float_precision=None,
+               csv_compression=None, csv_encoder='pandas', write_workers=None, only=None,
+               warm=None, stage_workers=None, hyper_path=None, hyper_partitions=None):
+    """ Run the stages whose inputs changed and rewrite only their outputs
+        stages: list of Stage, upstream stages first
+        input_filepath: raw workbook folder
+        external_filepath: external data folder
+        interim_filepath, output_filepath: folders outputs are written to
+        cache_dir: folder for stage results, parsed workbooks and the build manifest
+        force: rerun every stage
+        max_workers: processes used to parse workbooks
+        workbook_cache: reuse parsed workbooks keyed by content hash
+        output_format: csv, parquet or arrow
+        partitions: dict of output name -> partition columns for parquet/arrow
+        compression: parquet/arrow compression codec
+        memory_report: record peak and per-table memory of the stages that run
+        database_path: embedded database file every output is also upserted into
+        table_keys: dict of output name -> primary key columns of its database table
+        table_indexes: dict of output name -> lists of indexed columns of its database table
+        hyper_path: Tableau .hyper extract the processed outputs are also written into
+        hyper_partitions: dict of output name -> year column whose partitions are appended
+                          or replaced in the extract
+        float_precision: digits after the decimal point of csv floats (None: shortest repr)
+        csv_compression: gzip or zstd to compress csv outputs
+        csv_encoder: pandas or polars (see sinks.encode_csv)
+        write_workers: threads serializing outputs
+        only: names of the stages to run (default: all); the outputs other stages pass to them
+              come from the last build (see previous_outputs)
+        warm: Warm state of a resident process; unchanged workbooks and the outputs of
+              stages are taken from it rather than parsed or read back, and it is left
+              holding every workbook and stage output of this build
+        stage_workers: threads running stages (default: one per CPU); a stage starts as soon
+                       as the stages producing its upstream outputs are done. Stages run one
+                       at a time while memory is traced, so peaks are their own
+
+        outputs are written to temporary files and swapped into place only once every stage
+        has run, so a failed build leaves the previous outputs untouched
+
+        returns the build manifest
+    """
+    os.makedirs(f'{cache_dir}/stages', exist_ok=True)
+    manifest_path = f'{cache_dir}/build_manifest.json'
+    previous = load_manifest(manifest_path)
+    selected = [stage for stage in stages if only is None or stage.name in only]
+    own_keys, workbook_hashes = input_keys(
+        selected, input_filepath, external_filepath, warm.digests if warm else None
+    )
+    by_name = {stage.name: stage for stage in stages}
+    producers = {out: stage.name for stage in stages for out in stage.outputs}
+    options = {
+        'compression': compression, 'float_precision': float_precision,
+        'csv_compression': csv_compression, 'csv_encoder': csv_encoder
+    }
+
+    dfs = {
+        name: sheet for name, (digest, sheet) in (warm.workbooks if warm else {}).items()
+        if workbook_hashes.get(name) == digest
+    }
+    read = workbook_reader(functools.partial(
+        ingest.read_workbooks,
+        input_filepath,
+        cache_dir=f'{cache_dir}/workbooks' if workbook_cache else None,
+        max_workers=max_workers,
+        hashes=workbook_hashes
+        ), dfs)
+
+    # parse the workbooks of every stage whose own inputs changed in one parallel batch; a
+    # warm build holds them all, so its first build reads every workbook
+    read(stale_workbooks(selected, own_keys, previous, force or warm is not None))
+
+    keys = {}
+    entries, hashes = carried_entries(stages, own_keys, previous)
+    results = {}
+    memory = {}
+    jobs = {}
+    # stages running concurrently may need the same upstream stage restored or rerun
+    locks = {stage.name: threading.Lock() for stage in stages}
+
+    def execute(stage):
+        read(stage.workbooks)
+        kwargs = {name: dfs[name] for name in stage.workbooks}
+        kwargs.update(
+            {arg: f'{external_filepath}/{file_name}'
+             for arg, file_name in stage.external.items()}
+        )
+        kwargs.update({up: materialize(producers[up])[up] for up in stage.upstream})
+        kwargs.update(stage.params)
+        out, memory[stage.name] = call_stage(stage, kwargs, memory_report)
+        pd.to_pickle(out, stage_cache_path(cache_dir, stage.name, keys[stage.name]))
+        return (out)
+
+    def materialize(name):
+        with locks[name]:
+            if name not in results and name not in own_keys:
+                results[name] = previous_outputs(
+                    by_name[name], previous.get(name, {}),
+                    stage_paths(by_name[name], interim_filepath, output_filepath,
+                                output_format, csv_compression),
+                    cache_dir, output_format
+                )
+            if name not in results:
+                results[name] = cached_result(cache_dir, name, keys[name], warm)
+            if results[name] is None:
+                results[name] = execute(by_name[name])
+            return (results[name])
+
+    def evaluate(name):
+        # runs in a worker thread, once the stages producing the upstream outputs are done
+        stage = by_name[name]
+        started = time.perf_counter()
+        prev = previous.get(name, {})
+        # upstream outputs of stages left out of the run and never built are hashed as read
+        upstream_hashes = {
+            up: hashes.get(up) or output_hash(materialize(producers[up])[up])
+            for up in stage.upstream
+        }
+        keys[name] = stage_key(own_keys[name], upstream_hashes)
+        paths = stage_paths(stage, interim_filepath, output_filepath, output_format,
+                            csv_compression)
+        status, out = stage_result(
+            stage, keys[name], prev, paths, cache_dir, execute, force,
+            write_settings(output_format, options, partitions, paths), warm
+        )
+        if status == 'skipped':
+            return (status, paths, prev['output_hashes'], [], started)
+        results[name] = out
+        return (status, paths) + changed_outputs(
+            out, paths, prev, output_format, partitions, options
+        ) + (started,)
+
+    def finish(name, result):
+        status, paths, stage_hashes, jobs[name], started = result
+        hashes.update(stage_hashes)
+        entries[name] = {
+            'input_key': own_keys[name],
+            'key': keys[name],
+            'status': status,
+            'format': output_format,
+            'write': write_settings(output_format, options, partitions, paths),
+            'outputs': list(paths.values()),
+            'output_hashes': {out: hashes[out] for out in by_name[name].outputs},
+            'memory': memory.get(name),
+            'started': round(started - build_started, 4),
+            'seconds': round(time.perf_counter() - started, 4)
+        }
+        logger.info('stage %s: %s (%.2fs)', name, status, entries[name]['seconds'])
+
+    graph = stage_graph(selected)
+    traced = memory_report or tracemalloc.is_tracing()
+    build_started = time.perf_counter()
+    schedule(graph, evaluate, finish, 1 if traced else stage_workers or os.cpu_count())
+    timing = schedule_report(graph, entries, time.perf_counter() - build_started)
+    entries = {stage.name: entries[stage.name] for stage in stages if stage.name in entries}
+    jobs = [job for stage in selected for job in jobs[stage.name]]
+
+    write_files(jobs, write_workers)
+    remove_outputs(superseded_outputs(previous, entries))
+
+    # tables whose content the database has not seen are loaded, from the stage cache when
+    # their stage was skipped
+    write_database(
+        database_path, hashes, lambda name: materialize(producers[name])[name],
+        table_keys, table_indexes
+    )
+    write_extract(
+        hyper_path, hashes, lambda name: materialize(producers[name])[name], stages,
+        hyper_partitions
+    )
+
+    keep_warm(warm, dfs, workbook_hashes, keys, materialize)
+
+    return (write_manifest(manifest_path, entries, timing))
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+import warnings
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+import src.data.instrument as instrument
+
+FLOWS = ['production', 'consumption', 'exports']
+
+# producer quantities as dense (country x crop year) arrays in 1k bags
+#   countries:  country of each row
+#   first_year: crop_year_beg of the first column
+#   openstock, production, consumption, exports: float64 arrays, NaN where a country
+#               has no data for a crop year
+StockPanel = namedtuple(
+    'StockPanel',
+    ['countries', 'first_year', 'openstock', 'production', 'consumption', 'exports']
+)
+
+
+def panel(df):
+    """ Lay producer crop year data out as a StockPanel
+        df: table with country, crop_year_beg and the openstock, production, consumption and
+            exports measures (e.g. producer_cropyear)
+    """
+    rows, countries = pd.factorize(df['country'], sort=True)
+    years = df['crop_year_beg'].to_numpy().astype('int64')
+    first_year = int(years.min())
+    cols = years - first_year
+    shape = (len(countries), int(years.max()) - first_year + 1)
+
+    arrays = {}
+    for measure in ['openstock'] + FLOWS:
+        values = np.full(shape, np.nan)
+        values[rows, cols] = df.units.get(measure, '1k_bags').to_numpy(dtype='float64')
+        arrays[measure] = values
+    return (StockPanel(list(countries), first_year, **arrays))
+
+
+def roll_forward(stocks):
+    """ Closing stock, assumed imports and stock adjustment of every country and crop year
+        at once
+        stocks: StockPanel
+
+        closing stock is opening stock plus production, less consumption and exports, floored
+        at 0; the shortfall is the imports assumed to cover it; the adjustment is next crop
+        year's opening stock less the closing stock
+    """
+    raw_close = \
+        np.round(stocks.openstock + stocks.production - stocks.consumption - stocks.exports, 2)
+    close = np.fmax(0, raw_close)
+    open_next = np.full_like(stocks.openstock, np.nan)
+    open_next[:, :-1] = stocks.openstock[:, 1:]
+    return ({
+        'closestock': close,
+        'imports': np.where(raw_close < 0, 0 - raw_close, 0),
+        'stock_adj': open_next - close
+    })
+
+
+def carry_forward(opening, net):
+    """ Run close_t = max(0, close_t-1 + net_t) along the last axis for every leading index
+        at once
+        opening: array of opening stocks
+        net: array of net flows (production - consumption - exports), one more trailing
+             (year) axis than opening
+
+        returns (closing stocks, shortfall clipped each year); uses the closed form
+        close_t = S_t - min(-opening, min_k<=t S_k) of the cumulative net flow S
+    """
+    cumulative = np.cumsum(net, axis=-1)
+    floor = np.minimum(-opening[..., None], np.minimum.accumulate(cumulative, axis=-1))
+    close = cumulative - floor
+    previous = np.concatenate([opening[..., None], close[..., :-1]], axis=-1)
+    return (close, np.fmax(0, -(previous + net)))
+
+
+def baseline_flows(stocks, years, window=5, growth=None):
+    """ Projected (country x year) flows: the mean of the last `window` observed crop years,
+        grown at a constant annual rate
+        stocks: StockPanel
+        years: number of crop years to project
+        window: observed crop years averaged
+        growth: dict of flow -> annual growth rate (default 0)
+    """
+    growth = growth or {}
+    horizon = np.arange(1, years + 1)
+    flows = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for flow in FLOWS:
+            base = np.nanmean(getattr(stocks, flow)[:, -window:], axis=1)
+            flows[flow] = base[:, None] * (1 + growth.get(flow, 0.0)) ** horizon
+    return (flows)
+
+
+@instrument.instrumented
+def project(stocks, years=10, window=5, growth=None):
+    """ Project closing stocks forward from the last observed crop year
+        stocks: StockPanel
+        years: number of crop years to project
+        window: observed crop years averaged into the baseline flows
+        growth: dict of flow -> annual growth rate
+
+        returns dict of closestock, imports and the projected flows, (country x year) each
+    """
+    opening = roll_forward(stocks)['closestock'][:, -1]
+    flows = baseline_flows(stocks, years, window, growth)
+    net = flows['production'] - flows['consumption'] - flows['exports']
+    close, shortfall = carry_forward(opening, net)
+    return ({'closestock': close, 'imports': shortfall, **flows})
+
+
+@instrument.instrumented
+def simulate(stocks, years=10, scenarios=1000, production_sd=0.1, consumption_sd=0.03,
+             window=5, growth=None, seed=0, batch_size=1000):
+    """ Closing stocks under randomly perturbed production and consumption
+        stocks: StockPanel
+        years: number of crop years to project
+        scenarios: number of scenarios
+        production_sd, consumption_sd: standard deviation of the yearly multiplicative
+            shocks (lognormal with mean 1)
+        window, growth: baseline flows, see baseline_flows
+        seed: random seed
+        batch_size: scenarios evaluated per array operation, bounding temporary memory
+
+        returns a (scenario x country x year) array of closing stocks
+    """
+    rng = np.random.default_rng(seed)
+    opening = roll_forward(stocks)['closestock'][:, -1]
+    flows = baseline_flows(stocks, years, window, growth)
+    closing = np.empty((scenarios,) + flows['production'].shape)
+    for start in range(0, scenarios, batch_size):
+        n = min(batch_size, scenarios - start)
+        shape = (n,) + flows['production'].shape
+        production = \
+            flows['production'] * rng.lognormal(-production_sd ** 2 / 2, production_sd, shape)
+        consumption = \
+            flows['consumption'] * rng.lognormal(-consumption_sd ** 2 / 2, consumption_sd, shape)
+        net = production - consumption - flows['exports']
+        closing[start:start + n], _ = carry_forward(np.broadcast_to(opening, (n,) + opening.shape),
+                                                    net)
+    return (closing)
+
+
+def to_frame(stocks, columns, first_year):
+    """ Long (country, crop year) table of (country x year) arrays
+        stocks: StockPanel
+        columns: dict of column -> (country x year) array
+        first_year: crop_year_beg of the first array column
+    """
+    n_countries, n_years = next(iter(columns.values())).shape
+    beg = np.tile(np.arange(first_year, first_year + n_years), n_countries)
+    frame = pd.DataFrame({
+        'country': np.repeat(stocks.countries, n_years),
+        'crop_year': [f'{y}/{str(y + 1)[2:]}' for y in beg],
+        'crop_year_beg': beg,
+        'crop_year_end': beg + 1
+    })
+    return (frame.assign(**{column: values.ravel() for column, values in columns.items()}))
+
+
+def projection_table(stocks, years=10, scenarios=1000, quantiles=(0.05, 0.5, 0.95), **kwargs):
+    """ Baseline projection with scenario quantiles and stock-out probabilities
+        stocks: StockPanel
+        years: number of crop years to project
+        scenarios: number of simulated scenarios
+        quantiles: closing stock quantiles reported across scenarios
+        kwargs: passed to simulate
+    """
+    baseline = project(stocks, years, kwargs.get('window', 5), kwargs.get('growth'))
+    closing = simulate(stocks, years, scenarios, **kwargs)
+    columns = {
+        f'{name}_1k_bags': baseline[name]
+        for name in ['production', 'consumption', 'exports', 'closestock', 'imports']
+    }
+    for q, values in zip(quantiles, np.quantile(closing, quantiles, axis=0)):
+        columns[f'closestock_p{round(q * 100):02d}_1k_bags'] = values
+    columns['stockout_probability'] = (closing <= 0).mean(axis=0)
+    first_year = stocks.first_year + stocks.openstock.shape[1]
+    return (to_frame(stocks, columns, first_year))
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+import calendar
+import os
+import numpy as np
+import openpyxl
+import pandas as pd
+import src.data.ico_sheet as ico_sheet
+import src.data.pipeline as pipeline
+
+FIRST_YEAR = 1990
+N_YEARS = 30
+FOOTER = '© International Coffee Organization'
+
+HARVEST_GROUPS = ['April', 'July', 'October']
+
+# base row labels at 1x scale, sized like the current ICO release; names the pipeline maps
+# or splits (Belgium/Luxembourg, China, former countries) are kept so those paths run
+PRODUCERS = list(pipeline.PRODUCER_COUNTRY_MAP) + [f'Producer {i:02d}' for i in range(51)]
+EU_MEMBERS = ['Austria', 'Belgium', 'Belgium/Luxembourg', 'Luxembourg'] + \
+    [f'EU member {i:02d}' for i in range(23)]
+OTHER_MEMBERS = ['Japan', 'Norway', 'Switzerland', 'United States of America'] + \
+    [f'Member {i:02d}' for i in range(3)]
+NON_MEMBERS = {
+    region: [f'{region} {i:02d}' for i in range(15)] for region in ico_sheet.REGIONS
+}
+NON_MEMBERS['Europe'] += ['USSR', 'Yugoslavia SFR']
+NON_MEMBERS['Caribbean'] += ['Netherlands Antilles (former)']
+CHINA = ["China, People's Republic of", 'China (Mainland)', 'Hong Kong', 'Macao']
+GROWER_CATEGORIES = ['Colombian Milds', 'Other Milds', 'Brazilian Naturals', 'Robustas']
+INDICATORS = ['ICO composite indicator', 'Colombian\n Milds', 'Other Milds',
+              'Brazilian\n Naturals', 'Robustas']
+
+# raw workbook file -> layout it is generated with
+WORKBOOKS = {
+    '1a - Total production.xlsx': 'producer',
+    '1b - Domestic consumption.xlsx': 'producer',
+    '1d - Gross Opening stocks.xlsx': 'producer',
+    '1e - Exports - crop year.xlsx': 'producer',
+    '2a - Exports - calendar year.xlsx': 'exports',
+    '2b - Imports.xlsx': 'importer',
+    '2c - Re-exports.xlsx': 'importer',
+    '3a - Prices paid to growers.xlsx': 'grower',
+    '3b - Retail prices.xlsx': 'retail',
+    '3c - Indicator prices.xlsx': 'indicator',
+    '5a - Non-member imports.xlsx': 'non_member',
+    '5b - Non-member re-exports.xlsx': 'non_member'
+}
+
+
+def replicate(names, scale):
+    """ Row labels at a scale: the base names, then numbered copies of them
+        names: base labels
+        scale: number of copies
+
+        copies are numbered 'name (k)', which cannot be read as a footnote marker
+    """
+    return ([name if k == 0 else f'{name} ({k})' for k in range(scale) for name in names])
+
+
+def years():
+    """ Calendar years covered by the synthetic sheets
+    """
+    return (list(range(FIRST_YEAR, FIRST_YEAR + N_YEARS)))
+
+
+def quantities(rng, n, scale=500.0):
+    """ (n x years) block of positive quantities rounded like the ICO data
+    """
+    return (rng.gamma(2.0, scale, size=(n, N_YEARS)).round(4))
+
+
+def producer_rows(rng, scale):
+    """ Country rows under April/July/October harvest group rows, then a total row
+    """
+    names = np.array(replicate(PRODUCERS, scale), dtype=object)
+    values = quantities(rng, len(names))
+    groups = np.arange(len(names)) % len(HARVEST_GROUPS)
+    rows = []
+    for g, group in enumerate(HARVEST_GROUPS):
+        members = groups == g
+        rows.append([f'{group} group', None] + values[members].sum(axis=0).tolist())
+        rows.extend(
+            [name, '(A)'] + v for name, v in zip(names[members], values[members].tolist())
+        )
+    rows.append(['Total', None] + values.sum(axis=0).tolist())
+    return (['Crop year', None] + [f'{y}/{str(y + 1)[2:]}' for y in years()], rows)
+
+
+def exports_rows(rng, scale):
+    """ Calendar year exports: country rows and a total row
+    """
+    names = replicate(PRODUCERS, scale)
+    values = quantities(rng, len(names))
+    rows = [[name] + v for name, v in zip(names, values.tolist())]
+    rows.append(['Total'] + values.sum(axis=0).tolist())
+    return (['Calendar years'] + [str(y) for y in years()], rows)
+
+
+def importer_rows(rng, scale):
+    """ European Union aggregate over indented members, including Belgium and Luxembourg
+        reported jointly before 1999, then the other members and a total row
+    """
+    eu = replicate(EU_MEMBERS, scale)
+    others = replicate(OTHER_MEMBERS, scale)
+    values = quantities(rng, len(eu) + len(others), 2000.0)
+    split = 1999 - FIRST_YEAR
+    rows = [['European Union'] + values[:len(eu)].sum(axis=0).tolist()]
+    for name, v in zip(eu, values[:len(eu)].tolist()):
+        if name in ('Belgium', 'Luxembourg'):
+            v = [None] * split + v[split:]
+        elif name == 'Belgium/Luxembourg':
+            v = v[:split] + [None] * (N_YEARS - split)
+        rows.append([f'   {name}'] + v)
+    rows.extend([name] + v for name, v in zip(others, values[len(eu):].tolist()))
+    rows.append(['Total'] + values.sum(axis=0).tolist())
+    return (['Calendar years'] + [str(y) for y in years()], rows)
+
+
+def non_member_rows(rng, scale):
+    """ Country rows under region rows, with the China aggregate over its indented parts
+    """
+    rows = []
+    totals = np.zeros(N_YEARS)
+    for region, base in NON_MEMBERS.items():
+        names = replicate(base, scale)
+        values = quantities(rng, len(names), 50.0)
+        rows.append([region] + values.sum(axis=0).tolist())
+        rows.extend([name] + v for name, v in zip(names, values.tolist()))
+        if region == 'Asia & Oceania':
+            parts = quantities(rng, len(CHINA) - 1, 50.0)
+            rows.append([CHINA[0]] + parts.sum(axis=0).tolist())
+            rows.extend([f'   {name}'] + v for name, v in zip(CHINA[1:], parts.tolist()))
+        totals += values.sum(axis=0)
+    rows.append(['Total'] + totals.tolist())
+    return (['Calendar years'] + [str(y) for y in years()], rows)
+
+
+def grower_rows(rng, scale):
+    """ Grower prices by indicator category, with a blank separator row
+    """
+    rows = []
+    for category in GROWER_CATEGORIES:
+        names = replicate([f'{category} grower {i:02d}' for i in range(12)], scale)
+        values = rng.uniform(20, 200, size=(len(names), N_YEARS)).round(4)
+        rows.append([category])
+        rows.extend([name] + v for name, v in zip(names, values.tolist()))
+        rows.append([' '])
+    return (['Calendar years'] + years(), rows)
+
+
+def retail_rows(rng, scale):
+    """ Retail prices for member importers with a footnote row
+    """
+    names = [f'   {name}' for name in replicate(EU_MEMBERS, scale)] + \
+        replicate(OTHER_MEMBERS, scale)
+    values = rng.uniform(2, 12, size=(len(names), N_YEARS)).round(4)
+    rows = [['European Union']] + [[name] + v for name, v in zip(names, values.tolist())]
+    rows.append(['1 Soluble coffee'])
+    return (['Calendar years'] + years(), rows)
+
+
+def indicator_rows(rng, scale):
+    """ Annual average rows, each followed by its twelve monthly rows; scale adds indicators
+    """
+    indicators = replicate(INDICATORS, scale)
+    rows = []
+    for year in years():
+        months = rng.uniform(40, 250, size=(12, len(indicators))).round(2)
+        rows.append([str(year)] + months.mean(axis=0).round(2).tolist())
+        rows.extend([calendar.month_name[m + 1]] + v for m, v in enumerate(months.tolist()))
+    return ([None] + indicators, rows)
+
+
+BUILDERS = {
+    'producer': producer_rows,
+    'exports': exports_rows,
+    'importer': importer_rows,
+    'non_member': non_member_rows,
+    'grower': grower_rows,
+    'retail': retail_rows,
+    'indicator': indicator_rows
+}
+
+
+def write_workbook(path, title, header, rows):
+    """ Write an ICO-layout sheet: title, unit and header rows, the body, then the footer
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    for row in [[title], ['In thousand 60kg bags'], header] + rows + [[FOOTER]]:
+        ws.append(row)
+    wb.save(path)
+
+
+def population_csv(path, labels):
+    """ Write a UN WPP-shaped population file covering every label the sheets join on
+        path: csv to write
+        labels: row labels of the synthetic sheets
+    """
+    names = {label.strip() for label in labels}
+    for country_map in [pipeline.PRODUCER_COUNTRY_MAP, pipeline.IMPORTER_COUNTRY_MAP]:
+        names.update(country_map.get(name, name) for name in list(names))
+    for rule in pipeline.POPULATION_AGGREGATES:
+        names.update(rule.components)
+    names = sorted(names)
+    span = np.arange(FIRST_YEAR - 1, FIRST_YEAR + N_YEARS + 2)
+    base = np.linspace(100, 100000, len(names))
+    pd.DataFrame({
+        'Location': np.repeat(names, len(span)),
+        'Time': np.tile(span, len(names)),
+        'TPopulation1Jan': np.repeat(base, len(span)) * np.tile(1.01 ** (span - span[0]),
+                                                                len(names)),
+    }).assign(TPopulation1July=lambda x: x.TPopulation1Jan * 1.005) \
+        .round(3) \
+        .to_csv(path, index=False)
+
+
+def generate(folder, scale=1, seed=0):
+    """ Write a synthetic ICO release shaped like the real workbooks
+        folder: output folder; workbooks go to {folder}/raw, population to {folder}/external
+        scale: multiple of the real number of countries (indicators for the price sheet)
+        seed: random seed
+
+        returns the (raw, external) folders
+    """
+    raw, external = f'{folder}/raw', f'{folder}/external'
+    os.makedirs(raw, exist_ok=True)
+    os.makedirs(external, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    labels = []
+    for file_name, kind in WORKBOOKS.items():
+        header, rows = BUILDERS[kind](rng, scale)
+        title = file_name[len('1a - '):-len('.xlsx')]
+        write_workbook(f'{raw}/{file_name}', title, header, rows)
+        labels.extend(row[0] for row in rows if isinstance(row[0], str))
+    population_csv(f'{external}/{pipeline.POPULATION_FILE}', labels)
+    return (raw, external)
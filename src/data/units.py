@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import functools
+import hashlib
+import inspect
+import sys
+import numpy as np
+import pandas as pd
+import src.data.schema as schema
+
+CANONICAL = '1k_bags'
+SCALES = ['1k_bags', 'kg', 'lb']
+
+
+@functools.lru_cache(maxsize=None)
+def version():
+    """ Hash of the unit conversion code; stage keys and written outputs follow its changes
+    """
+    source = inspect.getsource(sys.modules[__name__]) + inspect.getsource(schema.from_fixed_point)
+    return (hashlib.sha256(source.encode('utf-8')).hexdigest())
+
+
+def convert(values, scale):
+    """ Convert quantities in thousands of 60kg bags to another scale
+        values: array or Series in 1k bags
+        scale: scale to convert to (1k_bags, kg, lb)
+    """
+    if scale == '1k_bags':
+        return (values)
+    kg = values * 1000 * 60
+    if scale == 'kg':
+        return (kg)
+    if scale == 'lb':
+        return (kg * 2.20462262185)
+    raise ValueError(f'Unrecognized scale: {scale}')
+
+
+@pd.api.extensions.register_dataframe_accessor('units')
+class UnitsAccessor:
+    """ Quantities stored once as '<measure>_1k_bags' with kg/lb derived on demand
+    """
+
+    def __init__(self, df):
+        self._df = df
+
+    def measures(self):
+        """ Measures stored on the canonical scale
+        """
+        suffix = f'_{CANONICAL}'
+        return ([
+            col[:-len(suffix)] for col in self._df.columns
+            if isinstance(col, str) and col.endswith(suffix)
+        ])
+
+    def get(self, measure, scale):
+        """ A measure on any scale, read directly when stored and converted otherwise
+            measure: measure name, e.g. 'production'
+            scale: scale for the values (1k_bags, kg, lb)
+        """
+        col = f'{measure}_{scale}'
+        if col in self._df.columns:
+            return (schema.from_fixed_point(self._df[col]))
+        return (convert(schema.from_fixed_point(self._df[f'{measure}_{CANONICAL}']), scale))
+
+    def block(self, measure):
+        """ (rows x scales) array of a measure on every scale
+            measure: measure name
+        """
+        return (np.column_stack([self.get(measure, scale).to_numpy() for scale in SCALES]))
+
+    def expand(self):
+        """ Materialize every derived scale next to its canonical column, for writing;
+            fixed-point quantities are written as floats
+        """
+        df = self._df
+        missing = [
+            f'{measure}_{scale}' for measure in self.measures() for scale in SCALES[1:]
+            if f'{measure}_{scale}' not in df.columns
+        ]
+        fixed = [
+            f'{measure}_{CANONICAL}' for measure in self.measures()
+            if schema.is_fixed_point(df[f'{measure}_{CANONICAL}'])
+        ]
+        if not missing and not fixed:
+            return (df)
+        cols = {}
+        for col in df.columns:
+            cols[col] = df[col]
+            if isinstance(col, str) and col.endswith(f'_{CANONICAL}'):
+                measure = col[:-len(f'_{CANONICAL}')]
+                cols[col] = self.get(measure, CANONICAL)
+                for scale in SCALES[1:]:
+                    if f'{measure}_{scale}' not in df.columns:
+                        cols[f'{measure}_{scale}'] = convert(cols[col], scale)
+        return (pd.DataFrame(cols, index=df.index))
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import time
+import src.data.ingest as ingest
+import src.data.stages as stages
+
+logger = logging.getLogger(__name__)
+
+
+def watched_files(stage_list, input_filepath, external_filepath):
+    """ Input files of a build: the raw workbooks and the external files its stages read
+        stage_list: list of stages.Stage
+        input_filepath: raw workbook folder
+        external_filepath: external data folder
+
+        the raw folder is listed on every call, so a workbook dropped in is picked up; caches
+        written next to the inputs (the filtered population table) are not watched
+    """
+    external = sorted({
+        os.path.join(external_filepath, file_name)
+        for stage in stage_list for file_name in stage.external.values()
+    })
+    return (list(ingest.source_files(input_filepath).values()) + external)
+
+
+def snapshot(paths):
+    """ Stat signature of every file that exists among some paths
+        paths: files to watch
+
+        returns a dict of path -> (modification time in ns, size)
+    """
+    files = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        files[path] = (stat.st_mtime_ns, stat.st_size)
+    return (files)
+
+
+def changed_files(before, after):
+    """ Files added, removed or modified between two snapshots
+    """
+    return (sorted(
+        path for path in set(before) | set(after) if before.get(path) != after.get(path)
+    ))
+
+
+def wait_for_change(files, before, interval=1.0):
+    """ Poll the input files until one changes and they then stay unchanged for one interval
+        files: function returning the files to watch (see watched_files)
+        before: snapshot the last build started from
+        interval: seconds between polls
+
+        waiting for the files to settle lets a workbook being copied in be written out before
+        it is read
+
+        returns (settled snapshot, changed files)
+    """
+    current = snapshot(files())
+    while current == before:
+        time.sleep(interval)
+        current = snapshot(files())
+    while True:
+        time.sleep(interval)
+        settled = snapshot(files())
+        if settled == current:
+            return (current, changed_files(before, current))
+        current = settled
+
+
+def rebuild(build, warm):
+    """ Run one build and log its latency and the stages that ran
+        build: function of a stages.Warm state running the stages (see stages.run_stages)
+        warm: stages.Warm state
+
+        a failed build (a workbook saved half way, say) is logged rather than raised; the
+        outputs are only swapped in when a build finishes, so the last ones stay in place
+
+        returns the build manifest, or None when the build failed
+    """
+    start = time.perf_counter()
+    try:
+        manifest = build(warm)
+    except Exception:
+        logger.exception('build failed after %.2fs; keeping the previous outputs',
+                         time.perf_counter() - start)
+        return (None)
+    status = {
+        state: ', '.join(name for name, entry in manifest['stages'].items()
+                         if entry['status'] == state) or 'none'
+        for state in ['ran', 'restored']
+    }
+    logger.info('built in %.2fs; ran: %s; restored: %s', time.perf_counter() - start,
+                status['ran'], status['restored'])
+    return (manifest)
+
+
+def watch(build, stage_list, input_filepath, external_filepath, interval=1.0,
+          max_builds=None):
+    """ Stay resident and rebuild whenever an input file of the stages changes
+        build: function of a stages.Warm state running the stages (see stages.run_stages)
+        stage_list: list of stages.Stage the build runs
+        input_filepath: raw workbook folder
+        external_filepath: external data folder
+        interval: seconds between polls
+        max_builds: rebuilds to run before returning (default: until interrupted)
+
+        the first build fills the warm state with every parsed workbook and stage output;
+        a rebuild then hashes and parses only the changed files and reruns only the stages
+        whose inputs changed, taking everything else from memory
+    """
+    def files():
+        return (watched_files(stage_list, input_filepath, external_filepath))
+
+    warm = stages.warm_state()
+    before = snapshot(files())
+    rebuild(build, warm)
+    logger.info('watching %d files in %s and %s every %.1fs', len(before), input_filepath,
+                external_filepath, interval)
+    builds = 0
+    try:
+        while max_builds is None or builds < max_builds:
+            before, changed = wait_for_change(files, before, interval)
+            logger.info('changed: %s', ', '.join(os.path.basename(path) for path in changed))
+            rebuild(build, warm)
+            builds += 1
+    except KeyboardInterrupt:
+        logger.info('stopped watching')